@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""Benchmark of the EngineLog: the list it used to be (timestamp string and dict per add,
+del [0] per trim, full copy per read) vs. the ring buffer with sequence numbers and indexes
+
+After every POLL_EVERY adds, a poller asks for the new trigger_fired entries of one rule,
+as the UI would with /rest/logs?since=&type=&rule=. The list has to be copied and filtered.
+
+    python benchmarks/bench_enginelog.py
+"""
+import time
+
+from ottoengine import enginelog, helpers
+
+MAX_LOGS = [100, 10000, 100000]
+NUM_ADDS = 200000
+NUM_RULES = 50
+POLL_EVERY = 100
+
+
+class _ListEngineLog(object):
+
+    def __init__(self, max_logs):
+        self._log = []
+        self._max_logs = max_logs
+
+    def add(self, logtype, logentry, rule_id=None):
+        self._log.append({
+            "ts": str(helpers.nowutc()),
+            "type": logtype,
+            "entry": logentry,
+        })
+        while len(self._log) > self._max_logs:
+            del self._log[0]
+
+    def get_logs(self):
+        return self._log.copy()
+
+
+def _entries():
+    types = [enginelog.TRIGGER_FIRED, enginelog.CONDITION_PASSED, enginelog.RULE_COMPLETED]
+    return [
+        (types[i % 3], {"rule": "rule_{}".format(i % NUM_RULES)}, "rule_{}".format(i % NUM_RULES))
+        for i in range(NUM_ADDS)
+    ]
+
+
+def _run(log, entries, poll):
+    """Returns (secs per add, secs per poll)"""
+    add_secs = 0
+    poll_secs = 0
+    for i in range(0, NUM_ADDS, POLL_EVERY):
+        start = time.perf_counter()
+        for logtype, entry, rule_id in entries[i:i + POLL_EVERY]:
+            log.add(logtype, entry, rule_id=rule_id)
+        mid = time.perf_counter()
+        poll(log)
+        add_secs += mid - start
+        poll_secs += time.perf_counter() - mid
+    return add_secs / NUM_ADDS, poll_secs / (NUM_ADDS // POLL_EVERY)
+
+
+def _poll_list(log):
+    return [
+        e for e in log.get_logs()
+        if e["type"] == enginelog.TRIGGER_FIRED and e["entry"]["rule"] == "rule_7"
+    ]
+
+
+class _RingPoller(object):
+    """Asks only for the entries after the last one it has seen"""
+
+    def __init__(self):
+        self.since = 0
+
+    def __call__(self, log):
+        logs = log.get_logs(since=self.since, logtype=enginelog.TRIGGER_FIRED, rule_id="rule_7")
+        self.since = log.last_seq
+        return logs
+
+
+def main():
+    entries = _entries()
+    print("{:>9} {:>13} {:>13} {:>14} {:>14}".format(
+        "max_logs", "list add us", "ring add us", "list poll us", "ring poll us"))
+    for max_logs in MAX_LOGS:
+        list_add, list_poll = _run(_ListEngineLog(max_logs), entries, _poll_list)
+        ring_add, ring_poll = _run(enginelog.EngineLog(max_logs), entries, _RingPoller())
+        print("{:>9} {:>13.2f} {:>13.2f} {:>14.1f} {:>14.1f}".format(
+            max_logs, list_add * 1e6, ring_add * 1e6, list_poll * 1e6, ring_poll * 1e6))
+
+
+if __name__ == "__main__":
+    main()
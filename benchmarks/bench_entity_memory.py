@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""Benchmark of resident memory per entity in OttoEngineState: the previous EntityState
+(with a __dict__ and its own strings and attributes) vs. the compact __slots__ version
+with interned strings and shared attribute dicts
+
+    python benchmarks/bench_entity_memory.py
+"""
+import gc
+import json
+import tracemalloc
+
+from ottoengine import state
+from ottoengine.model import dataobjects
+
+NUM_ENTITIES = [5000, 20000]
+SHARED_ATTRIBUTES_PCT = 40      # Entities whose attributes are identical to others'
+STATES = ["on", "off", "unavailable", "home", "not_home"]
+
+
+class _LegacyEntityState(object):
+    """EntityState as it was before __slots__ and interning"""
+
+    def __init__(self, entity_id, state, attributes, last_changed, friendly_name=None,
+                 hidden=False):
+        self.entity_id = entity_id
+        self.state = state
+        self.attributes = attributes
+        self._last_changed = last_changed
+        self.friendly_name = friendly_name
+        self._numeric_state = None
+        self.hidden = False if hidden is None else hidden
+
+
+def _get_states_json(num_entities):
+    result = []
+    for i in range(num_entities):
+        if i % 100 < SHARED_ATTRIBUTES_PCT:
+            attributes = {"device_class": "motion", "icon": "mdi:motion-sensor"}
+        else:
+            attributes = {"friendly_name": "Entity {}".format(i), "unit_of_measurement": "C"}
+        result.append({
+            "entity_id": "sensor.entity_{}".format(i),
+            "state": STATES[i % len(STATES)],
+            "attributes": attributes,
+            "last_changed": "2018-05-06T01:09:25.307187+00:00",
+            "last_updated": "2018-05-06T01:09:25.307187+00:00"
+        })
+    return json.dumps(result)
+
+
+def _measure(raw, build):
+    """Bytes still allocated by build() once the decoded message has been freed"""
+    gc.collect()
+    tracemalloc.start()
+    store = build(json.loads(raw))
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del store
+    return size
+
+
+def _build_legacy(state_dicts):
+    store = {}
+    for state_dict in state_dicts:
+        store[state_dict["entity_id"]] = _LegacyEntityState(
+            state_dict["entity_id"], state_dict["state"], state_dict["attributes"],
+            state_dict["last_changed"], state_dict["attributes"].get("friendly_name"))
+    return store
+
+
+def _build_compact(state_dicts):
+    store = state.OttoEngineState()
+    for state_dict in state_dicts:
+        store.set_entity_state(state_dict["entity_id"], dataobjects.EntityState(
+            state_dict["entity_id"], state_dict["state"], state_dict["attributes"],
+            state_dict["last_changed"], state_dict["attributes"].get("friendly_name")))
+    return store
+
+
+def main():
+    print("{:>9} {:>14} {:>15} {:>8}".format("entities", "legacy B/ent", "compact B/ent",
+                                            "saved"))
+    for num_entities in NUM_ENTITIES:
+        raw = _get_states_json(num_entities)
+        legacy = _measure(raw, _build_legacy) / num_entities
+        compact = _measure(raw, _build_compact) / num_entities
+        print("{:>9} {:>14.0f} {:>15.0f} {:>7.0f}%".format(
+            num_entities, legacy, compact, (1 - compact / legacy) * 100))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+"""Benchmark of EventTrigger matching with hundreds of rules on one event_type:
+EventListenerIndex vs. evaluating every listener's trigger
+
+    python benchmarks/bench_event_index.py
+"""
+import timeit
+
+from ottoengine import listener_index
+from ottoengine.model import dataobjects, rule_objects, trigger_objects
+
+EVENT_TYPE = "zwave.scene_activated"
+NUM_RULES = [100, 500, 2000]
+NUMBER = 2000
+
+
+def _build_listeners(num_rules):
+    listeners = []
+    for i in range(num_rules):
+        trigger = trigger_objects.EventTrigger(
+            EVENT_TYPE, {"entity_id": "zwave.remote_{}".format(i % 50), "scene_id": i})
+        listeners.append(
+            rule_objects.HassListener(rule_objects.AutomationRule(str(i)), trigger))
+    return listeners
+
+
+def main():
+    print("{:>8} {:>12} {:>12} {:>8}".format("rules", "linear us", "indexed us", "speedup"))
+    for num_rules in NUM_RULES:
+        listeners = _build_listeners(num_rules)
+        index = listener_index.EventListenerIndex()
+        for listener in listeners:
+            index.add(listener)
+
+        event = dataobjects.HassEvent(
+            EVENT_TYPE, {"entity_id": "zwave.remote_7", "scene_id": 57}, None)
+
+        def _linear():
+            return [listener for listener in listeners if listener.trigger.eval_trigger(event)]
+
+        assert [listener.rule.id for listener in _linear()] == \
+            [listener.rule.id for listener in index.match(event)]
+
+        linear_secs = timeit.timeit(_linear, number=NUMBER)
+        indexed_secs = timeit.timeit(lambda: index.match(event), number=NUMBER)
+        print("{:>8} {:>12.1f} {:>12.1f} {:>7.1f}x".format(
+            num_rules,
+            linear_secs / NUMBER * 1e6,
+            indexed_secs / NUMBER * 1e6,
+            linear_secs / indexed_secs))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""Benchmark of state_changed events/sec through _process_event_response: timestamps
+parsed eagerly with dateutil (as before), with the fast ISO-8601 parser, and left lazy
+
+    python benchmarks/bench_event_parsing.py
+"""
+import asyncio
+import timeit
+
+import dateutil.parser
+
+from ottoengine import helpers, state
+from ottoengine.fibers import hass_websocket_reader
+from ottoengine.testing import websocket_helpers
+
+NUM_EVENTS = 5000
+REPEAT = 5
+
+
+class _Engine(object):
+    """Stands in for OttoEngine, optionally reading every timestamp like the old code did"""
+
+    def __init__(self, read_timestamps):
+        self.read_timestamps = read_timestamps
+        self.states = state.OttoEngineState()
+
+    def process_event(self, event):
+        if self.read_timestamps:
+            event.time_fired
+            event.old_state_obj.last_changed
+            event.new_state_obj.last_changed
+
+
+def main():
+    loop = asyncio.get_event_loop()
+    msgs = [
+        websocket_helpers.event_state_changed(i, "sensor.sensor_{}".format(i % 100), "20", "21")
+        for i in range(NUM_EVENTS)
+    ]
+    fast_parser = helpers.parse_iso8601
+
+    async def _replay(engine_obj):
+        for msg in msgs:
+            await hass_websocket_reader._process_event_response(engine_obj, msg)
+
+    variants = [
+        ("eager dateutil (before)", dateutil.parser.parse, True),
+        ("eager fast parser", fast_parser, True),
+        ("lazy (unread)", fast_parser, False),
+    ]
+    print("{:>24} {:>12}".format("", "events/sec"))
+    for name, parse, read_timestamps in variants:
+        helpers.parse_iso8601 = parse
+        try:
+            engine_obj = _Engine(read_timestamps)
+            secs = min(timeit.repeat(
+                lambda: loop.run_until_complete(_replay(engine_obj)), number=1, repeat=REPEAT))
+        finally:
+            helpers.parse_iso8601 = fast_parser
+        print("{:>24} {:>12,.0f}".format(name, NUM_EVENTS / secs))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""Benchmark of the on-disk engine log: what EngineLog.add() costs the event loop with a
+LogSink attached, and LogReader queries (binary search and rule id search on mmapped
+segments) vs. decoding every line
+
+Entries are added in bursts of BURST with IDLE_SECS between them, as rules fire on the loop;
+only the time spent in add() is counted.
+
+    python benchmarks/bench_log_sink.py
+"""
+import json
+import tempfile
+import time
+
+from ottoengine import enginelog, log_sink
+
+NUM_ENTRIES = 200000
+NUM_RULES = 200
+SEGMENT_BYTES = 8 * 1024 * 1024
+BURST = 1000
+IDLE_SECS = 0.01
+
+
+def _add_entries(englog):
+    types = [enginelog.TRIGGER_FIRED, enginelog.CONDITION_PASSED, enginelog.RULE_COMPLETED]
+    add_secs = 0
+    for burst_start in range(0, NUM_ENTRIES, BURST):
+        start = time.perf_counter()
+        for i in range(burst_start, burst_start + BURST):
+            rule_id = "rule_{}".format(i % NUM_RULES)
+            englog.add(types[i % 3], {"rule": rule_id, "i": i}, rule_id=rule_id)
+        add_secs += time.perf_counter() - start
+        time.sleep(IDLE_SECS)
+    return add_secs
+
+
+def _scan_all(log_dir, start_ts, end_ts, rule_id):
+    records = []
+    for path in log_sink.list_segments(log_dir):
+        with open(path) as f:
+            for line in f:
+                record = json.loads(line)
+                if start_ts <= record["ts"] <= end_ts and record["rule"] == rule_id:
+                    records.append(record)
+    return records
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main():
+    with tempfile.TemporaryDirectory() as log_dir:
+        plain_secs = _add_entries(enginelog.EngineLog())
+
+        sink = log_sink.LogSink(log_dir, segment_bytes=SEGMENT_BYTES, max_segments=100)
+        sink.start()
+        sink_secs = _add_entries(enginelog.EngineLog(sink=sink))
+        start = time.perf_counter()
+        sink.close(timeout=60)
+        drain_secs = time.perf_counter() - start
+        stats = sink.get_stats()
+
+        print("add() without sink {:.2f} us, with sink {:.2f} us".format(
+            plain_secs / NUM_ENTRIES * 1e6, sink_secs / NUM_ENTRIES * 1e6))
+        print("{} written, {} dropped in {} segments, {:.0f} ms left to drain at close".format(
+            stats["written"], stats["dropped"], len(log_sink.list_segments(log_dir)),
+            drain_secs * 1000))
+
+        reader = log_sink.LogReader(log_dir)
+        everything = reader.query()
+        first_ts = everything[0]["ts"]
+        last_ts = everything[-1]["ts"]
+        span = last_ts - first_ts
+
+        print("{:>28} {:>8} {:>10} {:>10}".format("query", "results", "mmap ms", "scan ms"))
+        queries = [
+            ("last 1% of time, one rule", first_ts + span * 0.99, last_ts, "rule_7"),
+            ("middle 10%, one rule", first_ts + span * 0.45, first_ts + span * 0.55, "rule_7"),
+            ("all time, one rule", first_ts, last_ts, "rule_7"),
+        ]
+        for name, start_ts, end_ts, rule_id in queries:
+            records, mmap_ms = _timed(reader.query, start_ts, end_ts, rule_id)
+            scanned, scan_ms = _timed(_scan_all, log_dir, start_ts, end_ts, rule_id)
+            assert len(records) == len(scanned)
+            print("{:>28} {:>8} {:>10.1f} {:>10.1f}".format(
+                name, len(records), mmap_ms, scan_ms))
+
+
+if __name__ == "__main__":
+    main()
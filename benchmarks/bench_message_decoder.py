@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""Replay benchmark of websocket frame decoding: stdlib json.loads on every frame (the
+old HassWebSocketReader path) vs. MessageDecoder with each available JSON backend
+
+    python benchmarks/bench_message_decoder.py
+"""
+import json
+import random
+import timeit
+
+from ottoengine import message_decoder
+from ottoengine.testing import websocket_helpers
+
+NUM_ENTITIES = 2000
+# (frame kind, count) in the replayed trace
+TRACE = [("state_changed", 5000), ("pong", 1000), ("call_service", 3000)]
+REPEAT = 15
+
+
+def _entity_state(i):
+    return {
+        "entity_id": "sensor.sensor_{}".format(i),
+        "state": str(i % 40),
+        "attributes": {"friendly_name": "Sensor {}".format(i), "unit_of_measurement": "C"},
+        "last_changed": "2018-05-06T01:09:25.307187+00:00",
+        "last_updated": "2018-05-06T01:09:25.307187+00:00"
+    }
+
+
+def _build_frames():
+    rand = random.Random(42)
+    frames = []
+    for kind, count in TRACE:
+        for i in range(count):
+            if kind == "pong":
+                frames.append(json.dumps({"id": i, "type": "pong"}))
+            elif kind == "state_changed":
+                frames.append(json.dumps(websocket_helpers.event_state_changed(
+                    i, "sensor.sensor_{}".format(rand.randrange(NUM_ENTITIES)), "20", "21")))
+            else:
+                frames.append(json.dumps(websocket_helpers.event_hass_event(
+                    i, "call_service",
+                    {"domain": "light", "service": "turn_on",
+                     "service_data": {"entity_id": "light.light_{}".format(i)}})))
+    rand.shuffle(frames)
+    return frames
+
+
+def main():
+    frames = _build_frames()
+    get_states = json.dumps({
+        "id": 1, "type": "result", "success": True,
+        "result": [_entity_state(i) for i in range(NUM_ENTITIES)]
+    })
+
+    def _wanted(event_type):
+        return event_type == "state_changed"
+
+    decoders = [("json.loads (old)", json.loads)]
+    for backend in message_decoder.available_backends():
+        decoder = message_decoder.MessageDecoder(event_filter=_wanted, backend=backend)
+        decoders.append(("decoder " + backend, decoder.decode))
+
+    print("Trace: {} frames; get_states result: {:.0f} KB".format(
+        len(frames), len(get_states) / 1024))
+    print("{:>18} {:>12} {:>16}".format("", "msgs/sec", "get_states ms"))
+    for name, decode in decoders:
+        def _replay():
+            for frame in frames:
+                decode(frame)
+
+        replay = min(timeit.repeat(_replay, number=1, repeat=REPEAT))
+        states = min(timeit.repeat(lambda: decode(get_states), number=1, repeat=REPEAT))
+        print("{:>18} {:>12,.0f} {:>16.2f}".format(name, len(frames) / replay, states * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""Benchmark of the packed rule store with 10k rules: loading every rule and loading
+single rules by id, against the file and SQLite backends
+
+    python benchmarks/bench_packed_store.py
+"""
+import json
+import logging
+import os
+import random
+import tempfile
+import timeit
+
+from ottoengine import packed_store, persistence, sqlite_store
+
+SOURCE_DIR = os.path.join(os.path.dirname(__file__), "..", "tests", "json_realworld_rules")
+NUM_RULES = 10000
+NUM_LOOKUPS = 1000
+REPEAT = 3
+
+
+def _write_rules(rules_dir, num_rules):
+    sources = []
+    for file in sorted(os.listdir(SOURCE_DIR)):
+        with open(os.path.join(SOURCE_DIR, file)) as infile:
+            sources.append(json.load(infile))
+
+    for i in range(num_rules):
+        rule = dict(sources[i % len(sources)])
+        rule["id"] = "bench{}".format(i)
+        with open(os.path.join(rules_dir, "{}.json".format(rule["id"])), "w") as outfile:
+            json.dump(rule, outfile)
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    lookup_ids = ["bench{}".format(random.randrange(NUM_RULES)) for i in range(NUM_LOOKUPS)]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        rules_dir = os.path.join(tmpdir, "rules")
+        os.makedirs(rules_dir)
+        _write_rules(rules_dir, NUM_RULES)
+
+        sqlite_path = os.path.join(tmpdir, "rules.sqlite")
+        store = sqlite_store.SqliteRuleStore(sqlite_path)
+        store.import_json_dir(rules_dir)
+        store.close()
+
+        packed_path = os.path.join(tmpdir, "rules.pack")
+        store = packed_store.PackedRuleStore(packed_path)
+        store.import_json_dir(rules_dir)
+        store.close()
+
+        backends = [
+            ("file", lambda: persistence.PersistenceManager(rules_dir)),
+            ("sqlite", lambda: persistence.PersistenceManager(
+                rules_dir, backend=persistence.BACKEND_SQLITE, sqlite_path=sqlite_path)),
+            ("packed", lambda: persistence.PersistenceManager(
+                rules_dir, backend=persistence.BACKEND_PACKED, packed_path=packed_path)),
+        ]
+
+        print("{:>8} {:>14} {:>16}".format("backend", "load all ms", "load_rule us"))
+        for name, make_mgr in backends:
+            # Opening the manager is part of startup, so it is timed with the full load
+            load_all = min(timeit.repeat(
+                lambda: make_mgr().get_rules(rules_dir), number=1, repeat=REPEAT))
+
+            mgr = make_mgr()
+
+            def _lookups():
+                for rule_id in lookup_ids:
+                    mgr.load_rule(rule_id)
+
+            lookups = min(timeit.repeat(_lookups, number=1, repeat=REPEAT))
+            print("{:>8} {:>14.1f} {:>16.1f}".format(
+                name, load_all * 1000, lookups / NUM_LOOKUPS * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""Load test of the REST API: the Flask server (REST_SERVER = flask) vs. the asyncio server on
+the engine's event loop (REST_SERVER = async)
+
+The engine loop runs in its own thread with the tests/json_realworld_rules rules copied
+NUM_RULE_COPIES times and NUM_ENTITIES entities. Clients are threads that each keep one
+connection open and send REQUESTS_PER_CLIENT requests back to back.
+
+    python benchmarks/bench_rest_server.py
+"""
+import asyncio
+import http.client
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from werkzeug import serving
+
+from ottoengine import async_restapi, config, engine, enginelog, persistence, restapi
+from ottoengine.fibers import clock
+from ottoengine.model import dataobjects
+
+RULES_DIR = os.path.join(os.path.dirname(__file__), "../tests/json_realworld_rules")
+NUM_RULE_COPIES = 10
+NUM_ENTITIES = 2000
+CLIENTS = [1, 8, 32]
+REQUESTS_PER_CLIENT = 50
+PATHS = ["/rest/rules", "/rest/entities"]
+
+
+def _start_engine(tmpdir):
+    loop = asyncio.new_event_loop()
+    cfg = config.EngineConfig()
+    persist_mgr = persistence.PersistenceManager(tmpdir)
+    engine_obj = engine.OttoEngine(
+        cfg, loop, clock.EngineClock(cfg.tz, loop), persist_mgr, enginelog.EngineLog())
+
+    for copy_num in range(NUM_RULE_COPIES):
+        for rule in persist_mgr.get_rules(RULES_DIR):
+            rule_dict = rule.serialize()
+            rule_dict["id"] = "{}_{}".format(rule_dict["id"], copy_num)
+            engine_obj.states.add_rule(persist_mgr.rule_from_dict(rule_dict).get("rule"))
+    for i in range(NUM_ENTITIES):
+        entity_id = "sensor.s{}".format(i)
+        engine_obj.states.set_entity_state(entity_id, dataobjects.EntityState(
+            entity_id, str(i), {}, "2018-10-01T12:00:00+00:00", "Sensor {}".format(i)))
+
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return engine_obj
+
+
+def _counts(engine_obj):
+    # The entity snapshot is published on the loop, so read it from there
+    async def _async_counts():
+        return (len(engine_obj.states.get_rules()), len(engine_obj.states.get_entities()))
+    return asyncio.run_coroutine_threadsafe(_async_counts(), engine_obj._loop).result()
+
+
+def _start_flask(engine_obj):
+    restapi.engine_obj = engine_obj
+    server = serving.make_server("127.0.0.1", 0, restapi.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, server.server_port
+
+
+def _start_async(engine_obj):
+    server = async_restapi.AsyncRestServer(engine_obj, host="127.0.0.1", port=0)
+    asyncio.run_coroutine_threadsafe(server.async_start(), engine_obj._loop).result()
+    return server, server.port
+
+
+def _client(port, path, latencies):
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    for i in range(REQUESTS_PER_CLIENT):
+        start = time.perf_counter()
+        conn.request("GET", path)
+        resp = conn.getresponse()
+        resp.read()
+        latencies.append(time.perf_counter() - start)
+        assert resp.status == 200
+    conn.close()
+
+
+def _load(port, path, num_clients):
+    """Returns (requests per second, p99 latency secs)"""
+    latencies = []
+    threads = [
+        threading.Thread(target=_client, args=(port, path, latencies))
+        for i in range(num_clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return (len(latencies) / elapsed, latencies[int(len(latencies) * 0.99) - 1])
+
+
+def main():
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)  # No line per request
+    with tempfile.TemporaryDirectory() as tmpdir:
+        engine_obj = _start_engine(tmpdir)
+        print("{} rules, {} entities".format(*_counts(engine_obj)))
+        servers = [("flask", _start_flask(engine_obj)[1]), ("async", _start_async(engine_obj)[1])]
+
+        print("{:>16} {:>8} {:>10} {:>10} {:>12} {:>12}".format(
+            "path", "clients", "flask rps", "async rps", "flask p99 ms", "async p99 ms"))
+        for path in PATHS:
+            for num_clients in CLIENTS:
+                results = [_load(port, path, num_clients) for name, port in servers]
+                print("{:>16} {:>8} {:>10.0f} {:>10.0f} {:>12.1f} {:>12.1f}".format(
+                    path, num_clients, results[0][0], results[1][0],
+                    results[0][1] * 1000, results[1][1] * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""Benchmark of loading a directory of rule files: sequential get_rules() vs. the
+thread pool in async_get_rules(), cold and with every file already cached
+
+    python benchmarks/bench_rule_loading.py
+"""
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import timeit
+
+from ottoengine import persistence
+
+SOURCE_DIR = os.path.join(os.path.dirname(__file__), "..", "tests", "json_realworld_rules")
+NUM_RULES = [200, 2000]
+REPEAT = 3
+
+
+def _write_rules(rules_dir, num_rules):
+    sources = []
+    for file in sorted(os.listdir(SOURCE_DIR)):
+        with open(os.path.join(SOURCE_DIR, file)) as infile:
+            sources.append(json.load(infile))
+
+    for i in range(num_rules):
+        rule = dict(sources[i % len(sources)])
+        rule["id"] = "bench{}".format(i)
+        with open(os.path.join(rules_dir, "{}.json".format(rule["id"])), "w") as outfile:
+            json.dump(rule, outfile)
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    loop = asyncio.get_event_loop()
+
+    print("{:>8} {:>14} {:>14} {:>14}".format("rules", "sequential ms", "pool cold ms",
+                                             "pool cached ms"))
+    for num_rules in NUM_RULES:
+        with tempfile.TemporaryDirectory() as rules_dir:
+            _write_rules(rules_dir, num_rules)
+
+            def _sequential():
+                persistence.PersistenceManager(rules_dir).get_rules(rules_dir)
+
+            def _pool_cold():
+                mgr = persistence.PersistenceManager(rules_dir)
+                loop.run_until_complete(mgr.async_get_rules(rules_dir))
+
+            warm_mgr = persistence.PersistenceManager(rules_dir)
+            loop.run_until_complete(warm_mgr.async_get_rules(rules_dir))
+
+            def _pool_cached():
+                loop.run_until_complete(warm_mgr.async_get_rules(rules_dir))
+
+            sequential = min(timeit.repeat(_sequential, number=1, repeat=REPEAT))
+            pool_cold = min(timeit.repeat(_pool_cold, number=1, repeat=REPEAT))
+            pool_cached = min(timeit.repeat(_pool_cached, number=1, repeat=REPEAT))
+
+            print("{:>8} {:>14.1f} {:>14.1f} {:>14.1f}".format(
+                num_rules, sequential * 1000, pool_cold * 1000, pool_cached * 1000))
+
+
+if __name__ == "__main__":
+    main()
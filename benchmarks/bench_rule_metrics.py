@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""Benchmark of what the rule metrics add to each rule invocation: the outcome count,
+stage histogram records and perf_counter() calls made for a rule whose trigger, condition
+and first service call all pass, and for one whose trigger is rejected
+
+    python benchmarks/bench_rule_metrics.py
+"""
+import time
+
+from ottoengine import metrics
+
+NUM_INVOCATIONS = 200000
+NUM_RULES = 200
+
+
+def _completed_run(rule_metrics, rule_id, received):
+    '''The metrics calls made by async_invoke_rule for a rule that runs to completion'''
+    invoked = time.perf_counter()
+    rule_metrics.record_stage(metrics.STAGE_TRIGGER, time.perf_counter() - received)
+    rule_metrics.record_stage(metrics.STAGE_CONDITION, time.perf_counter() - received)
+    rule_metrics.record_stage(metrics.STAGE_FIRST_SERVICE_CALL, time.perf_counter() - received)
+    now = time.perf_counter()
+    rule_metrics.finish(rule_id, metrics.COMPLETED, now - invoked)
+    rule_metrics.record_stage(metrics.STAGE_COMPLETED, now - received)
+
+
+def _rejected_run(rule_metrics, rule_id, received):
+    time.perf_counter()
+    rule_metrics.finish(rule_id, metrics.TRIGGER_REJECTED, 0.0)
+
+
+def _nothing(rule_metrics, rule_id, received):
+    pass
+
+
+def _per_call_us(func, rule_metrics, rule_ids):
+    received = time.perf_counter()
+    start = time.perf_counter()
+    for i in range(NUM_INVOCATIONS):
+        func(rule_metrics, rule_ids[i % NUM_RULES], received)
+    return (time.perf_counter() - start) / NUM_INVOCATIONS * 1e6
+
+
+def main():
+    rule_ids = ["rule_{}".format(i) for i in range(NUM_RULES)]
+    rule_metrics = metrics.RuleMetrics()
+    baseline_us = _per_call_us(_nothing, rule_metrics, rule_ids)
+
+    print("{:>20} {:>14}".format("invocation", "metrics us"))
+    for name, func in (("completed", _completed_run), ("trigger rejected", _rejected_run)):
+        per_call_us = _per_call_us(func, rule_metrics, rule_ids) - baseline_us
+        print("{:>20} {:>14.2f}".format(name, per_call_us))
+
+    start = time.perf_counter()
+    text = metrics.format_prometheus(rule_metrics, {})
+    print("format_prometheus() for {} rules: {:.1f} ms, {} bytes".format(
+        NUM_RULES, (time.perf_counter() - start) * 1000, len(text)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""Benchmark of a burst of rules turning off lights: one websocket frame per ServiceAction
+vs. the ServiceCallDispatcher merging calls over a short window
+
+The websocket is simulated with a fixed round-trip time per call, and each rule's actions
+run as async_invoke_rule runs them (consecutive service calls sent together).
+
+    python benchmarks/bench_service_dispatcher.py
+"""
+import asyncio
+import time
+
+from ottoengine import service_dispatcher
+from ottoengine.model import dataobjects
+
+RTT_SECS = 0.002
+WINDOW_SECS = 0.005
+# (number of rules firing at once, lights each rule turns off)
+BURSTS = [(1, 20), (10, 20), (50, 5)]
+
+
+class _SimulatedWebsocket(object):
+
+    def __init__(self):
+        self.frames = 0
+
+    async def async_call_service(self, service_call):
+        self.frames += 1
+        await asyncio.sleep(RTT_SECS)
+        return {"id": self.frames, "type": "result", "success": True, "result": None}
+
+
+async def _async_rule(call_service, rule_num, num_lights):
+    await asyncio.gather(*[
+        call_service(dataobjects.ServiceCall(
+            "light", "turn_off", {"entity_id": "light.l{}_{}".format(rule_num % 3, i)}))
+        for i in range(num_lights)
+    ])
+
+
+async def _async_burst(call_service, num_rules, num_lights):
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        _async_rule(call_service, rule_num, num_lights) for rule_num in range(num_rules)])
+    return time.perf_counter() - start
+
+
+def main():
+    loop = asyncio.get_event_loop()
+    print("{:>6} {:>7} {:>12} {:>12} {:>10} {:>10}".format(
+        "rules", "lights", "direct msgs", "batched msgs", "direct ms", "batched ms"))
+    for num_rules, num_lights in BURSTS:
+        direct = _SimulatedWebsocket()
+        direct_secs = loop.run_until_complete(
+            _async_burst(direct.async_call_service, num_rules, num_lights))
+
+        batched = _SimulatedWebsocket()
+        dispatcher = service_dispatcher.ServiceCallDispatcher(
+            batched.async_call_service, WINDOW_SECS)
+        batched_secs = loop.run_until_complete(
+            _async_burst(dispatcher.async_call, num_rules, num_lights))
+
+        print("{:>6} {:>7} {:>12} {:>12} {:>10.1f} {:>10.1f}".format(
+            num_rules, num_lights, direct.frames, batched.frames,
+            direct_secs * 1000, batched_secs * 1000))
+
+
+if __name__ == "__main__":
+    main()
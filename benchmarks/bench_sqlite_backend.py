@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""Benchmark of loading 10k rules with the file backend vs. the SQLite backend,
+plus an indexed group query against filtering a full load
+
+    python benchmarks/bench_sqlite_backend.py
+"""
+import json
+import logging
+import os
+import tempfile
+import timeit
+
+from ottoengine import persistence, sqlite_store
+
+SOURCE_DIR = os.path.join(os.path.dirname(__file__), "..", "tests", "json_realworld_rules")
+NUM_RULES = 10000
+NUM_GROUPS = 100
+REPEAT = 3
+
+
+def _write_rules(rules_dir, num_rules):
+    sources = []
+    for file in sorted(os.listdir(SOURCE_DIR)):
+        with open(os.path.join(SOURCE_DIR, file)) as infile:
+            sources.append(json.load(infile))
+
+    for i in range(num_rules):
+        rule = dict(sources[i % len(sources)])
+        rule["id"] = "bench{}".format(i)
+        rule["group"] = "group{}".format(i % NUM_GROUPS)
+        with open(os.path.join(rules_dir, "{}.json".format(rule["id"])), "w") as outfile:
+            json.dump(rule, outfile)
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        rules_dir = os.path.join(tmpdir, "rules")
+        os.makedirs(rules_dir)
+        sqlite_path = os.path.join(tmpdir, "rules.sqlite")
+        _write_rules(rules_dir, NUM_RULES)
+
+        store = sqlite_store.SqliteRuleStore(sqlite_path)
+        import_secs = timeit.timeit(lambda: store.import_json_dir(rules_dir), number=1)
+        store.close()
+
+        file_mgr = persistence.PersistenceManager(rules_dir)
+        sqlite_mgr = persistence.PersistenceManager(
+            rules_dir, backend=persistence.BACKEND_SQLITE, sqlite_path=sqlite_path)
+
+        def _file_load():
+            persistence.PersistenceManager(rules_dir).get_rules(rules_dir)
+
+        def _sqlite_load():
+            sqlite_mgr.get_rules(rules_dir)
+
+        file_load = min(timeit.repeat(_file_load, number=1, repeat=REPEAT))
+        sqlite_load = min(timeit.repeat(_sqlite_load, number=1, repeat=REPEAT))
+        file_group = min(timeit.repeat(
+            lambda: file_mgr.query_rules(group="group7"), number=1, repeat=REPEAT))
+        sqlite_group = min(timeit.repeat(
+            lambda: sqlite_mgr.query_rules(group="group7"), number=1, repeat=REPEAT))
+
+    print("Imported {} rules in {:.1f} ms".format(NUM_RULES, import_secs * 1000))
+    print("{:>22} {:>10} {:>10}".format("", "file ms", "sqlite ms"))
+    print("{:>22} {:>10.1f} {:>10.1f}".format("load all rules", file_load * 1000,
+                                              sqlite_load * 1000))
+    print("{:>22} {:>10.1f} {:>10.1f}".format("query one group", file_group * 1000,
+                                              sqlite_group * 1000))
+
+
+if __name__ == "__main__":
+    main()
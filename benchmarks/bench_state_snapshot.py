@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""Benchmark of reading all entity states for the REST API: deepcopy of the entity map on
+the event loop (as before) vs. taking the published snapshot, plus the cost per
+set_entity_state() of keeping snapshots published
+
+    python benchmarks/bench_state_snapshot.py
+"""
+import copy
+import timeit
+
+from ottoengine import state
+from ottoengine.model import dataobjects
+
+NUM_ENTITIES = [2000, 20000]
+NUM_WRITES = 20000
+
+
+def _entity(i, value):
+    return dataobjects.EntityState(
+        "sensor.entity_{}".format(i), value,
+        {"friendly_name": "Entity {}".format(i), "unit_of_measurement": "C"},
+        "2018-05-06T01:09:25.307187+00:00")
+
+
+def main():
+    print("{:>9} {:>15} {:>13} {:>16} {:>14}".format(
+        "entities", "deepcopy ms", "snapshot us", "write+publish us", "dict write us"))
+    for num_entities in NUM_ENTITIES:
+        states = state.OttoEngineState()
+        with states.batch_update():
+            for i in range(num_entities):
+                states.set_entity_state("sensor.entity_{}".format(i), _entity(i, "0"))
+        plain = dict(states.snapshot())
+
+        deepcopy = min(timeit.repeat(lambda: copy.deepcopy(plain), number=1, repeat=3))
+        snapshot = min(timeit.repeat(states.snapshot, number=1000, repeat=3)) / 1000
+
+        updates = [_entity(i % num_entities, str(i)) for i in range(NUM_WRITES)]
+
+        def _writes():
+            for update in updates:
+                states.set_entity_state(update.entity_id, update)
+
+        def _dict_writes():
+            for update in updates:
+                plain[update.entity_id] = update
+
+        writes = min(timeit.repeat(_writes, number=1, repeat=3)) / NUM_WRITES
+        dict_writes = min(timeit.repeat(_dict_writes, number=1, repeat=3)) / NUM_WRITES
+
+        print("{:>9} {:>15.1f} {:>13.2f} {:>16.2f} {:>14.2f}".format(
+            num_entities, deepcopy * 1000, snapshot * 1e6, writes * 1e6, dict_writes * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""Replay benchmark of inbound websocket traffic for the tests/json_realworld_rules rules:
+subscribing to every state_changed event (SUBSCRIPTION_MODE = all) vs. one subscribe_trigger
+per entity the rules use (SUBSCRIPTION_MODE = filtered)
+
+The trace is a house with the rules' entities plus NUM_OTHER_ENTITIES that no rule uses,
+each changing at a random rate. A frame counts as received when a subscription covers it.
+
+    python benchmarks/bench_subscriptions.py
+"""
+import json
+import os
+import random
+import time
+
+from ottoengine import message_decoder, persistence, subscriptions
+from ottoengine.testing import websocket_helpers
+
+RULES_DIR = os.path.join(os.path.dirname(__file__), "../tests/json_realworld_rules")
+NUM_OTHER_ENTITIES = [200, 1000, 5000]
+NUM_EVENTS = 20000
+
+
+def _build_trace(rule_entities, num_other):
+    rand = random.Random(42)
+    entities = sorted(rule_entities) + ["sensor.other_{}".format(i) for i in range(num_other)]
+    weights = [rand.choice([1, 1, 1, 5, 20]) for entity in entities]
+    frames = []
+    for i, entity_id in enumerate(rand.choices(entities, weights, k=NUM_EVENTS)):
+        frames.append((entity_id, json.dumps(
+            websocket_helpers.event_state_changed(i, entity_id, "off", "on"))))
+    return frames
+
+
+def _decode_secs(frames):
+    decoder = message_decoder.MessageDecoder()
+    start = time.perf_counter()
+    for entity_id, frame in frames:
+        decoder.decode(frame)
+    return time.perf_counter() - start
+
+
+def main():
+    persist_mgr = persistence.PersistenceManager(RULES_DIR)
+    subs = subscriptions.RuleSubscriptions(subscriptions.MODE_FILTERED)
+    for rule in persist_mgr.get_rules(RULES_DIR):
+        subs.add_rule(rule)
+    rule_entities = subs.get_entity_ids()
+    print("{} rules need {} entities and {} event types".format(
+        subs.get_stats()["rules"], len(rule_entities), len(subs.get_event_types())))
+
+    print("{:>8} {:>10} {:>10} {:>10} {:>10} {:>12} {:>12}".format(
+        "other", "all msgs", "filt msgs", "all KiB", "filt KiB", "all dec ms", "filt dec ms"))
+    for num_other in NUM_OTHER_ENTITIES:
+        frames = _build_trace(rule_entities, num_other)
+        filtered = [frame for frame in frames if frame[0] in rule_entities]
+        print("{:>8} {:>10} {:>10} {:>10.0f} {:>10.0f} {:>12.1f} {:>12.1f}".format(
+            num_other,
+            len(frames),
+            len(filtered),
+            sum(len(frame) for entity_id, frame in frames) / 1024,
+            sum(len(frame) for entity_id, frame in filtered) / 1024,
+            _decode_secs(frames) * 1000,
+            _decode_secs(filtered) * 1000))
+
+
+if __name__ == "__main__":
+    main()
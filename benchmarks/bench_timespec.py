@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+"""Micro-benchmark of TimeSpec.next_time_from: compiled CronSchedule vs. croniter
+
+    python benchmarks/bench_timespec.py
+"""
+import timeit
+
+from dateutil import parser
+
+from ottoengine.fibers import clock
+
+NUMBER = 2000
+
+SPECS = [
+    {"tz": "UTC"},
+    {"tz": "America/Los_Angeles", "minute": 30, "hour": 18},
+    {"tz": "America/Los_Angeles", "minute": "0,30", "hour": "8-17", "weekdays": "1-5"},
+    {"tz": "UTC", "minute": 30, "hour": 9, "day_of_month": 4, "month": 7},
+]
+
+
+def main():
+    start = parser.parse("2018-05-08 21:38:00-00:00")
+    print("{:<80} {:>12} {:>12} {:>8}".format("TimeSpec", "croniter us", "compiled us", "speedup"))
+    for specdict in SPECS:
+        spec = clock.TimeSpec.from_dict(specdict)
+        spec.next_time_from(start)  # Compile outside of the timed loop
+
+        croniter_secs = timeit.timeit(
+            lambda: spec._next_time_from_croniter(start), number=NUMBER)
+        compiled_secs = timeit.timeit(
+            lambda: spec.next_time_from(start), number=NUMBER)
+
+        print("{:<80} {:>12.1f} {:>12.1f} {:>7.1f}x".format(
+            str(specdict),
+            croniter_secs / NUMBER * 1e6,
+            compiled_secs / NUMBER * 1e6,
+            croniter_secs / compiled_secs))
+
+    spec = clock.TimeSpec.from_dict(SPECS[2])
+    batch_secs = timeit.timeit(lambda: spec.next_times_from(start, 100), number=20)
+    print("next_times_from(100): {:.1f} us per time".format(batch_secs / 2000 * 1e6))
+
+
+if __name__ == "__main__":
+    main()
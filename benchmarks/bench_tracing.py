@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""Benchmark of what tracing adds to handling an event, from _process_event_response to the
+rule's service call being answered, with tracing off (TRACE_SPANS = 0) and on, for events
+no rule listens to, events whose rule's trigger doesn't pass, and events that run a rule
+
+The websocket answers each call as soon as it is written.
+
+    python benchmarks/bench_tracing.py
+"""
+import asyncio
+import json
+import tempfile
+import time
+
+from ottoengine import config, engine, enginelog, hass_websocket_client, persistence, tracing
+from ottoengine.fibers import clock, hass_websocket_reader
+
+NUM_RULES = 100
+NUM_EVENTS = 5000
+TIME_FIRED = "2018-10-01T12:00:00.000000+00:00"
+
+
+class _AnsweringSocket(object):
+
+    def __init__(self, websocket):
+        self._websocket = websocket
+
+    async def send(self, frame):
+        request_id = json.loads(frame)["id"]
+        asyncio.get_event_loop().call_soon(self._websocket.resolve_result, {
+            "id": request_id, "type": "result", "success": True, "result": None})
+
+
+def _engine(loop, rules_dir, trace_spans):
+    cfg = config.EngineConfig()
+    cfg.trace_spans = trace_spans
+    engine_obj = engine.OttoEngine(
+        cfg, loop, clock.EngineClock(cfg.tz, loop),
+        persistence.PersistenceManager(rules_dir), enginelog.EngineLog())
+    websocket = hass_websocket_client.AsyncHassWebsocket("localhost", 8123)
+    websocket._socket = _AnsweringSocket(websocket)
+    engine_obj._websocket = websocket
+    for i in range(NUM_RULES):
+        rule = engine_obj._persistence_mgr.rule_from_dict({
+            "id": "rule_{}".format(i),
+            "triggers": [
+                {"platform": "state", "entity_id": "switch.s{}".format(i), "to": "on"}],
+            "actions": [{"action_sequence": [
+                {"log_message": "pressed"},
+                {"domain": "light", "service": "turn_on",
+                 "data": {"entity_id": "light.l{}".format(i)}},
+            ]}]
+        }).get("rule")
+        loop.run_until_complete(engine_obj._async_load_rule(rule))
+    return engine_obj
+
+
+def _messages(entity_prefix, new_state):
+    def _state(entity_id, value):
+        return {
+            "entity_id": entity_id, "state": value, "attributes": {},
+            "last_changed": TIME_FIRED, "last_updated": TIME_FIRED}
+    messages = []
+    for i in range(NUM_EVENTS):
+        entity_id = "{}{}".format(entity_prefix, i % NUM_RULES)
+        messages.append({"type": "event", "event": {
+            "event_type": "state_changed",
+            "data": {
+                "entity_id": entity_id,
+                "old_state": _state(entity_id, "off"),
+                "new_state": _state(entity_id, new_state)},
+            "time_fired": TIME_FIRED,
+        }})
+    return messages
+
+
+async def _async_handle(engine_obj, messages) -> float:
+    start = time.perf_counter()
+    for msg in messages:
+        await hass_websocket_reader._process_event_response(
+            engine_obj, msg, time.perf_counter())
+    # Until every rule has run and had its call answered
+    while len(asyncio.all_tasks()) > 1:
+        await asyncio.sleep(0)
+    return time.perf_counter() - start
+
+
+def main():
+    loop = asyncio.get_event_loop()
+    cases = [
+        ("no listener", "sensor.t", "on"),
+        ("trigger rejected", "switch.s", "off"),
+        ("rule runs", "switch.s", "on"),
+    ]
+    print("{:>18} {:>12} {:>12} {:>10}".format("event", "off us/evt", "on us/evt", "spans"))
+    for name, entity_prefix, new_state in cases:
+        per_event_us = []
+        for trace_spans in (0, tracing.DEFAULT_MAX_SPANS):
+            with tempfile.TemporaryDirectory() as rules_dir:
+                engine_obj = _engine(loop, rules_dir, trace_spans)
+                # Both runs see the same states, so neither pays for first seeing an entity
+                loop.run_until_complete(
+                    _async_handle(engine_obj, _messages(entity_prefix, new_state)))
+                secs = loop.run_until_complete(
+                    _async_handle(engine_obj, _messages(entity_prefix, new_state)))
+                per_event_us.append(secs / NUM_EVENTS * 1e6)
+        print("{:>18} {:>12.1f} {:>12.1f} {:>10}".format(
+            name, per_event_us[0], per_event_us[1], engine_obj.tracer.get_stats()["spans"]))
+
+    start = time.perf_counter()
+    traces = engine_obj.get_traces()
+    read_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    chrome_json = json.dumps(tracing.to_chrome_trace(traces))
+    export_ms = (time.perf_counter() - start) * 1000
+    print("Reading {} traces: {:.1f} ms, exporting them as Chrome JSON: {:.1f} ms ({} KB)".format(
+        len(traces), read_ms, export_ms, len(chrome_json) // 1024))
+
+
+if __name__ == "__main__":
+    main()
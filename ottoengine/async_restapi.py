@@ -0,0 +1,380 @@
+"""The REST API served by asyncio on the engine's own event loop.
+
+Handlers are coroutines that read the engine's state directly, instead of hopping from
+a web server thread to the loop and back for every request, so concurrent requests
+don't queue up behind one another. Routes and response bodies match restapi.
+"""
+import asyncio
+import json
+import logging
+import re
+import sys
+import urllib.parse
+
+from ottoengine import metrics, rest_responses
+
+_LOG = logging.getLogger(__name__)
+# _LOG.setLevel(logging.DEBUG)
+
+MIMETYPE = "application/json"
+MAX_BODY_BYTES = 1024 * 1024
+MAX_HEADER_LINES = 100             # Lines are limited to the StreamReader's 64 KiB
+STREAM_CHUNK_BYTES = 64 * 1024     # NDJSON is written in chunks of about this size
+KEEPALIVE_TIMEOUT_SECS = 30
+
+REASONS = {
+    200: "OK", 204: "No Content", 400: "Bad Request", 404: "Not Found",
+    405: "Method Not Allowed", 413: "Payload Too Large", 414: "URI Too Long",
+    431: "Request Header Fields Too Large", 500: "Internal Server Error"
+}
+
+# Same as flask_cors in restapi: allow all cross-origin requests
+CORS_HEADERS = [
+    ("Access-Control-Allow-Origin", "*"),
+    ("Access-Control-Allow-Methods", "GET, PUT, DELETE, OPTIONS"),
+    ("Access-Control-Allow-Headers", "Content-Type"),
+    ("Access-Control-Expose-Headers", rest_responses.CURSOR_HEADER),
+]
+
+
+class HttpError(Exception):
+    '''Ends a request with an HTTP error status'''
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class TextResponse(object):
+    '''A handler's response that is sent as is, rather than as JSON'''
+
+    def __init__(self, text: str, content_type: str):
+        self.body = text.encode()
+        self.content_type = content_type
+
+
+class Request(object):
+
+    def __init__(self, method: str, path: str, query: dict, headers: dict, body: bytes):
+        self.method = method
+        self.path = path
+        self.query = query        # name -> last value
+        self.headers = headers    # lower case name -> value
+        self.body = body
+
+    def get_json(self):
+        try:
+            return json.loads(self.body.decode() or "null")
+        except ValueError:
+            raise HttpError(400, "Request body is not valid JSON")
+
+
+class AsyncRestServer(object):
+    """A small HTTP/1.1 server with keep-alive for the REST API routes"""
+
+    def __init__(self, engine_obj, host: str = "0.0.0.0", port: int = 5000):
+        self._engine = engine_obj
+        self._host = host
+        self._port = port
+        self._server = None
+        self._routes = []   # (compiled path pattern, {method: handler})
+
+        self._add_route(r"/rest/ping", GET=self._ping)
+        self._add_route(r"/rest/reload", GET=self._reload)
+        self._add_route(r"/rest/rules", GET=self._rules)
+        self._add_route(r"/rest/entities", GET=self._entities)
+        self._add_route(r"/rest/services", GET=self._services)
+        self._add_route(r"/rest/rule", PUT=self._put_rule)
+        self._add_route(
+            r"/rest/rule/(?P<rule_id>[^/]+)",
+            GET=self._get_rule, PUT=self._put_rule, DELETE=self._delete_rule)
+        self._add_route(r"/rest/clock/check", PUT=self._clock_check)
+        self._add_route(r"/rest/logs", GET=self._logs)
+        self._add_route(r"/rest/metrics", GET=self._metrics)
+        self._add_route(r"/rest/traces", GET=self._traces)
+        self._add_route(r"/rest/traces/chrome", GET=self._chrome_trace)
+
+    @property
+    def port(self) -> int:
+        '''The port being listened on, which is chosen by the OS if port 0 was given'''
+        if self._server is not None and self._server.sockets:
+            return self._server.sockets[0].getsockname()[1]
+        return self._port
+
+    async def async_start(self):
+        self._server = await asyncio.start_server(
+            self._async_handle_connection, self._host, self._port)
+        _LOG.info("Async REST server listening on {}:{}".format(self._host, self.port))
+
+    async def async_stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    # ~~~~~~~~~~~~~~~~~~~~
+    #   Route handlers
+    # ~~~~~~~~~~~~~~~~~~~~
+
+    async def _ping(self, request: Request) -> dict:
+        return rest_responses.ping()
+
+    async def _reload(self, request: Request) -> dict:
+        return rest_responses.reload_rules(await self._engine.async_reload_rules())
+
+    async def _rules(self, request: Request) -> rest_responses.Page:
+        return _list(rest_responses.rules, self._engine.states.get_rules(), request)
+
+    async def _entities(self, request: Request) -> rest_responses.Page:
+        return _list(rest_responses.entities, self._engine.states.get_entities(), request)
+
+    async def _services(self, request: Request) -> rest_responses.Page:
+        return _list(rest_responses.services, self._engine.states.get_services(), request)
+
+    async def _get_rule(self, request: Request, rule_id: str) -> dict:
+        _LOG.info("GET for rule {}".format(rule_id))
+        return rest_responses.get_rule(rule_id, self._engine.states.get_rule(rule_id))
+
+    async def _put_rule(self, request: Request, rule_id: str = None) -> dict:
+        _LOG.info("PUT for rule {}".format(rule_id))
+        body = request.get_json()
+        data = body.get("data") if isinstance(body, dict) else None
+        if not isinstance(data, dict):
+            raise HttpError(400, "Request body must be {\"data\": {rule}}")
+        result = await self._engine.async_save_rule(data)
+        return rest_responses.save_rule(rule_id, data, result)
+
+    async def _delete_rule(self, request: Request, rule_id: str) -> dict:
+        _LOG.info("DELETE for rule {}".format(rule_id))
+        success = await self._engine.async_delete_rule(rule_id)
+        return rest_responses.delete_rule(rule_id, success)
+
+    async def _clock_check(self, request: Request) -> dict:
+        body = request.get_json()
+        spec = body.get("data") if isinstance(body, dict) else None
+        _LOG.info(spec)
+        # Only parses the spec, so it does not need to hop to the loop
+        result = self._engine.check_timespec_threadsafe(spec)
+        return rest_responses.clock_check(spec, result)
+
+    async def _logs(self, request: Request) -> rest_responses.Page:
+        query = _list_query(request)
+        try:
+            filters = rest_responses.log_filters(query)
+        except ValueError as e:
+            raise HttpError(400, str(e))
+        return _list(rest_responses.logs, self._engine.englog.get_logs(**filters), request, query)
+
+    async def _metrics(self, request: Request) -> TextResponse:
+        return TextResponse(self._engine.get_metrics_text(), metrics.CONTENT_TYPE)
+
+    async def _traces(self, request: Request) -> rest_responses.Page:
+        query = _list_query(request)
+        try:
+            filters = rest_responses.trace_filters(query)
+        except ValueError as e:
+            raise HttpError(400, str(e))
+        return _list(rest_responses.traces, self._engine.get_traces(**filters), request, query)
+
+    async def _chrome_trace(self, request: Request) -> dict:
+        try:
+            filters = rest_responses.trace_filters(_list_query(request))
+        except ValueError as e:
+            raise HttpError(400, str(e))
+        return rest_responses.chrome_trace(self._engine.get_traces(**filters))
+
+    # ~~~~~~~~~~~~~~~~~~~~
+    #   HTTP handling
+    # ~~~~~~~~~~~~~~~~~~~~
+
+    def _add_route(self, pattern: str, **handlers):
+        self._routes.append((re.compile(pattern + "$"), handlers))
+
+    async def _async_handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(
+                        _async_read_request(reader), KEEPALIVE_TIMEOUT_SECS)
+                except HttpError as e:
+                    await _async_write_response(writer, e.status, _error_body(str(e)), False)
+                    break
+                if request is None:
+                    break
+
+                status, body = await self._async_dispatch(request)
+                keep_alive = _keep_alive(request)
+                if isinstance(body, rest_responses.Page):
+                    # An HTTP/1.0 client can't read chunks, so its stream ends at close
+                    keep_alive = keep_alive and request.headers["_version"] != "HTTP/1.0"
+                    await _async_write_stream(writer, body, keep_alive)
+                elif isinstance(body, TextResponse):
+                    await _async_write_response(
+                        writer, status, body.body, keep_alive, body.content_type)
+                else:
+                    await _async_write_response(writer, status, body, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _async_dispatch(self, request: Request) -> tuple:
+        '''Returns (status, body bytes), (200, Page) for an NDJSON Page to stream,
+        or (200, TextResponse)'''
+        if request.method == "OPTIONS":
+            return (204, b"")
+
+        for pattern, handlers in self._routes:
+            match = pattern.match(request.path)
+            if match is None:
+                continue
+            handler = handlers.get(request.method)
+            if handler is None:
+                return (405, _error_body("Method {} not allowed".format(request.method)))
+            try:
+                resp = await handler(request, **match.groupdict())
+            except HttpError as e:
+                return (e.status, _error_body(str(e)))
+            except Exception:
+                message = "Exception handling {} {}: {}: {}".format(
+                    request.method, request.path, sys.exc_info()[0], sys.exc_info()[1])
+                _LOG.error(message)
+                return (500, _error_body(message))
+            if isinstance(resp, TextResponse):
+                return (200, resp)
+            if isinstance(resp, rest_responses.Page):
+                if resp.ndjson:
+                    return (200, resp)
+                resp = resp.to_dict()
+            return (200, json.dumps(resp).encode())
+
+        return (404, _error_body("No route for {}".format(request.path)))
+
+
+def _list_query(request: Request) -> rest_responses.ListQuery:
+    try:
+        return rest_responses.ListQuery.from_args(request.query)
+    except ValueError as e:
+        raise HttpError(400, str(e))
+
+
+def _list(build_page, items: list, request: Request, query=None) -> rest_responses.Page:
+    try:
+        return build_page(items, query or _list_query(request))
+    except ValueError as e:
+        raise HttpError(400, str(e))
+
+
+async def _async_read_request(reader) -> Request:
+    '''Reads one request, or returns None if the client closed the connection'''
+    request_line = await _async_read_line(reader, 414, "Request line")
+    if not request_line.strip():
+        return None
+    try:
+        method, target, version = request_line.decode("latin-1").split()
+    except ValueError:
+        raise HttpError(400, "Malformed request line")
+
+    headers = {"_version": version}
+    for _ in range(MAX_HEADER_LINES + 1):
+        line = await _async_read_line(reader, 431, "Header line")
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    else:
+        raise HttpError(431, "More than {} header lines".format(MAX_HEADER_LINES))
+
+    length = _content_length(method.upper(), headers)
+    body = await reader.readexactly(length) if length else b""
+
+    url = urllib.parse.urlsplit(target)
+    query = dict(urllib.parse.parse_qsl(url.query))
+    return Request(method.upper(), urllib.parse.unquote(url.path), query, headers, body)
+
+
+async def _async_read_line(reader, status: int, what: str) -> bytes:
+    try:
+        return await reader.readline()
+    except ValueError:
+        # readline() raises ValueError, not LimitOverrunError, once a line passes the limit
+        raise HttpError(status, "{} is longer than the limit".format(what))
+
+
+def _content_length(method: str, headers: dict) -> int:
+    '''The length of the request body, which a PUT or POST must give'''
+    value = headers.get("content-length")
+    if value is None:
+        if method in ("PUT", "POST"):
+            raise HttpError(400, "Content-Length is required")
+        return 0
+    try:
+        length = int(value)
+    except ValueError:
+        raise HttpError(400, "Content-Length is not a number: {}".format(value))
+    if length < 0:
+        raise HttpError(400, "Content-Length is negative: {}".format(value))
+    if length > MAX_BODY_BYTES:
+        raise HttpError(413, "Request body is larger than {} bytes".format(MAX_BODY_BYTES))
+    return length
+
+
+def _keep_alive(request: Request) -> bool:
+    connection = request.headers.get("connection", "").lower()
+    if request.headers["_version"] == "HTTP/1.0":
+        return connection == "keep-alive"
+    return connection != "close"
+
+
+async def _async_write_response(writer, status: int, body: bytes, keep_alive: bool,
+                                content_type: str = MIMETYPE):
+    headers = [("Content-Type", content_type), ("Content-Length", str(len(body)))]
+    writer.write(_head(status, headers, keep_alive) + body)
+    await writer.drain()
+
+
+async def _async_write_stream(writer, page: rest_responses.Page, keep_alive: bool):
+    '''Writes the page as NDJSON while it is serialized, chunked if the connection stays open.
+    Yields to the loop after each chunk, so a large list doesn't hold up rules firing.'''
+    headers = [("Content-Type", rest_responses.NDJSON_MIMETYPE)]
+    if page.next_cursor is not None:
+        headers.append((rest_responses.CURSOR_HEADER, page.next_cursor))
+    if keep_alive:
+        headers.append(("Transfer-Encoding", "chunked"))
+    writer.write(_head(200, headers, keep_alive))
+
+    lines = []
+    size = 0
+    for line in page.iter_ndjson():
+        lines.append(line)
+        size += len(line)
+        if size >= STREAM_CHUNK_BYTES:
+            await _async_write_chunk(writer, b"".join(lines), keep_alive)
+            lines = []
+            size = 0
+    if lines:
+        await _async_write_chunk(writer, b"".join(lines), keep_alive)
+    if keep_alive:
+        writer.write(b"0\r\n\r\n")
+    await writer.drain()
+
+
+async def _async_write_chunk(writer, data: bytes, chunked: bool):
+    if chunked:
+        data = "{:x}\r\n".format(len(data)).encode() + data + b"\r\n"
+    writer.write(data)
+    await writer.drain()
+    await asyncio.sleep(0)
+
+
+def _head(status: int, headers: list, keep_alive: bool) -> bytes:
+    lines = ["HTTP/1.1 {} {}".format(status, REASONS.get(status, ""))]
+    headers = headers + [("Connection", "keep-alive" if keep_alive else "close")] + CORS_HEADERS
+    lines.extend("{}: {}".format(name, value) for name, value in headers)
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+def _error_body(message: str) -> bytes:
+    return json.dumps(rest_responses.error(message)).encode()
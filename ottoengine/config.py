@@ -38,6 +38,17 @@ class EngineConfig:
         self.tz = "America/Los_Angeles"
         self.json_rules_dir = "./json_rules"
         self.log_level = logging.INFO
+        self.clock_precise = False
+        self.persistence_backend = "file"   # file, sqlite or packed
+        self.sqlite_path = None             # Defaults to rules.sqlite in json_rules_dir
+        self.packed_path = None             # Defaults to rules.pack in json_rules_dir
+        self.subscription_mode = "all"      # all or filtered (needs subscribe_trigger)
+        self.service_batch_window_ms = 0    # 0 sends each service call as it is made
+        self.rest_server = "flask"          # flask (own thread) or async (engine's loop)
+        self.engine_log_dir = None          # Keeps the engine log on disk when set
+        self.engine_log_segment_kb = 4096   # Size at which a new log segment is started
+        self.engine_log_segments = 10       # Number of log segments kept
+        self.trace_spans = 0                # Trace spans kept for /rest/traces; 0 is off
 
     def load(self):
         self._load_config_file()
@@ -56,6 +67,15 @@ class EngineConfig:
         else:
             return self._config[section][key.lower()]
 
+    def _get_count(self, key: str, default: int) -> int:
+        """ An optional [ENGINE] integer that must be at least 1 """
+        value = _parse_int(self._get("ENGINE", key))
+        if value is None:
+            return default
+        if value < 1:
+            raise ValueError("[ENGINE] {} must be at least 1, not {}".format(key, value))
+        return value
+
     def _load_config_file(self):
         # Load configuration file
         if not os.path.isfile(self._config_file):
@@ -91,3 +111,22 @@ class EngineConfig:
             self.log_level = logging.INFO
 
         self.test_websocket_port = _parse_int(self._get("ENGINE", "TEST_WEBSOCKET_PORT"))
+        self.clock_precise = _parse_boolean(self._get("ENGINE", "CLOCK_PRECISE"))
+        self.persistence_backend = (
+            self._get("ENGINE", "PERSISTENCE_BACKEND") or self.persistence_backend).lower()
+        self.sqlite_path = self._get("ENGINE", "SQLITE_PATH")
+        self.packed_path = self._get("ENGINE", "PACKED_PATH")
+        self.subscription_mode = (
+            self._get("ENGINE", "SUBSCRIPTION_MODE") or self.subscription_mode).lower()
+        self.service_batch_window_ms = (
+            _parse_int(self._get("ENGINE", "SERVICE_BATCH_WINDOW_MS"))
+            or self.service_batch_window_ms)
+        self.rest_server = (self._get("ENGINE", "REST_SERVER") or self.rest_server).lower()
+        self.engine_log_dir = self._get("ENGINE", "ENGINE_LOG_DIR")
+        self.engine_log_segment_kb = self._get_count(
+            "ENGINE_LOG_SEGMENT_KB", self.engine_log_segment_kb)
+        self.engine_log_segments = self._get_count(
+            "ENGINE_LOG_SEGMENTS", self.engine_log_segments)
+        trace_spans = _parse_int(self._get("ENGINE", "TRACE_SPANS"))
+        if trace_spans is not None:
+            self.trace_spans = trace_spans
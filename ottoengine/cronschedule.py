@@ -0,0 +1,220 @@
+import datetime
+import pytz
+
+from ottoengine import helpers
+
+# Allowed (low, high) values for each cron field
+MINUTE_RANGE = (0, 59)
+HOUR_RANGE = (0, 23)
+DAY_OF_MONTH_RANGE = (1, 31)
+MONTH_RANGE = (1, 12)
+WEEKDAY_RANGE = (0, 7)     # 0-6 is Sun to Sat; 7 is also Sun
+
+MONTH_NAMES = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12
+}
+WEEKDAY_NAMES = {"sun": 0, "mon": 1, "tue": 2, "wed": 3, "thu": 4, "fri": 5, "sat": 6}
+
+# Give up searching for a matching time after this many years (i.e. Feb 30th)
+MAX_YEARS_BETWEEN_MATCHES = 50
+
+
+def parse_field(value, value_range, names=None) -> int:
+    """Expands a cron field into a bitset of the allowed values.
+    Supports *, single values, names, a-b ranges, */n and a-b/n steps, and comma lists.
+
+        :param value: The field value (int, str or None). None means *
+        :param tuple value_range: (low, high) allowed values for the field
+        :param dict names: Optional mapping of lowercase names to values
+        :rtype: int
+    """
+    low, high = value_range
+    if value is None:
+        value = "*"
+
+    mask = 0
+    for part in str(value).lower().split(","):
+        part = part.strip()
+        step = 1
+        has_step = "/" in part
+        if has_step:
+            part, step_str = part.split("/", 1)
+            step = _parse_int(step_str, None)
+            if step < 1:
+                raise helpers.ValidationError("Cron step must be positive: {}".format(value))
+
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start_str, end_str = part.split("-", 1)
+            start = _parse_int(start_str, names)
+            end = _parse_int(end_str, names)
+        else:
+            start = _parse_int(part, names)
+            # a/n means a through the end of the range, every n
+            end = high if has_step else start
+
+        if start < low or end > high or start > end:
+            raise helpers.ValidationError(
+                "Cron field is out of range {}-{}: {}".format(low, high, value))
+
+        for v in range(start, end + 1, step):
+            mask |= 1 << v
+
+    return mask
+
+
+def _parse_int(value_str: str, names) -> int:
+    value_str = value_str.strip()
+    if names is not None and value_str in names:
+        return names[value_str]
+    try:
+        return int(value_str)
+    except ValueError:
+        raise helpers.ValidationError("Cron field value is not valid: {}".format(value_str))
+
+
+def _next_set_bit_table(mask: int, value_range: tuple) -> list:
+    """Returns a table where table[v] is the smallest allowed value >= v, or None"""
+    low, high = value_range
+    table = [None] * (high + 2)
+    nxt = None
+    for v in range(high, -1, -1):
+        if (mask >> v) & 1:
+            nxt = v
+        table[v] = nxt
+    return table
+
+
+def _full_mask(value_range: tuple) -> int:
+    low, high = value_range
+    return ((1 << (high + 1)) - 1) & ~((1 << low) - 1)
+
+
+class CronSchedule(object):
+    """A cron specification pre-expanded into bitsets, with its tzinfo resolved once.
+
+    Fires at every instant whose local wall-clock time in the schedule's timezone
+    matches, which gives the same next fire times as croniter for the syntax it
+    supports, except as below. When both day_of_month and weekdays are restricted, a day matches if
+    either one matches (as in cron).
+
+    Around DST changes:
+    - A wall-clock time repeated when the clocks go back fires both times.
+    - A wall-clock time skipped when the clocks go forward is read as standard time,
+      so 2:30 fires at 3:30 DST that day.
+
+    croniter (0.3.x) agrees when the hour isn't restricted, but is an hour off for times
+    with a fixed hour on the days the clocks change: 18:30 fires at 17:30 the day they
+    go back, and 2:30 at 1:30 standard time the day they go forward.
+    """
+
+    def __init__(self, tz_name, minute=None, hour=None, day_of_month=None, month=None,
+                 weekdays=None):
+        self._tz = pytz.timezone(tz_name)
+
+        self._minutes = parse_field(minute, MINUTE_RANGE)
+        self._hours = parse_field(hour, HOUR_RANGE)
+        self._days = parse_field(day_of_month, DAY_OF_MONTH_RANGE)
+        self._months = parse_field(month, MONTH_RANGE, MONTH_NAMES)
+        self._weekdays = parse_field(weekdays, WEEKDAY_RANGE, WEEKDAY_NAMES)
+
+        # Sunday may be written as 0 or 7
+        if self._weekdays & (1 << 7):
+            self._weekdays = (self._weekdays | 1) & ~(1 << 7)
+
+        self._next_minute = _next_set_bit_table(self._minutes, MINUTE_RANGE)
+        self._next_hour = _next_set_bit_table(self._hours, HOUR_RANGE)
+        self._days_restricted = self._days != _full_mask(DAY_OF_MONTH_RANGE)
+        self._weekdays_restricted = self._weekdays != _full_mask((0, 6))
+
+    @property
+    def tzinfo(self):
+        return self._tz
+
+    def next_time_from(self, dt: datetime.datetime) -> datetime.datetime:
+        """Returns the first fire time strictly after dt, in the schedule's timezone"""
+        local = dt.astimezone(self._tz)
+        naive = local.replace(tzinfo=None, second=0, microsecond=0)
+        result = self._next_instant(naive, dt)
+
+        # In the first pass through an hour the clocks are about to repeat, the times
+        # already passed come round again, an hour later
+        dst = local.dst()
+        if dst and (dt + dst).astimezone(self._tz).dst() != dst:
+            repeated = self._next_instant(naive - dst, dt, last_naive=naive)
+            if repeated is not None and repeated < result:
+                return repeated
+        return result
+
+    def _next_instant(self, naive: datetime.datetime, dt: datetime.datetime,
+                      last_naive: datetime.datetime = None) -> datetime.datetime:
+        """Returns the first fire time after dt at a wall-clock time after naive, or None
+        if there is none up to last_naive"""
+        while True:
+            naive = self._next_naive(naive + datetime.timedelta(minutes=1))
+            if last_naive is not None and naive > last_naive:
+                return None
+            for result in self._instants(naive):
+                if result > dt:
+                    return result
+
+    def _instants(self, naive: datetime.datetime) -> list:
+        """The instants with a local wall-clock time, in order: two for a time the clocks
+        go back over, and for a time they skip, the instant it is in standard time"""
+        try:
+            return [self._tz.localize(naive, is_dst=None)]
+        except pytz.AmbiguousTimeError:
+            return [self._tz.localize(naive, is_dst=True), self._tz.localize(naive, is_dst=False)]
+        except pytz.NonExistentTimeError:
+            return [self._tz.normalize(self._tz.localize(naive, is_dst=False))]
+
+    def next_times_from(self, dt: datetime.datetime, count: int) -> list:
+        """Returns the next count fire times after dt
+        :rtype: list(datetime.datetime)
+        """
+        times = []
+        for i in range(count):
+            dt = self.next_time_from(dt)
+            times.append(dt)
+        return times
+
+    def _day_matches(self, naive: datetime.datetime) -> bool:
+        day_ok = (self._days >> naive.day) & 1
+        # Python's Monday is 0; cron's Sunday is 0
+        weekday_ok = (self._weekdays >> ((naive.weekday() + 1) % 7)) & 1
+        if self._days_restricted and self._weekdays_restricted:
+            return bool(day_ok or weekday_ok)
+        return bool(day_ok and weekday_ok)
+
+    def _next_naive(self, t: datetime.datetime) -> datetime.datetime:
+        """Returns the first matching naive local time at or after t"""
+        limit_year = t.year + MAX_YEARS_BETWEEN_MATCHES
+        while t.year <= limit_year:
+            if not (self._months >> t.month) & 1:
+                if t.month == 12:
+                    t = datetime.datetime(t.year + 1, 1, 1)
+                else:
+                    t = datetime.datetime(t.year, t.month + 1, 1)
+                continue
+
+            if not self._day_matches(t):
+                t = datetime.datetime(t.year, t.month, t.day) + datetime.timedelta(days=1)
+                continue
+
+            hour = self._next_hour[t.hour]
+            if hour is None:
+                t = datetime.datetime(t.year, t.month, t.day) + datetime.timedelta(days=1)
+                continue
+            if hour != t.hour:
+                t = t.replace(hour=hour, minute=0)
+
+            minute = self._next_minute[t.minute]
+            if minute is None:
+                t = t.replace(minute=0) + datetime.timedelta(hours=1)
+                continue
+            return t.replace(minute=minute)
+
+        raise helpers.ValidationError(
+            "No matching time within {} years".format(MAX_YEARS_BETWEEN_MATCHES))
@@ -2,9 +2,11 @@ import asyncio
 import logging
 import signal
 import sys
+import time
 import traceback
 
 from ottoengine import state, const, persistence, config, helpers, enginelog, hass_websocket_client
+from ottoengine import listener_index, subscriptions, service_dispatcher, metrics, tracing
 from ottoengine.model import dataobjects, trigger_objects, rule_objects, action_objects
 from ottoengine.fibers import clock, hass_websocket_reader
 from ottoengine.testing import test_websocket
@@ -32,11 +34,34 @@ class OttoEngine(object):
 
         self._websocket = None
         self._fiber_websocket_reader = None
+        self._setup_complete = False   # Set once the clock is running and rules are loaded
 
         self._states = state.OttoEngineState()
+        # Publish entity state snapshots for the REST API at most once per loop iteration
+        self._states.set_publish_scheduler(self._loop.call_soon)
 
-        self._event_listeners = {}     # Provide a way to lookup listeners by event_type
-        self._time_listeners = []     # Just keeps track of the IDs so we can remove during reload
+        self._time_listeners = set()  # Just keeps track of the IDs so we can remove during reload
+        self._rule_listeners = {}     # rule_id -> [HassListener] registered for that rule
+
+        # Find only the listeners whose triggers match an event
+        self._state_listener_index = listener_index.StateListenerIndex()
+        self._event_listener_index = listener_index.EventListenerIndex()
+
+        # What the rules need from Home Assistant, and the subscriptions made for it
+        self._rule_subscriptions = subscriptions.RuleSubscriptions(config.subscription_mode)
+        self._subscription_ids = {}   # ("event", type) or ("entity", id) -> subscription id
+
+        # Merge the service calls made within a short window; disabled when it is 0
+        self._service_dispatcher = None
+        if config.service_batch_window_ms:
+            self._service_dispatcher = service_dispatcher.ServiceCallDispatcher(
+                self._async_send_service_call, config.service_batch_window_ms / 1000.0)
+
+        # Outcome counters of each rule, and how long events take to get through each stage
+        self._rule_metrics = metrics.RuleMetrics()
+
+        # Traces of events through the rules they invoke to their service calls; None is off
+        self._tracer = tracing.Tracer(config.trace_spans) if config.trace_spans else None
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~
     #   Engine's Public API
@@ -50,6 +75,56 @@ class OttoEngine(object):
     def englog(self):
         return self._enginelog
 
+    @property
+    def state_listener_index(self) -> listener_index.StateListenerIndex:
+        return self._state_listener_index
+
+    @property
+    def event_listener_index(self) -> listener_index.EventListenerIndex:
+        return self._event_listener_index
+
+    @property
+    def metrics(self) -> metrics.RuleMetrics:
+        return self._rule_metrics
+
+    @property
+    def tracer(self) -> tracing.Tracer:
+        return self._tracer
+
+    def get_stats(self) -> dict:
+        """ The stats of the engine's parts, by part. Parts not running yet are None.
+        Reads the parts' state, so call it from the event loop.
+        :rtype: dict
+        """
+        reader = self._fiber_websocket_reader
+        snapshot = self._states.snapshot()
+        return {
+            "clock_lag": self._clock.get_lag_stats(),
+            "state_listener_index": self._state_listener_index.get_stats(),
+            "event_listener_index": self._event_listener_index.get_stats(),
+            "subscriptions": self._rule_subscriptions.get_stats(),
+            "message_decoder": reader.decoder.get_stats() if reader is not None else None,
+            "websocket_rtt": (
+                self._websocket.get_rtt_stats() if self._websocket is not None else None),
+            "service_dispatcher": (
+                self._service_dispatcher.get_stats()
+                if self._service_dispatcher is not None else None),
+            "entity_snapshot": {"version": snapshot.version, "entities": len(snapshot)},
+            "engine_log": {"last_seq": self._enginelog.last_seq},
+            "tracer": self._tracer.get_stats() if self._tracer is not None else None,
+            "rule_load_seconds": self._persistence_mgr.get_load_times(),
+        }
+
+    def get_traces(self, **filters) -> list:
+        '''Takes the same filters as Tracer.get_traces(); [] when tracing is off'''
+        if self._tracer is None:
+            return []
+        return self._tracer.get_traces(**filters)
+
+    def get_metrics_text(self) -> str:
+        '''The rule metrics and engine stats in Prometheus text format'''
+        return metrics.format_prometheus(self._rule_metrics, self.get_stats())
+
     def start_engine(self):
         '''Starts the Otto Engine until it is shutdown'''
 
@@ -80,37 +155,97 @@ class OttoEngine(object):
             _LOG.debug("[Event] entity_id: {}, new_state: {}, attributes: {}".format(
                 event.entity_id, event.new_state_obj.state, event.new_state_obj.attributes))
 
-            entity_listeners = self._event_listeners.get(event.entity_id)
-            if entity_listeners is not None:
-                for listener in entity_listeners:
-                    _LOG.info("Invoking trigger: rule {}, entity: {}".format(
-                            listener.rule.id, event.entity_id))
-                    listeners.append(listener)
+            for listener in self._state_listener_index.match(event):
+                _LOG.info("Invoking trigger: rule {}, entity: {}".format(
+                        listener.rule.id, event.entity_id))
+                listeners.append(listener)
 
         elif isinstance(event, dataobjects.HassEvent):
             _LOG.debug(
                 "[Event] event_type: {}, event_data: {}".format(event.event_type, event.data_obj))
 
-            event_listeners = self._event_listeners.get(event.event_type)
-            if event_listeners is not None:
-                for listener in event_listeners:
-                    _LOG.info("Invoking trigger: rule {}, event_type: {}".format(
-                            listener.rule.id, event.event_type))
-                    listeners.append(listener)
+            for listener in self._event_listener_index.match(event, self._count_rejected):
+                _LOG.info("Invoking trigger: rule {}, event_type: {}".format(
+                        listener.rule.id, event.event_type))
+                listeners.append(listener)
+
+        # The event's span is only kept if one of the rules' triggers passes
+        if listeners and event.trace is not None:
+            event.trace.finish(keep=False, listeners=len(listeners))
 
         # The trigger_function is a reference to an async_handle_trigger() function
         # created from rule_objects.get_XXX_listeners()
+        # The indexes only return listeners whose triggers pass, so they aren't evaluated again
         for listener in listeners:
-            self._loop.create_task(
-                async_invoke_rule(self, listener.rule, trigger=listener.trigger, event=event))
+            self._loop.create_task(async_invoke_rule(
+                self, listener.rule, trigger=listener.trigger, event=event, trigger_checked=True))
+
+    def _count_rejected(self, listener):
+        ''' Counts an event trigger the index evaluated and rejected, as the rule would have '''
+        if listener.rule.enabled:
+            self._rule_metrics.finish(listener.rule.id, metrics.TRIGGER_REJECTED, 0.0)
+
+    def wants_event_type(self, event_type: str) -> bool:
+        ''' False if events of this type can be dropped before they are decoded '''
+        return (
+            event_type == const.STATE_CHANGED
+            or self._event_listener_index.has_listeners(event_type)
+        )
 
-    async def call_service(self, service_call: dataobjects.ServiceCall):
-        await self._websocket.async_call_service(service_call)
+    async def call_service(self, service_call: dataobjects.ServiceCall) -> bool:
+        '''Returns True if Home Assistant reports the service call succeeded'''
+        if self._service_dispatcher is not None:
+            result = await self._service_dispatcher.async_call(service_call)
+        else:
+            result = await self._async_send_service_call(service_call)
         self.englog.add(enginelog.SERVICE_CALLED, service_call.serialize())
 
+        if not result.get("success"):
+            _LOG.error("Service call {}.{} failed: {}".format(
+                service_call.domain, service_call.service, result.get("error")))
+            self.englog.add(enginelog.ERROR, {
+                "service_call": service_call.serialize(),
+                "error": result.get("error")
+            })
+            return False
+        return True
+
+    async def _async_send_service_call(self, service_call: dataobjects.ServiceCall) -> dict:
+        try:
+            return await self._websocket.async_call_service(service_call)
+        except hass_websocket_client.WebSocketError as e:
+            return {"success": False, "error": {"message": str(e)}}
+
+    def apply_entity_states(self, entity_states: list) -> int:
+        '''Applies a full get_states result to the engine's state.
+
+        Only entities that differ from the stored state are updated. An entity whose
+        state changed from a known one (i.e. while the websocket was disconnected) gets
+        a synthetic StateChangedEvent, so rules see the change. Returns the number of
+        entities updated.
+            :param list(dataobjects.EntityState) entity_states:
+        '''
+        updated = 0
+        with self._states.batch_update():
+            for new_state in entity_states:
+                old_state = self._states.get_entity_state(new_state.entity_id, warn=False)
+                if old_state is None:
+                    self._states.set_entity_state(new_state.entity_id, new_state)
+                elif not old_state.is_equal(new_state):
+                    self.process_event(dataobjects.StateChangedEvent(
+                        new_state.entity_id, old_state, new_state, helpers.nowutc()))
+                else:
+                    continue
+                updated += 1
+        return updated
+
     def websocket_fiber_ending(self):
-        _LOG.warn("Websocket Fiber has ended...restarting Engine setup")
-        self._loop.create_task(self._async_setup_engine())
+        if self._setup_complete:
+            _LOG.warn("Websocket Fiber has ended...reconnecting")
+            self._loop.create_task(self._async_reconnect())
+        else:
+            _LOG.warn("Websocket Fiber has ended...restarting Engine setup")
+            self._loop.create_task(self._async_setup_engine())
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     #                       Threadsafe methods
@@ -121,17 +256,14 @@ class OttoEngine(object):
         return asyncio.run_coroutine_threadsafe(
             self._async_get_state(group, key), self._loop).result(ASYNC_TIMEOUT_SECS)
 
+    # Entity states are read from the latest published snapshot, which is immutable,
+    # so these don't need to wait on the event loop
+
     def get_entity_state_threadsafe(self, entity_id):
-        async def _async_get_entity_state():
-            return self.states.get_entity_state(entity_id)
-        return asyncio.run_coroutine_threadsafe(
-            _async_get_entity_state(), self._loop).result(ASYNC_TIMEOUT_SECS)
+        return self.states.snapshot().get(entity_id)
 
-    def get_all_entity_state_threadsafe(self):
-        async def _async_get_all_entity_state():
-            return self.states.get_all_entity_state_copy()
-        return asyncio.run_coroutine_threadsafe(
-            _async_get_all_entity_state(), self._loop).result(ASYNC_TIMEOUT_SECS)
+    def get_all_entity_state_threadsafe(self) -> state.EntityStateSnapshot:
+        return self.states.snapshot()
 
     def get_rules_threadsafe(self) -> list:
         async def _async_get_rules():
@@ -146,20 +278,15 @@ class OttoEngine(object):
             _async_get_rule(rule_id), self._loop).result(ASYNC_TIMEOUT_SECS)
 
     def delete_rule_threadsafe(self, rule_id) -> bool:
-        async def _async_delete_rule(rule_id):
-            return self._persistence_mgr.delete_rule(rule_id)
         return asyncio.run_coroutine_threadsafe(
-            _async_delete_rule(rule_id), self._loop).result(ASYNC_TIMEOUT_SECS)
+            self._async_delete_rule(rule_id), self._loop).result(ASYNC_TIMEOUT_SECS)
 
     def reload_rules_threadsafe(self) -> bool:
         return asyncio.run_coroutine_threadsafe(
             self._async_reload_rules(), self._loop).result(ASYNC_TIMEOUT_SECS)
 
     def get_entities_threadsafe(self) -> list:
-        async def _async_get_entites():
-            return self.states.get_entities()
-        return asyncio.run_coroutine_threadsafe(
-            _async_get_entites(), self._loop).result(ASYNC_TIMEOUT_SECS)
+        return self.states.get_entities()
 
     def get_services_threadsafe(self) -> list:
         async def _async_get_services():
@@ -167,37 +294,29 @@ class OttoEngine(object):
         return asyncio.run_coroutine_threadsafe(
             _async_get_services(), self._loop).result(ASYNC_TIMEOUT_SECS)
 
-    def get_logs_threadsafe(self) -> list:
+    def get_logs_threadsafe(self, **filters) -> list:
+        '''Takes the same filters as EngineLog.get_logs()'''
         async def _async_get_logs():
-            return self.englog.get_logs()
+            return self.englog.get_logs(**filters)
         return asyncio.run_coroutine_threadsafe(
             _async_get_logs(), self._loop).result(ASYNC_TIMEOUT_SECS)
 
-    def save_rule_threadsafe(self, rule_dict):
-        async def _async_save_rule(rule_dict):
-            '''
-            Returns { success: True } if successful,
-            or { success: False, message: message } if unsuccessful.
-            '''
-            result = self._persistence_mgr.rule_from_dict(rule_dict)
-            if not result.get("success"):
-                return result
-
-            rule = result.get("rule")
-            try:
-                self._persistence_mgr.save_rule(rule)
-            except Exception as e:
-                message = "Exception saving rule: {}: {}".format(
-                    sys.exc_info()[0], sys.exc_info()[1])
-                _LOG.error(message)
-                traceback.print_exc()
-                return {"success": False, "message": message}
-
-            self.states.add_rule(rule)  # This will overwrite any previous rule with this ID
-            return {"success": True}
+    def get_traces_threadsafe(self, **filters) -> list:
+        '''Takes the same filters as Tracer.get_traces(); [] when tracing is off'''
+        async def _async_get_traces():
+            return self.get_traces(**filters)
+        return asyncio.run_coroutine_threadsafe(
+            _async_get_traces(), self._loop).result(ASYNC_TIMEOUT_SECS)
 
+    def get_metrics_text_threadsafe(self) -> str:
+        async def _async_get_metrics_text():
+            return self.get_metrics_text()
         return asyncio.run_coroutine_threadsafe(
-            _async_save_rule(rule_dict), self._loop).result(ASYNC_TIMEOUT_SECS)
+            _async_get_metrics_text(), self._loop).result(ASYNC_TIMEOUT_SECS)
+
+    def save_rule_threadsafe(self, rule_dict):
+        return asyncio.run_coroutine_threadsafe(
+            self._async_save_rule(rule_dict), self._loop).result(ASYNC_TIMEOUT_SECS)
 
     def check_timespec_threadsafe(self, spec_dict):
         try:
@@ -209,6 +328,21 @@ class OttoEngine(object):
             return {"success": False, "message": message}
         return {"success": True, "next_time": next_time}
 
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    #                       Coroutines
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # These are to be awaited by callers running on the engine's event loop,
+    # i.e. the async REST server, which otherwise reads engine state directly
+
+    async def async_save_rule(self, rule_dict) -> dict:
+        return await self._async_save_rule(rule_dict)
+
+    async def async_delete_rule(self, rule_id) -> bool:
+        return await self._async_delete_rule(rule_id)
+
+    async def async_reload_rules(self) -> dict:
+        return await self._async_reload_rules()
+
     # ~~~~~~~~~~~~~~~~~~~~
     #   Private methods
     # ~~~~~~~~~~~~~~~~~~~~
@@ -229,6 +363,25 @@ class OttoEngine(object):
             _LOG.info("Starting testing websocket server")
             self._run_fiber(test_websocket.TestWebSocketServer(self._config.test_websocket_port))
 
+        await self._async_connect_websocket()
+        await self._websocket.async_get_all_state()
+        await self._websocket.async_get_all_services()
+
+        # Start the EngineClock
+        self._run_fiber(self._clock)
+
+        # Load the Automation Rules
+        await self._async_reload_rules()
+        self._setup_complete = True
+
+    async def _async_reconnect(self):
+        '''Reconnects the websocket, keeping the clock, rules and listeners as they are.
+        The get_states result is applied as a diff by apply_entity_states().
+        '''
+        await self._async_connect_websocket()
+        await self._websocket.async_get_all_state()
+
+    async def _async_connect_websocket(self):
         # Initialize the websocket
         self._websocket = hass_websocket_client.AsyncHassWebsocket(
             self._config.hass_host, self._config.hass_port,
@@ -236,6 +389,7 @@ class OttoEngine(object):
         )
         self._fiber_websocket_reader = hass_websocket_reader.HassWebSocketReader(
             self, self._websocket)
+        self._subscription_ids = {}   # Subscriptions end with the old connection
 
         # Run the Websocket Reader Fiber
         self._run_fiber(self._fiber_websocket_reader)
@@ -245,23 +399,53 @@ class OttoEngine(object):
             _LOG.info("Waiting for Websocket Fiber to connect")
             await asyncio.sleep(3)
 
-        await self._websocket.async_subscribe_events(const.STATE_CHANGED)
-        # await self._websocket.async_subscribe_events("call_service");
-        await self._websocket.async_subscribe_events("timer_ended")
-        await self._websocket.async_get_all_state()
-        await self._websocket.async_get_all_services()
+        await self._async_update_subscriptions()
 
-        # Start the EngineClock
-        self._run_fiber(self._clock)
+    async def _async_update_subscriptions(self):
+        '''Subscribes to what the loaded rules need and unsubscribes from what they no
+        longer need. Only the differences are sent, so it is cheap to call after every
+        rule change.
+        '''
+        if self._websocket is None or not self._websocket.connected:
+            return
 
-        # Load the Automation Rules
-        await self._async_reload_rules()
+        wanted = set(("event", event_type)
+                     for event_type in self._rule_subscriptions.get_event_types())
+        wanted.update(("entity", entity_id)
+                      for entity_id in self._rule_subscriptions.get_entity_ids())
+
+        for key in set(self._subscription_ids) - wanted:
+            subscription_id = self._subscription_ids.pop(key)
+            if subscription_id is not None:
+                await self._websocket.async_unsubscribe_events(subscription_id)
+
+        for key in wanted - set(self._subscription_ids):
+            self._subscription_ids[key] = None   # Pending, so a concurrent update skips it
+            kind, value = key
+            if kind == "event":
+                subscription_id = await self._websocket.async_subscribe_events(value)
+            else:
+                subscription_id = await self._websocket.async_subscribe_trigger(
+                    {"platform": "state", "entity_id": value})
 
-    async def _async_load_rules(self):
+            if key in self._subscription_ids:
+                self._subscription_ids[key] = subscription_id
+            else:
+                # No longer wanted by the time the subscription was sent
+                await self._websocket.async_unsubscribe_events(subscription_id)
+
+        _LOG.info("Subscriptions: {} event types, {} entities".format(
+            len([key for key in self._subscription_ids if key[0] == "event"]),
+            len([key for key in self._subscription_ids if key[0] == "entity"])))
+
+    async def _async_read_rules(self) -> list:
         _LOG.info("Loading rules from persistence")
 
-        rules = self._persistence_mgr.get_rules(self._config.json_rules_dir)
+        rules = await self._persistence_mgr.async_get_rules(self._config.json_rules_dir)
         _LOG.info("{} rules found in {}".format(len(rules), self._config.json_rules_dir))
+        return rules
+
+    async def _async_load_rules(self, rules: list):
         for rule in rules:
             await self._async_load_rule(rule)
 
@@ -272,23 +456,58 @@ class OttoEngine(object):
             # Add rule to State
             self.states.add_rule(rule)
 
+    async def _async_save_rule(self, rule_dict):
+        '''
+        Returns { success: True } if successful,
+        or { success: False, message: message } if unsuccessful.
+        '''
+        result = self._persistence_mgr.rule_from_dict(rule_dict)
+        if not result.get("success"):
+            return result
+
+        rule = result.get("rule")
+        try:
+            self._persistence_mgr.save_rule(rule)
+        except Exception as e:
+            message = "Exception saving rule: {}: {}".format(
+                sys.exc_info()[0], sys.exc_info()[1])
+            _LOG.error(message)
+            traceback.print_exc()
+            return {"success": False, "message": message}
+
+        # Swap only this rule's listeners. There is no await between unloading and
+        # loading, so no event is processed while the rule is unregistered.
+        self._unload_listeners(rule.id)
+        await self._async_load_rule(rule)  # This will overwrite any previous rule with this ID
+        await self._async_update_subscriptions()
+        return {"success": True}
+
+    async def _async_delete_rule(self, rule_id) -> bool:
+        '''Returns True if the rule's file existed'''
+        self._unload_listeners(rule_id)
+        self.states.remove_rule(rule_id)
+        await self._async_update_subscriptions()
+        return self._persistence_mgr.delete_rule(rule_id)
+
     def _load_listeners(self, rule: rule_objects.AutomationRule):
 
+            if not rule.enabled:
+                _LOG.info("Rule {} is not enabled, not adding its listeners".format(rule.id))
+                return
+
+            self._rule_subscriptions.add_rule(rule)
+            rule_listeners = self._rule_listeners.setdefault(rule.id, [])
             for listener in rule_objects.get_listeners(rule):
 
                 # State and Event triggers
                 if isinstance(listener.trigger, trigger_objects.ListenerTrigger):
-                    if isinstance(listener.trigger, trigger_objects.EventTrigger):
-                        listener_id = listener.trigger.event_type
-                    elif isinstance(listener.trigger,
-                                    (trigger_objects.StateTrigger,
-                                     trigger_objects.NumericStateTrigger)):
-                        listener_id = listener.trigger.entity_id
+                    listener_id = _listener_id(listener.trigger)
                     _LOG.info("Adding listener for {} (rule: {})".format(listener_id, rule.id))
-                    if listener_id in self._event_listeners:
-                        self._event_listeners[listener_id].append(listener)
+                    if isinstance(listener.trigger, trigger_objects.EventTrigger):
+                        self._event_listener_index.add(listener)
                     else:
-                        self._event_listeners[listener_id] = [listener]
+                        self._state_listener_index.add(listener)
+                    rule_listeners.append(listener)
 
                 # Time triggers
                 if isinstance(listener.trigger, trigger_objects.TimeTrigger):
@@ -305,27 +524,52 @@ class OttoEngine(object):
                         helpers.nowutc()
                     )
                     # Add reference so we can find the listener id to remove it
-                    self._time_listeners.append(listener.trigger.id)
+                    self._time_listeners.add(listener.trigger.id)
+                    rule_listeners.append(listener)
+
+    def _unload_listeners(self, rule_id):
+        '''Removes only this rule's listeners, leaving every other rule registered'''
+        self._rule_subscriptions.remove_rule(rule_id)
+        for listener in self._rule_listeners.pop(rule_id, []):
+
+            # State and Event triggers
+            if isinstance(listener.trigger, trigger_objects.ListenerTrigger):
+                listener_id = _listener_id(listener.trigger)
+                _LOG.info("Removing listener for {} (rule: {})".format(listener_id, rule_id))
+                if isinstance(listener.trigger, trigger_objects.EventTrigger):
+                    self._event_listener_index.remove(listener)
+                else:
+                    self._state_listener_index.remove(listener)
 
-    async def _async_clear_rules(self):
-        _LOG.info("Clearing all registered state listeners")
-        self._state_listeners = {}
+            # Time triggers
+            if isinstance(listener.trigger, trigger_objects.TimeTrigger):
+                _LOG.info("Removing time listener: (rule: {}) {}".format(
+                        rule_id, listener.trigger.timespec.serialize()))
+                self._clock.remove_timespec_action(listener.trigger.id)
+                self._time_listeners.discard(listener.trigger.id)
 
-        _LOG.info("Clearing all registered event listeners")
-        self._event_listeners = {}
+    async def _async_clear_rules(self):
+        _LOG.info("Clearing all registered state and event listeners")
+        self._state_listener_index.clear()
+        self._event_listener_index.clear()
 
         _LOG.info("Clearing all registered time listeners")
         for listener_id in self._time_listeners:
             self._clock.remove_timespec_action(listener_id)
-        self._time_listeners = []
+        self._time_listeners = set()
+        self._rule_listeners = {}
+        self._rule_subscriptions.clear()
 
         _LOG.info("Clearing all registered rules")
         self.states.clear_rules()
 
     async def _async_reload_rules(self):
         try:
+            # Read the rules first, so the current rules stay registered while files load
+            rules = await self._async_read_rules()
             await self._async_clear_rules()
-            await self._async_load_rules()
+            await self._async_load_rules(rules)
+            await self._async_update_subscriptions()
         except Exception as e:
             message = "Exception reloading rules: {}: {}".format(
                 sys.exc_info()[0], sys.exc_info()[1])
@@ -350,26 +594,75 @@ class OttoEngine(object):
         self._states.get_state(group, key, value)
 
 
+def _listener_id(trigger: trigger_objects.ListenerTrigger) -> str:
+    '''What a State or Event trigger's listener listens to, for logging'''
+    if isinstance(trigger, trigger_objects.EventTrigger):
+        return trigger.event_type
+    return trigger.entity_id
+
+
 async def async_invoke_rule(engine_obj: OttoEngine, rule: rule_objects.AutomationRule,
-                            trigger=None, event: dataobjects.HassEvent = None):
+                            trigger=None, event: dataobjects.HassEvent = None,
+                            trigger_checked: bool = False):
+    '''
+        :param bool trigger_checked: The trigger already passed for this event (the listener
+            came from the listener indexes), so it isn't evaluated again
+    '''
+    rule_metrics = engine_obj.metrics
+    invoked = time.perf_counter()
+    # Stages are timed from when the websocket received the event, if it did
+    received = event.received if event is not None and event.received is not None else invoked
+    # The rule's span of the event's trace is only kept if the trigger passes
+    span = None
+    if event is not None and event.trace is not None:
+        span = event.trace.child(tracing.RULE, rule=rule.id)
+    try:
+        outcome = await _async_run_rule(
+            engine_obj, rule, trigger, event, received, span, trigger_checked)
+    except Exception:
+        rule_metrics.finish(rule.id, metrics.ERRORED, time.perf_counter() - invoked)
+        if span is not None:
+            span.finish(outcome=metrics.COUNTER_NAMES[metrics.ERRORED])
+        raise
+    if outcome is None or outcome == metrics.TRIGGER_REJECTED:
+        if span is not None:
+            span.finish(keep=False)
+        if outcome is not None:
+            rule_metrics.finish(rule.id, outcome, 0.0)
+        return
+    if span is not None:
+        span.finish(outcome=metrics.COUNTER_NAMES[outcome])
+    now = time.perf_counter()
+    rule_metrics.finish(rule.id, outcome, now - invoked)
+    if outcome == metrics.COMPLETED:
+        rule_metrics.record_stage(metrics.STAGE_COMPLETED, now - received)
+
+
+async def _async_run_rule(engine_obj: OttoEngine, rule: rule_objects.AutomationRule,
+                          trigger, event: dataobjects.HassEvent, received: float,
+                          span: tracing.Span = None, trigger_checked: bool = False) -> int:
+    '''Runs the rule, returning its outcome counter (see metrics), or None if disabled'''
+    rule_metrics = engine_obj.metrics
     _LOG = logging.getLogger(__name__)
     _LOG.setLevel(logging.DEBUG)
     _LOG.debug("invoke_rule called for rule {}".format(rule.id))
 
     if not rule.enabled:
         _LOG.debug("Rule {} is not enabled".format(rule.id))
-        return
+        return None
 
     # Evaluate Trigger
     if trigger is not None:
         if isinstance(trigger, trigger_objects.ListenerTrigger) and (event is not None):
-            if trigger.eval_trigger(event):
+            if trigger_checked or trigger.eval_trigger(event):
                 _LOG.debug("Rule {}'s trigger passed".format(rule.id))
+                rule_metrics.record_stage(
+                    metrics.STAGE_TRIGGER, time.perf_counter() - received)
                 engine_obj.englog.add(enginelog.TRIGGER_FIRED, {
                     "trigger": trigger.serialize()
-                })
+                }, rule_id=rule.id)
             else:
-                return  # This could happen a lot, so let's not log it
+                return metrics.TRIGGER_REJECTED  # This could happen a lot, so let's not log it
         else:
             _LOG.debug(
                 "Trigger is not a ListenerTrigger, or event is None on rule: ".format(rule.id))
@@ -377,22 +670,25 @@ async def async_invoke_rule(engine_obj: OttoEngine, rule: rule_objects.Automatio
     # Evaluate Rule Condition
     _LOG.debug("Checking for rule {}'s rule condition".format(rule.id))
     if rule.rule_condition is not None:
-        if rule.rule_condition.evaluate(engine_obj):
+        passed = rule.rule_condition.evaluate(engine_obj)
+        rule_metrics.record_stage(metrics.STAGE_CONDITION, time.perf_counter() - received)
+        if passed:
             _LOG.debug("Rule {}'s rule condition passed".format(rule.id))
             engine_obj.englog.add(enginelog.CONDITION_PASSED, {
                 "rule": rule.id,
                 "condition_type": "rule condition",
                 "condition": rule.rule_condition.serialize()
-            })
+            }, rule_id=rule.id)
         else:
             _LOG.debug("Rule {}'s rule condition is false: {}".format(
                 rule.id, rule.rule_condition.serialize()))
-            return
+            return metrics.CONDITION_FALSE
     else:
         _LOG.debug("Rule {} does not have a rule condition".format(rule.id))
 
     # Run Actions
     _LOG.debug("Proceeding to run rule {}'s action sequences".format(rule.id))
+    service_called = False
     for seqId, action_seq in enumerate(rule.actions):
         _LOG.debug("Running rule {}'s action seq# {}".format(rule.id, seqId))
 
@@ -407,7 +703,7 @@ async def async_invoke_rule(engine_obj: OttoEngine, rule: rule_objects.Automatio
                     "condition_type": "action condition",
                     "action_seq": seqId,
                     "condition": action_seq.action_condition.serialize()
-                })
+                }, rule_id=rule.id)
 
             else:
                 _LOG.debug(
@@ -416,22 +712,79 @@ async def async_invoke_rule(engine_obj: OttoEngine, rule: rule_objects.Automatio
                         rule.id, seqId, action_seq.action_condition.serialize()))
                 continue
 
-        # Run the action sequence
-        for actId, action in enumerate(action_seq.action_sequence):
+        # Run the action sequence, each action after the one before it has finished, so
+        # service calls reach Home Assistant in the order written. With batching on,
+        # consecutive calls the dispatcher would merge into one are handed to it together.
+        batching = engine_obj._service_dispatcher is not None
+        for actId, actions in _action_runs(action_seq.action_sequence, batching):
 
-            success = await action.async_execute(engine_obj)
-            if not success:
-                if isinstance(action, action_objects.ConditionAction):
+            if not service_called and isinstance(actions[0], action_objects.ServiceAction):
+                service_called = True
+                rule_metrics.record_stage(
+                    metrics.STAGE_FIRST_SERVICE_CALL, time.perf_counter() - received)
+
+            if len(actions) == 1:
+                results = [await _execute(actions[0], engine_obj, span)]
+            else:
+                results = await asyncio.gather(
+                    *[_execute(action, engine_obj, span) for action in actions])
+
+            if not all(results):
+                if isinstance(actions[0], action_objects.ConditionAction):
                     _LOG.debug(
                         ("Rule {} aborting action seq# {} due to false "
                             + "condition at action# {}").format(rule.id, seqId, actId))
-                else:
-                    _LOG.error(
-                        ("Rule {} aborting action seq# {} due to action "
-                            + "failure at action# {}").format(rule.id, seqId, actId))
-                return
+                    return metrics.CONDITION_FALSE
+                _LOG.error(
+                    ("Rule {} aborting action seq# {} due to action "
+                        + "failure at action# {}").format(
+                            rule.id, seqId, actId + results.index(False)))
+                return metrics.ERRORED
 
         _LOG.debug("Rule {}'s action seq# {} complete".format(rule.id, seqId))
 
     _LOG.debug("Rule {} processing completed".format(rule.id))
-    engine_obj.englog.add(enginelog.RULE_COMPLETED, {"rule": rule.id})
+    engine_obj.englog.add(enginelog.RULE_COMPLETED, {"rule": rule.id}, rule_id=rule.id)
+    return metrics.COMPLETED
+
+
+def _action_runs(action_sequence: list, batching: bool) -> list:
+    '''Splits an action sequence into [(index of first action, [actions])]. With batching
+    on, consecutive ServiceActions that make the same call on different entities share an
+    entry, since the dispatcher sends them as one call; every other action is its own.'''
+    runs = []
+    run_key = None
+    run_entity_ids = set()
+    for actId, action in enumerate(action_sequence):
+        merge = None
+        if batching and isinstance(action, action_objects.ServiceAction):
+            call = action.get_dict_config()
+            merge = service_dispatcher.merge_key(
+                call["domain"], call["service"], call.get("data") or {})
+        if (merge is not None and merge[0] == run_key
+                and run_entity_ids.isdisjoint(merge[1])):
+            runs[-1][1].append(action)
+            run_entity_ids.update(merge[1])
+            continue
+        runs.append((actId, [action]))
+        run_key = merge[0] if merge is not None else None
+        run_entity_ids = set(merge[1]) if merge is not None else set()
+    return runs
+
+
+def _execute(action: action_objects.RuleActionItem, engine_obj: OttoEngine, span: tracing.Span):
+    '''The action's async_execute() coroutine, under its own span when the rule is traced'''
+    if span is None:
+        return action.async_execute(engine_obj)
+    return _async_execute_traced(action, engine_obj, span.child(
+        tracing.ACTION, action=action.__class__.__name__))
+
+
+async def _async_execute_traced(action: action_objects.RuleActionItem, engine_obj: OttoEngine,
+                                span: tracing.Span) -> bool:
+    result = False
+    try:
+        result = await action.async_execute(engine_obj, span)
+        return result
+    finally:
+        span.finish(success=bool(result))
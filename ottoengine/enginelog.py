@@ -1,4 +1,6 @@
-from ottoengine import helpers
+import bisect
+import datetime
+import time
 
 EVENT = "event"
 ERROR = "error"
@@ -9,20 +11,55 @@ CONDITION_PASSED = "condition_passed"
 RULE_COMPLETED = "rule_completed"
 DEBUG = "debug"
 
+# Fields of a log record, which is stored as a tuple
+_SEQ = 0
+_TS = 1
+_TYPE = 2
+_RULE = 3
+_ENTRY = 4
+
 
 class EngineLog:
-    def __init__(self, max_logs=100):
-        self._log = []
+    """The most recent max_logs entries, in a fixed size ring buffer.
+
+    Each entry gets a sequence number one higher than the last, so a reader can ask for
+    only the entries newer than the last one it saw. Entries are also indexed by type and
+    by rule id, so a filtered query only visits the entries that match.
+
+    If a sink is given (see log_sink.LogSink), every entry is also passed to its write().
+    """
+
+    def __init__(self, max_logs=100, sink=None):
         self._max_logs = max_logs
+        self._sink = sink
+        self._ring = [None] * max_logs
+        self._next_seq = 1
+        self._count = 0
+        self._type_index = {}   # logtype -> _SeqIndex
+        self._rule_index = {}   # rule id -> _SeqIndex
+
+    @property
+    def last_seq(self) -> int:
+        '''The sequence number of the newest entry, or 0 if nothing has been logged'''
+        return self._next_seq - 1
+
+    def add(self, logtype: str, logentry: dict, rule_id: str = None):
+        seq = self._next_seq
+        self._next_seq += 1
+        record = (seq, time.time(), logtype, rule_id, logentry)
+        if self._sink is not None:
+            self._sink.write(record)
+        if self._max_logs <= 0:
+            return
 
-    def add(self, logtype: str, logentry: dict):
-        if self._max_logs > 0:
-            self._log.append({
-                "ts": str(helpers.nowutc()),
-                "type": logtype,
-                "entry": logentry,
-            })
-            self._trim_log()
+        if self._count == self._max_logs:
+            self._evict(self._ring[seq % self._max_logs])
+        else:
+            self._count += 1
+        self._ring[seq % self._max_logs] = record
+        _index_for(self._type_index, logtype).append(seq)
+        if rule_id is not None:
+            _index_for(self._rule_index, rule_id).append(seq)
 
     def add_event(self, event_name: str, event_data: dict=None):
         self.add(EVENT, {
@@ -35,13 +72,113 @@ class EngineLog:
             "message": error_msg
         })
 
-    def get_logs(self):
-        return self._log.copy()
+    def get_logs(self, since: int = None, logtype: str = None, rule_id: str = None,
+                 limit: int = None) -> list:
+        """ Returns the entries, oldest first, as dicts of seq, ts, type, rule (if the entry
+        is for a rule) and entry.
+        :param int since: only entries with a higher sequence number
+        :param str logtype: only entries of this type
+        :param str rule_id: only entries for this rule
+        :param int limit: at most this many entries (the oldest ones that match)
+        :rtype: list(dict)
+        """
+        since = max(since or 0, self._next_seq - 1 - self._count)
+        seqs = self._matching_seqs(since, logtype, rule_id)
+
+        records = []
+        for seq in seqs:
+            record = self._ring[seq % self._max_logs]
+            if logtype is not None and record[_TYPE] != logtype:
+                continue
+            if rule_id is not None and record[_RULE] != rule_id:
+                continue
+            records.append(record)
+            if limit is not None and len(records) >= limit:
+                break
+        return [_record_dict(record) for record in records]
 
     def set_max_logs(self, max_logs):
+        records = [self._ring[seq % self._max_logs] for seq in self._matching_seqs(0)]
+        keep = records[max(0, len(records) - max_logs):] if max_logs > 0 else []
+
         self._max_logs = max_logs
-        self._trim_log()
+        self._ring = [None] * max_logs
+        self._count = 0
+        self._type_index = {}
+        self._rule_index = {}
+        for record in keep:
+            self._ring[record[_SEQ] % max_logs] = record
+            self._count += 1
+            _index_for(self._type_index, record[_TYPE]).append(record[_SEQ])
+            if record[_RULE] is not None:
+                _index_for(self._rule_index, record[_RULE]).append(record[_SEQ])
+
+    def _matching_seqs(self, since: int, logtype: str = None, rule_id: str = None):
+        '''Sequence numbers after since, from the smallest index that covers the query'''
+        indexes = []
+        if logtype is not None:
+            indexes.append(self._type_index.get(logtype))
+        if rule_id is not None:
+            indexes.append(self._rule_index.get(rule_id))
+        if None in indexes:
+            return []
+        if indexes:
+            return min(indexes, key=len).since(since)
+        oldest = self._next_seq - self._count
+        return range(max(since + 1, oldest), self._next_seq)
+
+    def _evict(self, record):
+        _evict_from(self._type_index, record[_TYPE])
+        if record[_RULE] is not None:
+            _evict_from(self._rule_index, record[_RULE])
+
+
+class _SeqIndex(object):
+    """Ascending sequence numbers of the entries with one type or rule id.
+    Entries leave in the order they were added, so the oldest is dropped from the front."""
+
+    def __init__(self):
+        self._seqs = []
+        self._start = 0
+
+    def __len__(self):
+        return len(self._seqs) - self._start
+
+    def append(self, seq: int):
+        self._seqs.append(seq)
+
+    def pop_oldest(self):
+        self._start += 1
+        # Compact now and then, rather than paying for a list delete on every eviction
+        if self._start >= 64 and self._start * 2 >= len(self._seqs):
+            del self._seqs[:self._start]
+            self._start = 0
+
+    def since(self, seq: int) -> list:
+        return self._seqs[bisect.bisect_right(self._seqs, seq, self._start):]
+
+
+def _index_for(indexes: dict, key) -> _SeqIndex:
+    index = indexes.get(key)
+    if index is None:
+        index = indexes[key] = _SeqIndex()
+    return index
+
+
+def _evict_from(indexes: dict, key):
+    index = indexes[key]
+    index.pop_oldest()
+    if len(index) == 0:
+        del indexes[key]
+
 
-    def _trim_log(self):
-        while len(self._log) > self._max_logs:
-            del self._log[0]
+def _record_dict(record: tuple) -> dict:
+    entry = {
+        "seq": record[_SEQ],
+        "ts": str(datetime.datetime.fromtimestamp(record[_TS], datetime.timezone.utc)),
+        "type": record[_TYPE],
+        "entry": record[_ENTRY],
+    }
+    if record[_RULE] is not None:
+        entry["rule"] = record[_RULE]
+    return entry
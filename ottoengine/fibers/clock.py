@@ -1,12 +1,14 @@
 import asyncio
 import croniter
 import datetime
+import heapq
 import inspect
+import itertools
 import pytz
 import logging
 # import pytz
 
-from ottoengine import fibers, helpers
+from ottoengine import cronschedule, fibers, helpers
 
 _LOG = logging.getLogger(__name__)
 # _LOG.setLevel(logging.DEBUG)
@@ -18,6 +20,10 @@ TICK_INTERVAL_SECONDS = 10  # Number of seconds between ticks
 # don't execute it, but just reschedule it for it's next time
 TICK_GRACE_SECONDS = 60
 
+# In precise mode the clock sleeps until the next alarm, but never longer than this,
+# so a jump in the system's wall clock is noticed within a bounded time
+PRECISE_MAX_SLEEP_SECONDS = 3600
+
 
 class TimeSpec(object):
 
@@ -33,6 +39,9 @@ class TimeSpec(object):
         self._weekdays = weekdays      # 0-6 is Sun to Sat; or 1-7 is Mon to Sun
         self._tz_name = tz_name
 
+        self._schedule = None          # CronSchedule compiled on first use
+        self._use_croniter = False     # True if the spec uses syntax CronSchedule can't compile
+
     def _create_cron_spec(self):
         minute = self._minute
         hour = self._hour
@@ -53,17 +62,48 @@ class TimeSpec(object):
 
         return "{} {} {} {} {}".format(minute, hour, day_of_month, month, weekdays)
 
-    # ~~~~~~~~~~~~~~~~~~~
-    #   Public Methods
-    # ~~~~~~~~~~~~~~~~~~~
-
-    def next_time_from(self, dt) -> datetime.datetime:
+    def _compile(self):
+        try:
+            self._schedule = cronschedule.CronSchedule(
+                self._tz_name,
+                minute=self._minute,
+                hour=self._hour,
+                day_of_month=self._day_of_month,
+                month=self._month,
+                weekdays=self._weekdays
+            )
+        except helpers.ValidationError as e:
+            _LOG.debug("TimeSpec {} will use croniter: {}".format(self.serialize(), e))
+            self._use_croniter = True
+
+    def _next_time_from_croniter(self, dt) -> datetime.datetime:
         cron = croniter.croniter(
             self._create_cron_spec(),
             dt.astimezone(pytz.timezone(self._tz_name))
         )
         return cron.get_next(datetime.datetime)
 
+    # ~~~~~~~~~~~~~~~~~~~
+    #   Public Methods
+    # ~~~~~~~~~~~~~~~~~~~
+
+    def next_time_from(self, dt) -> datetime.datetime:
+        if self._schedule is None and not self._use_croniter:
+            self._compile()
+        if self._use_croniter:
+            return self._next_time_from_croniter(dt)
+        return self._schedule.next_time_from(dt)
+
+    def next_times_from(self, dt, count: int) -> list:
+        """Returns the next count fire times after dt
+        :rtype: list(datetime.datetime)
+        """
+        times = []
+        for i in range(count):
+            dt = self.next_time_from(dt)
+            times.append(dt)
+        return times
+
     def serialize(self) -> dict:
         o = {}
 
@@ -122,11 +162,10 @@ class ClockAlarm(object):
         self.actions.append(action)
 
     def remove_action(self, trigger_guid):
-        for pos, action in self.actions:
-            # TimeSpec Action
-            if isinstance(action, AlarmTimeSpecAction):
-                if action.id == trigger_guid:
-                    del self.actions[pos]
+        self.actions = [
+            action for action in self.actions
+            if not (isinstance(action, AlarmTimeSpecAction) and action.id == trigger_guid)
+        ]
 
 
 class AlarmAction(object):
@@ -143,11 +182,33 @@ class AlarmTimeSpecAction(AlarmAction):
 
 class EngineClock (fibers.Fiber):
 
-    def __init__(self, tz_name: str, loop=None):
+    def __init__(self, tz_name: str, loop=None, precise: bool = False):
+        """
+            :param str tz_name: Timezone used when formatting the timeline
+            :param asyncio.AbstractEventLoop loop: The engine's event loop
+            :param bool precise: Sleep until the next alarm is due instead of polling
+                every TICK_INTERVAL_SECONDS
+        """
         super().__init__()
         self._tz_name = tz_name
         self._loop = loop
-        self._timeline = []     # list of ClockAlarms; one for each time at which to do something
+        self._precise = precise
+        self._wakeup = None     # asyncio.Event set when an earlier alarm is added (precise mode)
+
+        # Scheduling lag is the actual fire time minus the alarm_time
+        self._lag_count = 0
+        self._lag_total_secs = 0.0
+        self._lag_last_secs = None
+        self._lag_max_secs = None
+
+        # The timeline is a heap of (alarm_time, seq, ClockAlarm) entries so the next
+        # alarm can be found and popped in O(log n). Alarms are never removed from the
+        # middle of the heap. Instead they are dropped from _alarms, and the stale heap
+        # entry is discarded when it reaches the top.
+        self._timeline = []     # heap of (alarm_time, seq, ClockAlarm)
+        self._alarms = {}       # alarm_time -> ClockAlarm; one for each time to do something
+        self._action_index = {}     # TimeSpecAction id -> ClockAlarm holding that action
+        self._seq = itertools.count()   # Tie-breaker so heap entries never compare ClockAlarms
 
         if self._loop is None:
             self._loop = asyncio.get_event_loop()
@@ -176,27 +237,57 @@ class EngineClock (fibers.Fiber):
         assert inspect.iscoroutinefunction(action_function), (
             "TimeSpec action_function must be an async function reference."
             " It also cannot be a couroutine object yet")
+
+        # An ID can only be scheduled once, so replace any existing action with this ID
+        if id in self._action_index:
+            self.remove_timespec_action(id)
+
         action = AlarmTimeSpecAction(id, action_function, timespec)
-        self._add_action_to_timeline(timespec.next_time_from(nowtime), action)
+        alarm = self._add_action_to_timeline(timespec.next_time_from(nowtime), action)
+        self._action_index[id] = alarm
+
+        # Wake the precise run loop if this is now the earliest alarm
+        if self._wakeup is not None and self._peek_alarm() is alarm:
+            self._wakeup.set()
 
     def remove_timespec_action(self, id):
         """Removes a TimeSpaceAction from the Clock's timeline
             Parameters:
                 :param str id: The ID of the TimeSpecAction
         """
-        for alarm in self.timeline:
-            for pos, action in enumerate(alarm.actions):
-                if action.id == id:
-                    alarm.actions.remove(action)
-            if len(alarm.actions) == 0:
-                self._timeline.remove(alarm)
+        alarm = self._action_index.pop(id, None)
+        if alarm is None:
+            return
+
+        alarm.remove_action(id)
+        if len(alarm.actions) == 0:
+            # Leave the heap entry in place; it is skipped once it reaches the top
+            self._alarms.pop(alarm.alarm_time, None)
+            self._compact_timeline()
 
     @property
     def timeline(self):
-        """
+        """The live ClockAlarms in alarm_time order.
+        This builds a sorted copy, so it is intended for inspection and testing
+        rather than for use on the tick path.
         :rtype: list[ClockAlarm]
         """
-        return self._timeline
+        return sorted(self._alarms.values(), key=lambda alarm: alarm.alarm_time)
+
+    @property
+    def precise(self) -> bool:
+        return self._precise
+
+    def get_lag_stats(self) -> dict:
+        """Returns the scheduling lag (actual fire time minus alarm_time) of fired alarms
+        :rtype: dict
+        """
+        return {
+            "count": self._lag_count,
+            "last_secs": self._lag_last_secs,
+            "max_secs": self._lag_max_secs,
+            "mean_secs": self._lag_total_secs / self._lag_count if self._lag_count else None
+        }
 
     # ~~~~~~~~~~~~~~~~~~~~
     #   Private methods
@@ -205,25 +296,60 @@ class EngineClock (fibers.Fiber):
     async def _async_run(self):
         """Override of Fiber base class.  Called by async Fiber.async_run()
         """
+        if self._precise:
+            await self._async_run_precise()
+            return
+
         # Start the _tick() loop
         while self._running:
             await self._async_tick(helpers.nowutc())    # Execute tick
             await asyncio.sleep(TICK_INTERVAL_SECONDS)  # Sleep until next tick
 
+    async def _async_run_precise(self):
+        """Tick only when the next alarm is due, or when an earlier alarm is added
+        """
+        self._wakeup = asyncio.Event()
+        try:
+            while self._running:
+                await self._async_tick(helpers.nowutc())
+
+                # Sleep until the next alarm, or until woken by add_timespec_action()
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self._secs_until_next_alarm())
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._wakeup = None
+
+    def _secs_until_next_alarm(self) -> float:
+        alarm = self._peek_alarm()
+        if alarm is None:
+            return PRECISE_MAX_SLEEP_SECONDS
+        secs = (alarm.alarm_time - helpers.nowutc()).total_seconds()
+        return min(max(secs, 0), PRECISE_MAX_SLEEP_SECONDS)
+
     async def _async_tick(self, utcnow):
         """ Process a tick of the clock
         :param datetime.datetime utcnow: The current time in UTC, passed as arugment to
             facilitate unit testing
         """
         # If no timeline, do nothing
-        if len(self._timeline) == 0:
+        if len(self._alarms) == 0:
             return
 
         # If now() is >= 1st element of timeline
-        while len(self._timeline) and utcnow >= self._timeline[0].alarm_time:
+        alarm = self._peek_alarm()
+        while alarm is not None and utcnow >= alarm.alarm_time:
 
             # pop it off the timeline
-            alarm = self._timeline.pop(0)
+            heapq.heappop(self._timeline)
+            del self._alarms[alarm.alarm_time]
+            for action in alarm.actions:
+                if isinstance(action, AlarmTimeSpecAction):
+                    self._action_index.pop(action.id, None)
+
+            self._record_lag((utcnow - alarm.alarm_time).total_seconds())
 
             # If alarm is too old: > TICK_GRACE_SECONDS before now()
             if utcnow > alarm.alarm_time + datetime.timedelta(seconds=TICK_GRACE_SECONDS):
@@ -244,60 +370,63 @@ class EngineClock (fibers.Fiber):
                     self.add_timespec_action(
                         action.id, action.action_function, action.timespec, utcnow)
 
-        if len(self._timeline):
+            alarm = self._peek_alarm()
+
+        if alarm is not None:
             _LOG.debug(
                 "Clock _tick(): next alarm is {} seconds away".format(
-                    ((self._timeline[0].alarm_time - utcnow).seconds)))
-
-    def _add_action_to_timeline(self, alarm_time: datetime.datetime, action: AlarmAction):
-        # Handle empty timeline case
-        if len(self._timeline) == 0:
-            _LOG.debug("Clock has empty timeline.  Adding first alarm at: {}".format(alarm_time))
-            alarm = ClockAlarm(alarm_time)
+                    ((alarm.alarm_time - utcnow).seconds)))
+
+    def _record_lag(self, lag_secs: float):
+        self._lag_count += 1
+        self._lag_total_secs += lag_secs
+        self._lag_last_secs = lag_secs
+        if self._lag_max_secs is None or lag_secs > self._lag_max_secs:
+            self._lag_max_secs = lag_secs
+
+    def _peek_alarm(self) -> ClockAlarm:
+        """Returns the earliest live ClockAlarm without removing it, or None.
+        Stale heap entries for removed alarms are discarded along the way.
+        """
+        while self._timeline:
+            alarm_time, seq, alarm = self._timeline[0]
+            if self._alarms.get(alarm_time) is alarm:
+                return alarm
+            heapq.heappop(self._timeline)
+        return None
+
+    def _compact_timeline(self):
+        """Rebuilds the heap once stale entries outnumber the live alarms"""
+        if len(self._timeline) > 2 * len(self._alarms) + 16:
+            self._timeline = [
+                entry for entry in self._timeline if self._alarms.get(entry[0]) is entry[2]
+            ]
+            heapq.heapify(self._timeline)
+
+    def _add_action_to_timeline(
+        self, alarm_time: datetime.datetime, action: AlarmAction
+    ) -> ClockAlarm:
+        alarm = self._alarms.get(alarm_time)
+
+        # if new.alarm_time matches an existing alarm --> add action to existing alarm
+        if alarm is not None:
+            _LOG.debug(
+                ("Found match of existing alarm, adding to its list of actions. "
+                    + "Length: {}").format(len(alarm.actions)+1))
             alarm.add_action(action)
-            self._timeline.append(alarm)
-            _LOG.debug(self._format_timeline())
-            return
+            return alarm
 
-        for pos, alarm in enumerate(self._timeline):
-
-            _LOG.debug(
-                "new.alarm_time: {} | alarm.alarm_time: {}".format(alarm_time, alarm.alarm_time))
-
-            # if new.alarm_time == [pos].alarm_time --> add action to existing alarm
-            if alarm_time == alarm.alarm_time:
-                _LOG.debug(
-                    ("Found match of existing alarm, adding to its list of actions. "
-                        + "Length: {}").format(len(alarm.actions)+1))
-                alarm.add_action(action)
-                break
-
-            # if new.alarm_time < [pos].alarm_time --> insert new alarm at [pos]
-            elif alarm_time < alarm.alarm_time:
-                _LOG.debug(
-                    "Adding new alarm at postion {} in the timeline. Alarm: {}".format(
-                        pos, alarm_time))
-                alarm = ClockAlarm(alarm_time)
-                alarm.add_action(action)
-                self._timeline.insert(pos, alarm)
-                break
-
-            # if we are at the end of the timeline --> append a new alarm at the end
-            elif len(self._timeline) == pos+1:
-                _LOG.debug(
-                    "Adding new alarm at the end of the timeline. Alarm: {}".format(alarm_time))
-                alarm = ClockAlarm(alarm_time)
-                alarm.add_action(action)
-                self._timeline.append(alarm)
-                break
-
-            # else --> pos++ and loop again
-
-        _LOG.debug(self._format_timeline())
+        # else --> push a new alarm onto the timeline
+        _LOG.debug("Adding new alarm to the timeline. Alarm: {}".format(alarm_time))
+        alarm = ClockAlarm(alarm_time)
+        alarm.add_action(action)
+        self._alarms[alarm_time] = alarm
+        heapq.heappush(self._timeline, (alarm_time, next(self._seq), alarm))
+        return alarm
 
     def _format_timeline(self) -> str:
         p = "Printing clock alarm timeline..."
-        for alarm in self._timeline:
+        for alarm in self.timeline:
             p += "\nAlarm: {}".format(alarm.alarm_time.astimezone(pytz.timezone(self._tz_name)))
             for i, action in enumerate(alarm.actions):
                 if isinstance(action, AlarmTimeSpecAction):
@@ -1,9 +1,9 @@
 import asyncio
-import json
 import logging
+import time
 import traceback
 
-from ottoengine import const
+from ottoengine import const, message_decoder
 from ottoengine.model import dataobjects
 from ottoengine.fibers import Fiber
 
@@ -17,11 +17,16 @@ class HassWebSocketReader(Fiber):
         super().__init__()
         self._engine = engine
         self._socket = websocket
+        self._decoder = message_decoder.MessageDecoder(event_filter=engine.wants_event_type)
 
     @property
     def connected(self) -> bool:
         return self._socket.connected
 
+    @property
+    def decoder(self) -> message_decoder.MessageDecoder:
+        return self._decoder
+
     async def _async_run(self):
         # Connect the websocket
         await self._connect()
@@ -50,6 +55,7 @@ class HassWebSocketReader(Fiber):
     async def _read(self):
         while self._running and self._socket.connected:
             raw_msg = await self._socket.async_receive()
+            received = time.perf_counter()
 
             # Read the message, and make sure it is a valid response
             if raw_msg is None:
@@ -57,13 +63,16 @@ class HassWebSocketReader(Fiber):
                 _LOG.error(message)
                 raise Exception(message)
 
-            _LOG.debug("Websocket read: {}".format(raw_msg))
             try:
-                msg = json.loads(raw_msg)
-            except json.JSONDecodeError as e:
+                msg = self._decoder.decode(raw_msg)
+            except ValueError as e:
                 _LOG.error("Websocket message failed to parse as JSON: {}".format(raw_msg))
                 continue
 
+            # Pongs and events no rule listens for are dropped by the decoder
+            if msg is None:
+                continue
+
             if "type" not in msg:
                 _LOG.warning("Unknown response recieved on websocket: {}".format(raw_msg))
                 continue
@@ -81,45 +90,55 @@ class HassWebSocketReader(Fiber):
 
             # Response to a message sent by Otto Engine
             elif "result" in response_type:
-                await _process_result_response(self._engine, msg)
+                request_type = self._socket.resolve_result(msg)
+                await _process_result_response(self._engine, msg, request_type)
 
             # Event notification from Home Assistant
             elif "event" in response_type:
-                await _process_event_response(self._engine, msg)
+                await _process_event_response(self._engine, msg, received)
 
 
-async def _process_result_response(engine_obj, msg: dict):
+async def _process_result_response(engine_obj, msg: dict, request_type: str = None):
+    """
+        :param str request_type: The type of the request this result answers, or None if
+            it is not known, in which case it is guessed from the result's type
+    """
     if not msg["success"]:
         _LOG.warning("Websocket error response: {}".format(msg))
         return
 
     msg_result = msg["result"]
+    if request_type is None:
+        if isinstance(msg_result, list):
+            request_type = "get_states"
+        elif isinstance(msg_result, dict):
+            request_type = "get_services"
 
     # States response
-    if isinstance(msg_result, list):
+    if request_type == "get_states" and isinstance(msg_result, list):
 
+        entity_states = []
         for state_dict in msg_result:
-            state = dataobjects.EntityState(
+            # Skip building an EntityState for entities whose state is unchanged
+            existing_state = engine_obj.states.get_entity_state(
+                state_dict[const.ENTITY_ID], warn=False)
+            if existing_state is not None and existing_state.matches_dict(state_dict):
+                continue
+
+            entity_states.append(dataobjects.EntityState(
                 state_dict[const.ENTITY_ID],
                 state_dict[const.STATE],
                 state_dict[const.ATTRIBUTES],
                 state_dict[const.LAST_CHANGED],
                 state_dict.get("attributes").get("friendly_name"),
                 state_dict.get("attributes").get("hidden")
-            )
+            ))
 
-            # Update state if it doesn't match the engine's state
-            existing_state = engine_obj.states.get_entity_state(state.entity_id)
-
-            if not existing_state or not existing_state.is_equal(state):
-                engine_obj.states.set_entity_state(state.entity_id, state)
-                _LOG.debug(
-                    "Updating the engine's state for: {}".format(state.entity_id))
-            else:
-                pass
+        updated = engine_obj.apply_entity_states(entity_states)
+        _LOG.info("States result: {} entities, {} changed".format(len(msg_result), updated))
 
     # Services response
-    elif isinstance(msg_result, dict):
+    elif request_type == "get_services" and isinstance(msg_result, dict):
 
         for domain_key in msg_result:
             if domain_key in "context":
@@ -133,15 +152,60 @@ async def _process_result_response(engine_obj, msg: dict):
             except Exception as e:
                 _LOG.warn(f"Exception reading services response: {msg}")
 
-async def _process_event_response(engine_obj, msg: dict):
+async def _process_event_response(engine_obj, msg: dict, received: float = None):
     event_obj = msg.get("event")
 
+    # A subscribe_trigger state trigger fired; it carries the same states as state_changed
+    if "variables" in event_obj:
+        event_obj = _trigger_to_state_changed(event_obj)
+        if event_obj is None:
+            return
+
+    tracer = engine_obj.tracer
+
     # State Changed Event
-    if event_obj.get("event_type") in "state_changed":
-        event = dataobjects.StateChangedEvent.from_websocket_dict(event_obj)
+    if event_obj.get("event_type") == const.STATE_CHANGED:
+        event = dataobjects.StateChangedEvent.from_websocket_dict(event_obj, engine_obj.states)
+        if tracer is not None:
+            event.trace = tracer.start_trace(
+                received, event_obj.get("time_fired"), entity_id=event.entity_id)
 
     # Else it's something else
     else:
         event = dataobjects.HassEvent.from_websocket_dict(event_obj)
+        if tracer is not None:
+            event.trace = tracer.start_trace(
+                received, event_obj.get("time_fired"), event_type=event.event_type)
 
+    event.received = received
     engine_obj.process_event(event)
+
+
+def _trigger_to_state_changed(event_obj: dict) -> dict:
+    """Returns a state_changed event dict for a subscribe_trigger event, or None when the
+    entity was added or removed (it has no from_state or to_state)
+    """
+    #   "event": {
+    #     "variables": {
+    #       "trigger": {
+    #         "platform": "state",
+    #         "entity_id": "input_boolean.action_light",
+    #         "from_state": { ... },
+    #         "to_state": { ... }
+    #       }
+    #     }
+    #   }
+    trigger = event_obj["variables"].get("trigger") or {}
+    from_state = trigger.get("from_state")
+    to_state = trigger.get("to_state")
+    if from_state is None or to_state is None:
+        return None
+    return {
+        "event_type": const.STATE_CHANGED,
+        "data": {
+            "entity_id": trigger.get("entity_id") or to_state["entity_id"],
+            "old_state": from_state,
+            "new_state": to_state
+        },
+        "time_fired": to_state.get("last_updated") or to_state["last_changed"]
+    }
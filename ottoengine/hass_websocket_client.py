@@ -22,12 +22,17 @@
 # {"id": 12, "type": "ping"}
 # > {"id": 12, "type": "pong"}
 
+import asyncio
 import asyncws
 import ssl
 import json
 import logging
+import time
+
+from ottoengine import histogram, tracing
 
 EVENT_STATE_CHANGED = 'state_changed'
+REQUEST_TIMEOUT = 10.0   # Seconds to wait for a request's result before failing it
 
 _LOG = logging.getLogger(__name__)
 # _LOG.setLevel(logging.DEBUG)
@@ -42,7 +47,7 @@ class WebSocketError(Exception):
 
 class AsyncHassWebsocket(object):
 
-    def __init__(self, host, port, token=None, use_ssl=False):
+    def __init__(self, host, port, token=None, use_ssl=False, request_timeout=REQUEST_TIMEOUT):
         self._url = 'ws://{}:{}/api/websocket'.format(host, port)
         self._token = token
         self._use_ssl = use_ssl
@@ -50,6 +55,9 @@ class AsyncHassWebsocket(object):
         self._socket_connected = False
         self._socket_authenticated = False
         self._id = 0
+        self._request_timeout = request_timeout
+        self._pending = {}   # id -> (future, request type, send time, timeout handle)
+        self._rtt = {}       # request type -> LatencyHistogram of round-trip times
 
     @property
     def connected(self):
@@ -95,6 +103,7 @@ class AsyncHassWebsocket(object):
         return True
 
     async def async_close(self, force=False):
+        self.fail_pending("websocket closed")
         if force:
             self._socket.writer.close()
         else:
@@ -113,45 +122,66 @@ class AsyncHassWebsocket(object):
         if self._socket_authenticated:
             await self._socket.send(json.dumps({"id": self._nextid(), "type": "ping"}))
 
-    async def async_subscribe_events(self, event_type):
-        '''Subscribe to all events of type: event_type'''
+    async def async_subscribe_events(self, event_type) -> int:
+        '''Subscribe to all events of type: event_type. Returns the subscription id.'''
         # event_type is optional.  If omitted, all events will be subscribed to
         _LOG.debug("Websocket subscribing to events of type: {}".format(event_type))
-        await self._socket.send(
-            json.dumps(
-                {
-                    'id': self._nextid(),
-                    'type': 'subscribe_events',
-                    'event_type': event_type
-                }
-            )
+        subscription_id, future = await self.async_send_request(
+            {
+                'type': 'subscribe_events',
+                'event_type': event_type
+            }
+        )
+        return subscription_id
+
+    async def async_subscribe_trigger(self, trigger) -> int:
+        '''
+        Subscribe to a Home Assistant trigger, i.e. {"platform": "state", "entity_id": ...}.
+        Home Assistant evaluates the trigger and only sends the events that fire it.
+        Returns the subscription id.
+        '''
+        _LOG.debug("Websocket subscribing to trigger: {}".format(trigger))
+        subscription_id, future = await self.async_send_request(
+            {
+                'type': 'subscribe_trigger',
+                'trigger': trigger
+            }
+        )
+        return subscription_id
+
+    async def async_unsubscribe_events(self, subscription_id):
+        '''Ends a subscribe_events or subscribe_trigger subscription'''
+        _LOG.debug("Websocket unsubscribing: {}".format(subscription_id))
+        await self.async_send_request(
+            {
+                'type': 'unsubscribe_events',
+                'subscription': subscription_id
+            }
         )
 
     async def async_get_all_state(self):
-        '''Retrieve all the state objects from Home Assistant.'''
+        '''
+        Retrieve all the state objects from Home Assistant.
+        The result is handled by the websocket reader, so this does not wait for it.
+        '''
         _LOG.debug("Websocket requesting all state from Home Assistant")
-        await self._socket.send(
-            json.dumps(
-                {
-                    'id': self._nextid(),
-                    'type': 'get_states'
-                }
-            )
-        )
+        await self.async_send_request({'type': 'get_states'})
 
     async def async_get_all_services(self):
-        '''Retrieve all the services registered from Home Assistant.'''
+        '''
+        Retrieve all the services registered from Home Assistant.
+        The result is handled by the websocket reader, so this does not wait for it.
+        '''
         _LOG.debug("Websocket requesting all registered services from Home Assistant")
-        await self._socket.send(
-            json.dumps(
-                {
-                    'id': self._nextid(),
-                    'type': 'get_services'
-                }
-            )
-        )
+        await self.async_send_request({'type': 'get_services'})
 
-    async def async_call_service(self, service_call_info):
+    async def async_call_service(self, service_call_info) -> dict:
+        '''
+        Calls the service and waits for its result message, i.e.
+        {"id": 3, "type": "result", "success": true, "result": null}.
+        Raises WebSocketError if there is no result within the request timeout.
+        Other calls can be sent while this one waits.
+        '''
         # {
         #     "id": 3,
         #     "type": "call_service",
@@ -166,25 +196,109 @@ class AsyncHassWebsocket(object):
         _LOG.debug("Websocket calling service: {}.{} with {}".format(
             service_call_info.domain, service_call_info.service, service_call_info.service_data)
         )
-        await self._socket.send(
-            json.dumps(
-                {
-                    'id': self._nextid(),
-                    'type': 'call_service',
-                    'domain': service_call_info.domain,
-                    'service': service_call_info.service,
-                    'service_data': service_call_info.service_data
-                }
-            )
+        request_id, future = await self.async_send_request(
+            {
+                'type': 'call_service',
+                'domain': service_call_info.domain,
+                'service': service_call_info.service,
+                'service_data': service_call_info.service_data
+            }
         )
+        if service_call_info.traces:
+            tracing.finish_written(service_call_info.traces)
+        return await future
+
+    async def async_send_request(self, request: dict, timeout: float = None) -> tuple:
+        '''
+        Sends a request with the next id, and returns (id, future). The future gets the
+        result message once the reader passes it to resolve_result(), or a WebSocketError
+        if there is none within the timeout. Sending does not wait for earlier results,
+        so any number of requests can be in flight at once.
+        '''
+        loop = asyncio.get_event_loop()
+        request_id = self._nextid()
+        message = {'id': request_id}
+        message.update(request)
+
+        future = loop.create_future()
+        future.add_done_callback(_retrieve_failure)
+        handle = loop.call_later(
+            timeout or self._request_timeout, self._fail_request, request_id,
+            "no result after {} seconds".format(timeout or self._request_timeout))
+        self._pending[request_id] = (future, request['type'], time.perf_counter(), handle)
+
+        try:
+            await self._socket.send(json.dumps(message))
+        except Exception as e:
+            self._fail_request(request_id, "send failed: {}".format(str(e)))
+            raise
+        return (request_id, future)
+
+    def resolve_result(self, msg: dict) -> str:
+        '''
+        Completes the pending request a result message answers, and records its round-trip
+        time. Returns the request's type, or None if no request is waiting on this id.
+        '''
+        pending = self._pending.pop(msg.get('id'), None)
+        if pending is None:
+            return None
+        future, request_type, sent, handle = pending
+        handle.cancel()
+
+        rtt = self._rtt.get(request_type)
+        if rtt is None:
+            rtt = self._rtt[request_type] = histogram.LatencyHistogram()
+        rtt.record(time.perf_counter() - sent)
+
+        if not future.done():
+            future.set_result(msg)
+        return request_type
+
+    def fail_pending(self, reason: str):
+        '''Fails every request still waiting for a result'''
+        for request_id in list(self._pending):
+            self._fail_request(request_id, reason)
+
+    def get_rtt_stats(self) -> dict:
+        '''
+        Returns the round-trip time histogram stats of each request type, and the number
+        of requests waiting for a result
+        :rtype: dict
+        '''
+        return {
+            "pending": len(self._pending),
+            "requests": {
+                request_type: rtt.get_stats() for request_type, rtt in self._rtt.items()
+            }
+        }
+
+    def _fail_request(self, request_id, reason: str):
+        pending = self._pending.pop(request_id, None)
+        if pending is None:
+            return
+        future, request_type, sent, handle = pending
+        handle.cancel()
+        if not future.done():
+            future.set_exception(WebSocketError(
+                "{} request {} failed: {}".format(request_type, request_id, reason)))
 
     async def async_receive(self) -> str:
         '''Receive a message from the websocket'''
         message = await self._socket.recv()
-        _LOG.debug("Websocket read: {}".format(message))
+        # get_states results can be megabytes, so only format them when they'll be logged
+        if _LOG.isEnabledFor(logging.DEBUG):
+            _LOG.debug("Websocket read: {}".format(message))
         return message
 
     def _nextid(self):
         '''Return the next request ID to use'''
         self._id += 1
         return self._id
+
+
+def _retrieve_failure(future):
+    '''Logs a failed request, which also marks the exception as retrieved, since many
+    requests (i.e. subscriptions) are sent without anything waiting on the result
+    '''
+    if not future.cancelled() and future.exception() is not None:
+        _LOG.warning(str(future.exception()))
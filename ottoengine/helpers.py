@@ -1,4 +1,7 @@
 import datetime
+import dateutil.parser
+import math
+import numbers
 import pytz
 
 
@@ -111,6 +114,39 @@ def day_of_week_xxx(datetime) -> str:
     return days[datetime.weekday()]
 
 
+def parse_number(value):
+    """Returns value as a number, or None if it is not numeric.
+    Home Assistant sends entity states as strings, i.e. "21.5"
+        :rtype: int or float
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, numbers.Number):
+        number = value
+    else:
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            return None
+    if math.isnan(number):
+        return None
+    return number
+
+
+def parse_iso8601(value) -> datetime.datetime:
+    """Parses a timestamp in Home Assistant's format, i.e. 2017-05-06T01:08:38.324629+00:00
+    with the fast datetime.fromisoformat(), falling back to dateutil for other formats.
+    Datetimes and None are returned unchanged.
+        :rtype: datetime.datetime
+    """
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return dateutil.parser.parse(value)
+
+
 class ValidationError(Exception):
     """Exception class for improperly constructed objects"""
 
@@ -0,0 +1,74 @@
+import bisect
+
+_bisect_left = bisect.bisect_left
+
+# Upper bounds, in seconds, of the latency buckets; the last bucket has no upper bound
+DEFAULT_BOUNDS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+
+class LatencyHistogram(object):
+    """Counts latencies into fixed buckets, so recording one costs a bisect and keeping
+    any number of them costs a fixed amount of memory.
+    """
+
+    def __init__(self, bounds: tuple = DEFAULT_BOUNDS):
+        self._bounds = tuple(bounds)
+        self._counts = [0] * (len(self._bounds) + 1)
+        self._sum = 0.0
+        self._max = 0.0
+
+    @property
+    def bounds(self) -> tuple:
+        return self._bounds
+
+    @property
+    def count(self) -> int:
+        return sum(self._counts)
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+    def record(self, secs: float):
+        # Rules record several of these per invocation, so this does no more than it must
+        self._counts[_bisect_left(self._bounds, secs)] += 1
+        self._sum += secs
+        if secs > self._max:
+            self._max = secs
+
+    def get_buckets(self) -> list:
+        """Returns [(upper bound, count)], with None as the last bucket's bound.
+        Counts are per bucket, not cumulative.
+        """
+        return list(zip(self._bounds + (None,), self._counts))
+
+    def percentile(self, pct: float) -> float:
+        """Returns the upper bound of the bucket holding the pct'th percentile, the max
+        when that is the unbounded bucket, or None if nothing was recorded
+        """
+        count = self.count
+        if not count:
+            return None
+        rank = count * pct / 100.0
+        seen = 0
+        for bound, count in zip(self._bounds, self._counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self._max)
+        return self._max
+
+    def get_stats(self) -> dict:
+        """
+        :rtype: dict
+        """
+        count = self.count
+        return {
+            "count": count,
+            "mean_secs": self._sum / count if count else None,
+            "max_secs": self._max if count else None,
+            "p50_secs": self.percentile(50),
+            "p99_secs": self.percentile(99),
+            "buckets": [[bound, count] for bound, count in self.get_buckets() if count]
+        }
@@ -0,0 +1,380 @@
+import logging
+import math
+
+from ottoengine.model import dataobjects, trigger_objects
+
+_LOG = logging.getLogger(__name__)
+# _LOG.setLevel(logging.DEBUG)
+
+
+def _remove_entry(buckets: dict, key, entry):
+    """Removes entry from the list buckets[key], deleting the bucket once it is empty"""
+    bucket = buckets[key]
+    bucket.remove(entry)
+    if not bucket:
+        del buckets[key]
+
+
+def _decrement(counts: dict, key):
+    counts[key] -= 1
+    if counts[key] == 0:
+        del counts[key]
+
+
+class _IntervalNode(object):
+    """A node of a centered interval tree.
+    Holds the intervals whose closed hull contains center, sorted two ways for stabbing queries.
+    """
+
+    def __init__(self, center, by_low, by_high, left, right):
+        self.center = center
+        self.by_low = by_low        # [(low, high, entry)] sorted by low ascending
+        self.by_high = by_high      # [(low, high, entry)] sorted by high descending
+        self.left = left            # _IntervalNode of intervals entirely below center
+        self.right = right          # _IntervalNode of intervals entirely above center
+
+
+class NumericIntervalIndex(object):
+    """Interval index over the open (above_value, below_value) ranges of NumericStateTriggers.
+
+    A missing above_value or below_value is an unbounded end. The centered interval tree
+    is rebuilt lazily after listeners are added, and a query for the triggers whose range
+    contains a value runs in O(log n + k).
+    """
+
+    def __init__(self):
+        self._intervals = []    # [(low, high, entry)]
+        self._root = None
+        self._dirty = False
+
+    def __len__(self):
+        return len(self._intervals)
+
+    def add(self, low, high, entry):
+        """
+            :param low: Exclusive lower bound, or None for unbounded
+            :param high: Exclusive upper bound, or None for unbounded
+            :param entry: The object returned by stab() when the value is in the range
+        """
+        low = -math.inf if low is None else low
+        high = math.inf if high is None else high
+        if low >= high:
+            return  # An empty range can never match
+        self._intervals.append((low, high, entry))
+        self._dirty = True
+
+    def remove(self, entry):
+        """Removes the range that was added with entry"""
+        self._intervals = [interval for interval in self._intervals if interval[2] is not entry]
+        self._dirty = True
+
+    def stab(self, value) -> list:
+        """Returns the entries whose range contains value (low < value < high)"""
+        if self._dirty:
+            self._root = self._build(self._intervals)
+            self._dirty = False
+
+        found = []
+        node = self._root
+        while node is not None:
+            if value < node.center:
+                for low, high, entry in node.by_low:
+                    if low >= value:
+                        break
+                    found.append(entry)
+                node = node.left
+            elif value > node.center:
+                for low, high, entry in node.by_high:
+                    if high <= value:
+                        break
+                    found.append(entry)
+                node = node.right
+            else:
+                for low, high, entry in node.by_low:
+                    if low < value < high:
+                        found.append(entry)
+                break
+        return found
+
+    def _build(self, intervals):
+        if not intervals:
+            return None
+
+        endpoints = sorted(
+            point for low, high, entry in intervals for point in (low, high)
+            if not math.isinf(point)
+        )
+        center = endpoints[len(endpoints) // 2]
+
+        here, left, right = [], [], []
+        for interval in intervals:
+            if interval[1] < center:
+                left.append(interval)
+            elif interval[0] > center:
+                right.append(interval)
+            else:
+                here.append(interval)
+
+        return _IntervalNode(
+            center,
+            sorted(here, key=lambda interval: interval[0]),
+            sorted(here, key=lambda interval: interval[1], reverse=True),
+            self._build(left),
+            self._build(right)
+        )
+
+
+class StateListenerIndex(object):
+    """Finds the listeners whose StateTrigger or NumericStateTrigger match a StateChangedEvent.
+
+    StateTrigger listeners are bucketed by (entity_id, to_state, from_state), where None
+    in to_state or from_state is a wildcard. A state change is matched against at most
+    four buckets, so listeners that would reject the event never get a task created.
+
+    NumericStateTrigger listeners are kept in a NumericIntervalIndex per entity, queried
+    with the new state parsed once per event.
+    """
+
+    def __init__(self):
+        self._buckets = {}          # (entity_id, to_state, from_state) -> [(seq, HassListener)]
+        self._numeric = {}          # entity_id -> NumericIntervalIndex of (seq, HassListener)
+        self._entity_counts = {}    # entity_id -> number of listeners registered
+        self._entries = {}          # HassListener -> (seq, HassListener) so it can be removed
+        self._seq = 0               # Registration order, so matches are returned in that order
+
+        self._events = 0
+        self._matched = 0
+        self._avoided = 0
+
+    def add(self, listener):
+        """
+            :param rule_objects.HassListener listener: Listener with a State/NumericStateTrigger
+        """
+        trigger = listener.trigger
+        self._seq += 1
+        entry = (self._seq, listener)
+
+        if isinstance(trigger, trigger_objects.NumericStateTrigger):
+            intervals = self._numeric.get(trigger.entity_id)
+            if intervals is None:
+                intervals = self._numeric[trigger.entity_id] = NumericIntervalIndex()
+            intervals.add(trigger.above_value, trigger.below_value, entry)
+        elif isinstance(trigger, trigger_objects.StateTrigger):
+            key = (trigger.entity_id, trigger.to_state, trigger.from_state)
+            self._buckets.setdefault(key, []).append(entry)
+        else:
+            raise TypeError("StateListenerIndex cannot index trigger: {}".format(trigger))
+
+        self._entries[listener] = entry
+        self._entity_counts[trigger.entity_id] = self._entity_counts.get(trigger.entity_id, 0) + 1
+
+    def remove(self, listener):
+        """Removes a listener previously passed to add(). Unknown listeners are ignored.
+            :param rule_objects.HassListener listener:
+        """
+        entry = self._entries.pop(listener, None)
+        if entry is None:
+            return
+        trigger = listener.trigger
+
+        if isinstance(trigger, trigger_objects.NumericStateTrigger):
+            intervals = self._numeric[trigger.entity_id]
+            intervals.remove(entry)
+            if len(intervals) == 0:
+                del self._numeric[trigger.entity_id]
+        else:
+            key = (trigger.entity_id, trigger.to_state, trigger.from_state)
+            _remove_entry(self._buckets, key, entry)
+
+        _decrement(self._entity_counts, trigger.entity_id)
+
+    def has_listeners(self, entity_id: str) -> bool:
+        return entity_id in self._entity_counts
+
+    def clear(self):
+        self._buckets = {}
+        self._numeric = {}
+        self._entity_counts = {}
+        self._entries = {}
+
+    def match(self, event: dataobjects.StateChangedEvent) -> list:
+        """Returns the listeners whose triggers pass for this event, in registration order
+        :rtype: list(rule_objects.HassListener)
+        """
+        entity_id = event.entity_id
+        registered = self._entity_counts.get(entity_id, 0)
+        if registered == 0:
+            return []
+
+        matches = []
+        new_state = event.new_state_obj.state
+        old_state = event.old_state_obj.state
+
+        # StateTriggers only fire when the main state value actually changed
+        if new_state != old_state:
+            for key in (
+                (entity_id, new_state, old_state),
+                (entity_id, new_state, None),
+                (entity_id, None, old_state),
+                (entity_id, None, None)
+            ):
+                bucket = self._buckets.get(key)
+                if bucket:
+                    matches.extend(bucket)
+
+        intervals = self._numeric.get(entity_id)
+        if intervals is not None:
+            value = event.new_state_obj.numeric_state
+            if value is not None:
+                matches.extend(intervals.stab(value))
+
+        if len(matches) > 1:
+            matches.sort(key=lambda entry: entry[0])
+
+        self._events += 1
+        self._matched += len(matches)
+        self._avoided += registered - len(matches)
+        return [listener for seq, listener in matches]
+
+    def get_stats(self) -> dict:
+        """Counters of how many rule invocations the index has avoided
+        :rtype: dict
+        """
+        return {
+            "events": self._events,
+            "listeners_matched": self._matched,
+            "tasks_avoided": self._avoided
+        }
+
+
+class EventListenerIndex(object):
+    """Finds the listeners whose EventTrigger event_data filters are satisfied by a HassEvent.
+
+    Each listener is indexed under its event_type and one key/value pair of its event_data
+    filter, chosen as the pair shared by the fewest listeners so far. An event only reaches
+    the listeners whose indexed pair it contains, and those are then checked against the
+    rest of their filter. Listeners without a filter, or whose filter values can't be
+    hashed, are checked for every event of the type.
+    """
+
+    def __init__(self):
+        self._by_pair = {}          # (event_type, key, value) -> [(seq, HassListener)]
+        self._keys = {}             # event_type -> {key: number of listeners indexed on key}
+        self._unindexed = {}        # event_type -> [(seq, HassListener)]
+        self._type_counts = {}      # event_type -> number of listeners registered
+        self._entries = {}          # HassListener -> ((event_type, key, value) or None, entry)
+        self._seq = 0
+
+        self._events = 0
+        self._matched = 0
+        self._avoided = 0
+
+    def add(self, listener):
+        """
+            :param rule_objects.HassListener listener: Listener with an EventTrigger
+        """
+        trigger = listener.trigger
+        if not isinstance(trigger, trigger_objects.EventTrigger):
+            raise TypeError("EventListenerIndex cannot index trigger: {}".format(trigger))
+
+        self._seq += 1
+        entry = (self._seq, listener)
+        event_type = trigger.event_type
+        self._type_counts[event_type] = self._type_counts.get(event_type, 0) + 1
+
+        # Index on the filter pair with the fewest listeners so far, the most selective one
+        best_pair = None
+        best_len = None
+        for key, value in trigger.event_data.items():
+            try:
+                bucket_len = len(self._by_pair.get((event_type, key, value), ()))
+            except TypeError:
+                continue    # Unhashable filter value (i.e. a list)
+            if best_len is None or bucket_len < best_len:
+                best_pair, best_len = (event_type, key, value), bucket_len
+
+        self._entries[listener] = (best_pair, entry)
+        if best_pair is None:
+            self._unindexed.setdefault(event_type, []).append(entry)
+            return
+
+        self._by_pair.setdefault(best_pair, []).append(entry)
+        keys = self._keys.setdefault(event_type, {})
+        keys[best_pair[1]] = keys.get(best_pair[1], 0) + 1
+
+    def remove(self, listener):
+        """Removes a listener previously passed to add(). Unknown listeners are ignored.
+            :param rule_objects.HassListener listener:
+        """
+        location = self._entries.pop(listener, None)
+        if location is None:
+            return
+        pair, entry = location
+        event_type = listener.trigger.event_type
+
+        if pair is None:
+            _remove_entry(self._unindexed, event_type, entry)
+        else:
+            _remove_entry(self._by_pair, pair, entry)
+            keys = self._keys[event_type]
+            _decrement(keys, pair[1])
+            if not keys:
+                del self._keys[event_type]
+
+        _decrement(self._type_counts, event_type)
+
+    def has_listeners(self, event_type: str) -> bool:
+        return event_type in self._type_counts
+
+    def clear(self):
+        self._by_pair = {}
+        self._keys = {}
+        self._unindexed = {}
+        self._type_counts = {}
+        self._entries = {}
+
+    def match(self, event: dataobjects.HassEvent, on_rejected=None) -> list:
+        """Returns the listeners whose triggers pass for this event, in registration order
+            :param on_rejected: Called with each candidate listener whose trigger failed
+        :rtype: list(rule_objects.HassListener)
+        """
+        event_type = event.event_type
+        registered = self._type_counts.get(event_type, 0)
+        if registered == 0:
+            return []
+
+        candidates = list(self._unindexed.get(event_type, ()))
+        data = event.data_obj or {}
+        for key in self._keys.get(event_type, ()):
+            if key not in data:
+                continue
+            try:
+                bucket = self._by_pair.get((event_type, key, data[key]))
+            except TypeError:
+                continue    # Unhashable event value can't equal a hashable filter value
+            if bucket:
+                candidates.extend(bucket)
+
+        matches = []
+        for entry in candidates:
+            if entry[1].trigger.eval_trigger(event):
+                matches.append(entry)
+            elif on_rejected is not None:
+                on_rejected(entry[1])
+        if len(matches) > 1:
+            matches.sort(key=lambda entry: entry[0])
+
+        self._events += 1
+        self._matched += len(matches)
+        self._avoided += registered - len(matches)
+        return [listener for seq, listener in matches]
+
+    def get_stats(self) -> dict:
+        """Counters of how many rule invocations the index has avoided
+        :rtype: dict
+        """
+        return {
+            "events": self._events,
+            "listeners_matched": self._matched,
+            "tasks_avoided": self._avoided
+        }
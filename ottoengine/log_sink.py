@@ -0,0 +1,275 @@
+"""A durable copy of the EngineLog on disk, for looking back at what rules did after the
+in-memory log has moved on or the engine has restarted.
+
+Entries are appended as NDJSON to segment files named after the time of their first entry,
+e.g. engine-1538395200000000.ndjson, and a new segment is started when the current one
+reaches segment_bytes. Only the newest max_segments are kept. Each line starts with the
+entry's time, so a reader can binary search a segment without decoding it:
+
+    {"ts":1538395200.123456,"seq":42,"type":"trigger_fired","rule":"porch","entry":{...}}
+
+Entries are written by a background thread, so the event loop never waits on the disk. If
+the disk falls too far behind, new entries are dropped (and counted) rather than queued.
+"""
+import bisect
+import collections
+import json
+import logging
+import mmap
+import os
+import threading
+import time
+
+from ottoengine import enginelog
+
+_LOG = logging.getLogger(__name__)
+# _LOG.setLevel(logging.DEBUG)
+
+SEGMENT_PREFIX = "engine-"
+SEGMENT_SUFFIX = ".ndjson"
+DEFAULT_SEGMENT_BYTES = 4 * 1024 * 1024
+DEFAULT_MAX_SEGMENTS = 10
+MAX_QUEUED = 50000
+FLUSH_SECS = 1.0    # Longest the writer waits before writing what is queued
+# After waking, the writer lets a burst of entries finish before encoding them, so it
+# doesn't compete with the event loop for the GIL while rules are running
+COALESCE_SECS = 0.02
+DEFAULT_LOGTYPES = (
+    enginelog.TRIGGER_FIRED,
+    enginelog.CONDITION_PASSED,
+    enginelog.SERVICE_CALLED,
+    enginelog.RULE_COMPLETED,
+    enginelog.ERROR,
+)
+
+_TS_START = len(b'{"ts":')
+
+
+class LogSink(object):
+    """Appends EngineLog records to rotated segment files from a writer thread"""
+
+    def __init__(self, log_dir: str, segment_bytes: int = DEFAULT_SEGMENT_BYTES,
+                 max_segments: int = DEFAULT_MAX_SEGMENTS, logtypes=DEFAULT_LOGTYPES):
+        self._log_dir = log_dir
+        self._segment_bytes = segment_bytes
+        self._max_segments = max_segments
+        self._logtypes = frozenset(logtypes)
+        self._pending = collections.deque()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._file = None
+        self._file_bytes = 0
+        self._written = 0
+        self._dropped = 0
+        self._segments_started = 0
+
+    def start(self):
+        os.makedirs(self._log_dir, exist_ok=True)
+        self._thread = threading.Thread(
+            target=self._run, name="LogSinkWriter", daemon=True)
+        self._thread.start()
+
+    def close(self, timeout: float = 5.0):
+        '''Writes out what is queued, then stops the writer'''
+        if self._thread is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def write(self, record: tuple):
+        '''Queues an EngineLog record (seq, ts, type, rule id, entry). Never blocks.'''
+        if record[2] not in self._logtypes:
+            return
+        if len(self._pending) >= MAX_QUEUED:
+            self._dropped += 1
+            return
+        # deque.append is atomic, so the loop only takes the Event's lock to wake the writer
+        self._pending.append(record)
+        if not self._wakeup.is_set():
+            self._wakeup.set()
+
+    def get_stats(self) -> dict:
+        return {
+            "queued": len(self._pending),
+            "written": self._written,
+            "dropped": self._dropped,
+            "segments_started": self._segments_started,
+        }
+
+    # ~~~~~~~~~~~~~~~~~~~~
+    #   Writer thread
+    # ~~~~~~~~~~~~~~~~~~~~
+
+    def _run(self):
+        while True:
+            if self._wakeup.wait(FLUSH_SECS) and not self._stopping:
+                time.sleep(COALESCE_SECS)
+            self._wakeup.clear()
+            # Seen before draining, so records queued before close() are all written
+            stopping = self._stopping
+            records = []
+            while self._pending:
+                records.append(self._pending.popleft())
+            if records:
+                try:
+                    self._write_records(records)
+                except Exception:
+                    _LOG.exception("Failed writing {} engine log records".format(len(records)))
+            if stopping:
+                break
+        self._close_segment()
+
+    def _write_records(self, records: list):
+        lines = []
+        for record in records:
+            if self._file is None:
+                self._open_segment(record[1])
+            line = _record_line(record)
+            lines.append(line)
+            self._file_bytes += len(line)
+            if self._file_bytes >= self._segment_bytes:
+                self._file.write(b"".join(lines))
+                lines = []
+                self._close_segment()
+        if lines:
+            self._file.write(b"".join(lines))
+            self._file.flush()
+        self._written += len(records)
+
+    def _open_segment(self, first_ts: float):
+        filename = "{}{:016d}{}".format(SEGMENT_PREFIX, int(first_ts * 1e6), SEGMENT_SUFFIX)
+        self._file = open(os.path.join(self._log_dir, filename), "ab")
+        self._file_bytes = 0
+        self._segments_started += 1
+        for old_path in list_segments(self._log_dir)[:-self._max_segments]:
+            os.remove(old_path)
+
+    def _close_segment(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+
+
+class LogReader(object):
+    """Queries the segments written by a LogSink, including the one being written"""
+
+    def __init__(self, log_dir: str):
+        self._log_dir = log_dir
+
+    def query(self, start_ts: float = None, end_ts: float = None, rule_id: str = None,
+              logtype: str = None, limit: int = None) -> list:
+        """ Returns the entries logged from start_ts up to end_ts, oldest first.
+        :param float start_ts: seconds since the epoch, like time.time()
+        :param float end_ts: seconds since the epoch
+        :param str rule_id: only entries for this rule
+        :param str logtype: only entries of this type
+        :param int limit: at most this many entries
+        :rtype: list(dict)
+        """
+        records = []
+        for path in self._segments_for(start_ts, end_ts):
+            remaining = None if limit is None else limit - len(records)
+            records.extend(_query_segment(path, start_ts, end_ts, rule_id, logtype, remaining))
+            if limit is not None and len(records) >= limit:
+                break
+        return records
+
+    def _segments_for(self, start_ts: float, end_ts: float) -> list:
+        '''The segments that can hold entries in the time range'''
+        paths = list_segments(self._log_dir)
+        first_us = [_segment_first_us(path) for path in paths]
+        begin = 0
+        if start_ts is not None:
+            # The segment before the first one starting after start_ts may run past it
+            begin = max(0, bisect.bisect_right(first_us, int(start_ts * 1e6)) - 1)
+        end = len(paths)
+        if end_ts is not None:
+            end = bisect.bisect_right(first_us, int(end_ts * 1e6))
+        return paths[begin:end]
+
+
+def list_segments(log_dir: str) -> list:
+    '''Paths of the segment files, oldest first'''
+    try:
+        names = os.listdir(log_dir)
+    except FileNotFoundError:
+        return []
+    return [
+        os.path.join(log_dir, name) for name in sorted(names)
+        if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+    ]
+
+
+def _segment_first_us(path: str) -> int:
+    return int(os.path.basename(path)[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+
+
+def _record_line(record: tuple) -> bytes:
+    seq, ts, logtype, rule_id, entry = record
+    return '{{"ts":{:.6f},"seq":{},"type":{},"rule":{},"entry":{}}}\n'.format(
+        ts, seq, json.dumps(logtype), json.dumps(rule_id),
+        json.dumps(entry, separators=(",", ":"), default=str)).encode()
+
+
+def _query_segment(path, start_ts, end_ts, rule_id, logtype, limit) -> list:
+    with open(path, "rb") as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return []   # Empty segment
+    with mm:
+        # A line still being written has no newline yet
+        size = mm.rfind(b"\n") + 1
+        pos = 0 if start_ts is None else _first_line_at(mm, size, start_ts)
+
+        needle = None
+        if rule_id is not None:
+            needle = b'"rule":' + json.dumps(rule_id).encode()
+
+        records = []
+        while pos < size:
+            if needle is not None:
+                # Jump straight to the next line naming the rule
+                found = mm.find(needle, pos, size)
+                if found < 0:
+                    break
+                pos = mm.rfind(b"\n", 0, found) + 1
+            line_end = mm.find(b"\n", pos, size) + 1
+            if end_ts is not None and _line_ts(mm, pos) > end_ts:
+                break
+            record = json.loads(mm[pos:line_end].decode())
+            pos = line_end
+            if rule_id is not None and record["rule"] != rule_id:
+                continue    # The rule id was in the entry, not the record
+            if logtype is not None and record["type"] != logtype:
+                continue
+            records.append(record)
+            if limit is not None and len(records) >= limit:
+                break
+        return records
+
+
+def _line_ts(mm, pos: int) -> float:
+    return float(mm[pos + _TS_START:mm.find(b",", pos)])
+
+
+def _first_line_at(mm, size: int, start_ts: float) -> int:
+    '''Position of the first line logged at or after start_ts (size if there is none)'''
+    lo = 0
+    hi = size
+    # Invariant: lines starting before lo are before start_ts, the line at hi (if any) isn't
+    while lo < hi:
+        mid = mm.rfind(b"\n", lo, (lo + hi) // 2) + 1
+        if mid <= lo:
+            mid = lo
+        line_end = mm.find(b"\n", mid, size) + 1
+        if _line_ts(mm, mid) < start_ts:
+            lo = line_end
+        else:
+            hi = mid
+    return lo
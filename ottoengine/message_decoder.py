@@ -0,0 +1,107 @@
+import json
+import logging
+import re
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+_LOG = logging.getLogger(__name__)
+# _LOG.setLevel(logging.DEBUG)
+
+BACKEND_ORJSON = "orjson"
+BACKEND_JSON = "json"
+
+# Home Assistant puts id and type first, and event_type first in the event, so the
+# message type can be read from the start of the frame without parsing the rest of it.
+# The match is anchored, so it only looks at the first few dozen characters.
+_PEEK_PATTERN = (
+    r'\{\s*(?:"id"\s*:\s*\d+\s*,\s*)?"type"\s*:\s*"(\w+)"'
+    r'(?:\s*,\s*"event"\s*:\s*\{\s*"event_type"\s*:\s*"([^"\\]+)")?'
+)
+_PEEK_STR = re.compile(_PEEK_PATTERN).match
+_PEEK_BYTES = re.compile(_PEEK_PATTERN.encode()).match
+
+
+def available_backends() -> list:
+    """Returns the JSON backends that can be used, fastest first"""
+    if orjson is not None:
+        return [BACKEND_ORJSON, BACKEND_JSON]
+    return [BACKEND_JSON]
+
+
+def peek(raw_msg) -> tuple:
+    """Reads (type, event_type) from the start of a raw message without decoding it.
+    Either value is None when it isn't where Home Assistant normally puts it.
+        :param raw_msg: str or bytes websocket frame
+        :rtype: tuple
+    """
+    if isinstance(raw_msg, bytes):
+        match = _PEEK_BYTES(raw_msg)
+        if match is None:
+            return (None, None)
+        return tuple(value.decode() if value else None for value in match.groups())
+
+    match = _PEEK_STR(raw_msg)
+    if match is None:
+        return (None, None)
+    return match.groups()
+
+
+class MessageDecoder(object):
+    """Decodes websocket frames into dicts, with the fastest JSON library installed.
+
+    Pongs, and events whose event_type the event_filter rejects, are dropped after a
+    peek at the start of the frame, so they are never fully parsed. Frames the peek
+    can't read are always decoded.
+    """
+
+    def __init__(self, event_filter=None, backend: str = None):
+        """
+            :param event_filter: Optional function(event_type) -> bool; False drops the event
+            :param str backend: BACKEND_ORJSON or BACKEND_JSON. Defaults to the fastest available.
+        """
+        self._event_filter = event_filter
+        self._backend = backend or available_backends()[0]
+        if self._backend == BACKEND_ORJSON:
+            if orjson is None:
+                raise ValueError("orjson is not installed")
+            self._loads = orjson.loads
+        elif self._backend == BACKEND_JSON:
+            self._loads = json.loads
+        else:
+            raise ValueError("Unknown JSON backend: {}".format(backend))
+
+        self._decoded = 0
+        self._dropped = 0
+
+    @property
+    def backend(self) -> str:
+        return self._backend
+
+    def decode(self, raw_msg) -> dict:
+        """Returns the decoded message, or None if it was dropped.
+        Raises ValueError if the message is not valid JSON.
+        """
+        msg_type, event_type = peek(raw_msg)
+        if msg_type == "pong":
+            self._dropped += 1
+            return None
+        if (event_type is not None and self._event_filter is not None
+                and not self._event_filter(event_type)):
+            self._dropped += 1
+            return None
+
+        self._decoded += 1
+        return self._loads(raw_msg)
+
+    def get_stats(self) -> dict:
+        """
+        :rtype: dict
+        """
+        return {
+            "backend": self._backend,
+            "decoded": self._decoded,
+            "dropped": self._dropped
+        }
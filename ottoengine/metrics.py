@@ -0,0 +1,169 @@
+"""Counters and latency histograms of rule processing, and the Prometheus text format that
+/rest/metrics serves them (and the stats of the engine's other parts) in.
+
+Recording is on the rule processing path, so an invocation costs one dict lookup to count
+its outcome and a bisect into fixed histogram buckets per stage it reaches.
+"""
+import logging
+
+from ottoengine import histogram
+
+_LOG = logging.getLogger(__name__)
+# _LOG.setLevel(logging.DEBUG)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+PREFIX = "otto_"
+
+# Per-rule counters, by index into RuleMetrics' lists
+TRIGGERED = 0
+TRIGGER_REJECTED = 1
+CONDITION_FALSE = 2
+COMPLETED = 3
+ERRORED = 4
+COUNTER_NAMES = ("triggered", "trigger_rejected", "condition_false", "completed", "errored")
+_RUN_SECS = len(COUNTER_NAMES)      # Seconds spent running the rule after its trigger passed
+
+# Stages of handling an event, each timed from when the event was received
+# (or when the rule was invoked, for time triggers and replayed state)
+STAGE_TRIGGER = "trigger_evaluated"
+STAGE_CONDITION = "condition_evaluated"
+STAGE_FIRST_SERVICE_CALL = "first_service_call"
+STAGE_COMPLETED = "completed"
+STAGES = (STAGE_TRIGGER, STAGE_CONDITION, STAGE_FIRST_SERVICE_CALL, STAGE_COMPLETED)
+
+# The listener indexes skip most triggers that would be rejected without evaluating them,
+# so those are only counted in their tasks_avoided, not per rule
+_COUNTER_HELP = {
+    "trigger_rejected": (
+        "Rule invocations: trigger_rejected. Only event triggers that were evaluated are "
+        "counted; state triggers, and event triggers whose indexed event_data didn't match, "
+        "are counted in {0}state_listener_index_tasks_avoided and "
+        "{0}event_listener_index_tasks_avoided".format(PREFIX)),
+}
+
+
+class RuleMetrics(object):
+    """Per-rule outcome counters and per-stage latency histograms"""
+
+    def __init__(self):
+        self._rules = {}    # rule_id -> [count for each of COUNTER_NAMES..., run secs]
+        self._stages = {stage: histogram.LatencyHistogram() for stage in STAGES}
+
+    def finish(self, rule_id: str, outcome: int, run_secs: float):
+        """ Counts an invocation of the rule, once its outcome is known.
+        :param int outcome: one of the counters; all but TRIGGER_REJECTED also count TRIGGERED
+        :param float run_secs: time spent running the rule, not counted for TRIGGER_REJECTED
+        """
+        counts = self._rules.get(rule_id)
+        if counts is None:
+            counts = self._rules[rule_id] = [0] * len(COUNTER_NAMES) + [0.0]
+        counts[outcome] += 1
+        if outcome != TRIGGER_REJECTED:
+            counts[TRIGGERED] += 1
+            counts[_RUN_SECS] += run_secs
+
+    def record_stage(self, stage: str, secs: float):
+        self._stages[stage].record(secs)
+
+    def get_rule_counts(self) -> dict:
+        """
+        :rtype: dict(rule_id -> dict(counter name -> count, "run_secs" -> float))
+        """
+        return {
+            rule_id: dict(zip(COUNTER_NAMES + ("run_secs",), counts))
+            for rule_id, counts in self._rules.items()
+        }
+
+    def get_stage_histograms(self) -> dict:
+        return dict(self._stages)
+
+    def get_stats(self) -> dict:
+        return {
+            "rules": self.get_rule_counts(),
+            "stages": {stage: hist.get_stats() for stage, hist in self._stages.items()}
+        }
+
+
+def format_prometheus(rule_metrics: RuleMetrics, engine_stats: dict) -> str:
+    """ Renders the rule metrics, and the numbers in engine_stats (see OttoEngine.get_stats),
+    in the Prometheus text exposition format.
+    :rtype: str
+    """
+    lines = []
+    rule_counts = rule_metrics.get_rule_counts()
+    for name in COUNTER_NAMES:
+        metric = "{}rule_{}_total".format(PREFIX, name)
+        _add_header(lines, metric, "counter", _COUNTER_HELP.get(
+            name, "Rule invocations: {}".format(name)))
+        for rule_id, counts in sorted(rule_counts.items()):
+            lines.append("{}{{rule={}}} {}".format(metric, _label(rule_id), counts[name]))
+
+    metric = PREFIX + "rule_run_seconds_total"
+    _add_header(lines, metric, "counter", "Time spent running each rule after its trigger")
+    for rule_id, counts in sorted(rule_counts.items()):
+        lines.append("{}{{rule={}}} {}".format(metric, _label(rule_id), counts["run_secs"]))
+
+    metric = PREFIX + "stage_latency_seconds"
+    _add_header(lines, metric, "histogram", "Time from event received to each rule stage")
+    for stage, hist in rule_metrics.get_stage_histograms().items():
+        _add_histogram(lines, metric, "stage={}".format(_label(stage)), hist)
+
+    rtt = engine_stats.get("websocket_rtt") or {}
+    metric = PREFIX + "websocket_rtt_seconds"
+    _add_header(lines, metric, "summary", "Home Assistant request round-trip times")
+    for request_type, stats in sorted(rtt.get("requests", {}).items()):
+        _add_summary(lines, metric, "request={}".format(_label(request_type)), stats)
+    _add_gauge(lines, PREFIX + "websocket_pending_requests", rtt.get("pending"))
+
+    load_times = engine_stats.get("rule_load_seconds") or {}
+    metric = PREFIX + "rule_load_seconds"
+    _add_header(lines, metric, "gauge", "Seconds to load each rule file at the last load")
+    for filename, secs in sorted(load_times.items()):
+        lines.append("{}{{file={}}} {}".format(metric, _label(filename), secs))
+
+    # Everything else is a flat dict of numbers per part of the engine
+    for component, stats in sorted(engine_stats.items()):
+        if component in ("websocket_rtt", "rule_load_seconds") or not stats:
+            continue
+        for key, value in sorted(stats.items()):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                _add_gauge(lines, "{}{}_{}".format(PREFIX, component, key), value)
+
+    return "\n".join(lines) + "\n"
+
+
+def _add_header(lines: list, metric: str, metric_type: str, help_text: str):
+    lines.append("# HELP {} {}".format(metric, help_text))
+    lines.append("# TYPE {} {}".format(metric, metric_type))
+
+
+def _add_gauge(lines: list, metric: str, value):
+    if value is None:
+        return
+    lines.append("# TYPE {} gauge".format(metric))
+    lines.append("{} {}".format(metric, value))
+
+
+def _add_histogram(lines: list, metric: str, labels: str, hist: histogram.LatencyHistogram):
+    cumulative = 0
+    for bound, count in hist.get_buckets():
+        cumulative += count
+        le = "+Inf" if bound is None else repr(bound)
+        lines.append('{}_bucket{{{},le="{}"}} {}'.format(metric, labels, le, cumulative))
+    lines.append("{}_sum{{{}}} {}".format(metric, labels, hist.sum))
+    lines.append("{}_count{{{}}} {}".format(metric, labels, hist.count))
+
+
+def _add_summary(lines: list, metric: str, labels: str, stats: dict):
+    for quantile, key in (("0.5", "p50_secs"), ("0.99", "p99_secs")):
+        if stats.get(key) is not None:
+            lines.append('{}{{{},quantile="{}"}} {}'.format(metric, labels, quantile, stats[key]))
+    count = stats.get("count") or 0
+    lines.append("{}_sum{{{}}} {}".format(metric, labels, (stats.get("mean_secs") or 0) * count))
+    lines.append("{}_count{{{}}} {}".format(metric, labels, count))
+
+
+def _label(value) -> str:
+    '''A quoted label value, escaped as the text format requires'''
+    return '"{}"'.format(
+        str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
@@ -1,7 +1,7 @@
 import asyncio
 import logging
 
-from ottoengine import const, helpers
+from ottoengine import const, helpers, tracing
 from ottoengine.model import dataobjects
 
 _LOG = logging.getLogger(__name__)
@@ -19,10 +19,11 @@ class RuleActionItem(object):
         # This MAY be overridden by the subclass to accomodate special handling
         return self.get_dict_config()
 
-    async def async_execute(self, engine) -> bool:
+    async def async_execute(self, engine, trace=None) -> bool:
         '''Runs the action.
             Returns True if action was successful.
             Returns False if the action was unsuccessful.
+            trace is the action's tracing.Span when the rule is traced, else None.
         '''
         # This will be overridden by the subclasses
         raise NotImplementedError("async_execute was not properly overridden")
@@ -44,14 +45,22 @@ class ServiceAction(RuleActionItem):
             self._data_dict["entity_id"] = entity_id
 
     # Override
-    async def async_execute(self, engine):
+    async def async_execute(self, engine, trace=None):
         _LOG.info("Service called - domain: {}, service: {}, data: {}".format(
             self._domain, self._service, self._data_dict)
         )
-        await engine.call_service(
-            dataobjects.ServiceCall(self._domain, self._service, self._data_dict)
-        )
-        return True
+        service_call = dataobjects.ServiceCall(self._domain, self._service, self._data_dict)
+        if trace is None:
+            return await engine.call_service(service_call)
+
+        # Ended by the websocket when it writes the call, or here if it never does
+        span = trace.child(
+            tracing.SERVICE_CALL, service="{}.{}".format(self._domain, self._service))
+        service_call.traces = [span]
+        try:
+            return await engine.call_service(service_call)
+        finally:
+            span.finish(written=False)
 
     @staticmethod
     def from_dict(dict_obj):
@@ -86,11 +95,15 @@ class ConditionAction(RuleActionItem):
     def __init__(self, condition_obj):
         self._condition_obj = condition_obj
 
+    @property
+    def condition(self):
+        return self._condition_obj
+
     # No from_dict function since this is just a condition object
     # We use the _condition_from_dict() function in persistence.py instead
 
     # Override
-    async def async_execute(self, engine):
+    async def async_execute(self, engine, trace=None):
         '''Tests the condition.  Returns the result of the test'''
         result = False
         if self._condition_obj.evaluate(engine):
@@ -101,7 +114,7 @@ class ConditionAction(RuleActionItem):
 
     # Override
     def get_dict_config(self) -> dict:
-        return self._condition_obj.get_condition_config()
+        return self._condition_obj.get_dict_config()
 
 
 class DelayAction(RuleActionItem):
@@ -111,7 +124,7 @@ class DelayAction(RuleActionItem):
         self._delay_delta = delay_delta     # datetime.timedelta
 
     # Override
-    async def async_execute(self, engine):
+    async def async_execute(self, engine, trace=None):
         delay_secs = self._delay_delta.total_seconds()
         _LOG.info("Delay action for {} seconds".format(delay_secs))
         await asyncio.sleep(delay_secs)
@@ -140,7 +153,7 @@ class LogAction(RuleActionItem):
         return LogAction(json.get("log_message"))
 
     # Overrides
-    async def async_execute(self, engine):
+    async def async_execute(self, engine, trace=None):
         _LOG.info("LogAction: {}".format(self._message))
         return True
 
@@ -1,5 +1,4 @@
 import datetime
-import dateutil.parser
 import logging
 import numbers
 import pytz
@@ -30,6 +29,12 @@ class RuleCondition(object):
         # This will be overridden by the subclasses
         raise NotImplementedError("evaluate() was not properly overridden")
 
+    def get_entity_ids(self) -> set:
+        """The entities whose state evaluate() reads.
+        This MAY be overridden by the subclass; the default reads no entity state.
+        """
+        return set()
+
 
 class AndCondition(RuleCondition):
     # condition: and
@@ -54,6 +59,13 @@ class AndCondition(RuleCondition):
             d["conditions"].append(cond.get_dict_config())
         return d
 
+    # Override
+    def get_entity_ids(self) -> set:
+        entity_ids = set()
+        for cond in self._conditions:
+            entity_ids.update(cond.get_entity_ids())
+        return entity_ids
+
     # Override
     def evaluate(self, engine) -> bool:
         _LOG.debug("Evaluating AND condtion")
@@ -87,6 +99,13 @@ class OrCondition(RuleCondition):
             d["conditions"].append(cond.get_dict_config())
         return d
 
+    # Override
+    def get_entity_ids(self) -> set:
+        entity_ids = set()
+        for cond in self._conditions:
+            entity_ids.update(cond.get_entity_ids())
+        return entity_ids
+
     # Override
     def evaluate(self, engine) -> bool:
         for cond in self._conditions:
@@ -151,6 +170,10 @@ class NumericStateCondition(RuleCondition):
             d["below_value"] = self._below_value
         return d
 
+    # Override
+    def get_entity_ids(self) -> set:
+        return {self._entity_id}
+
     # Override
     def evaluate(self, engine) -> bool:
         _LOG.debug(
@@ -198,6 +221,10 @@ class StateCondition(RuleCondition):
             "state": self._state
         }
 
+    # Override
+    def get_entity_ids(self) -> set:
+        return {self._entity_id}
+
     # Override
     def evaluate(self, engine) -> bool:
         current_state = engine.states.get_entity_state(self._entity_id)
@@ -234,6 +261,10 @@ class SunCondition(RuleCondition):
             raise helpers.ValidationError(
                 "SunCondition: before and after cannot both be specified")
 
+    # Override
+    def get_entity_ids(self) -> set:
+        return {self._entity_id}
+
     # Override
     def evaluate(self, engine) -> bool:
         now = helpers.nowutc()  # datetime.datetime
@@ -244,9 +275,9 @@ class SunCondition(RuleCondition):
             self._after_offset = datetime.timedelta(0)      # datetime.timedelta
 
         sun_state = engine.states.get_entity_state(self._entity_id)
-        next_rising = dateutil.parser.parse(
+        next_rising = helpers.parse_iso8601(
             sun_state.attributes.get('next_rising'))    # datetime.datetime
-        next_setting = dateutil.parser.parse(
+        next_setting = helpers.parse_iso8601(
             sun_state.attributes.get('next_setting'))   # datetime.datetime
 
         # False if now is already after the specified time before sunrise
@@ -471,6 +502,10 @@ class ZoneCondition(RuleCondition):
         }
         return d
 
+    # Override
+    def get_entity_ids(self) -> set:
+        return {self._entity_id}
+
     # Override
     def evaluate(self, states) -> bool:
         if self._zone == states.get_entity_state(self._entity_id):
@@ -1,9 +1,13 @@
-import dateutil.parser
 import logging
+import sys
+
+from ottoengine import helpers
 
 _LOG = logging.getLogger(__name__)
 # _LOG.setLevel(logging.DEBUG)
 
+_UNPARSED = object()    # Sentinel for values that are parsed lazily
+
 
 class HassEvent(object):
     # "event": {
@@ -17,16 +21,30 @@ class HassEvent(object):
     # }
 
     def __init__(self, event_type, data_obj, time_fired):
+        """
+            :param time_fired: datetime, or an ISO-8601 string that is parsed when first read
+        """
         self.event_type = event_type
         self.data_obj = data_obj
-        self.time_fired = time_fired
+        self._time_fired = time_fired
+        self.received = None    # time.perf_counter() when the websocket received it
+        self.trace = None       # tracing.Span of the event, when it is traced
+
+    @property
+    def time_fired(self):
+        if isinstance(self._time_fired, str):
+            self._time_fired = helpers.parse_iso8601(self._time_fired)
+        return self._time_fired
+
+    @time_fired.setter
+    def time_fired(self, value):
+        self._time_fired = value
 
     @staticmethod
     def from_websocket_dict(response_dict):
         event_type = response_dict.get("event_type")
         data = response_dict["data"]
-        time_fired = dateutil.parser.parse(response_dict["time_fired"])
-        return HassEvent(event_type, data, time_fired)
+        return HassEvent(event_type, data, response_dict["time_fired"])
 
 
 class StateChangedEvent(HassEvent):
@@ -60,20 +78,33 @@ class StateChangedEvent(HassEvent):
         self.new_state_obj = new_state_obj
 
     @staticmethod
-    def from_websocket_dict(response_dict):
+    def from_websocket_dict(response_dict, states=None):
+        """
+            :param dict response_dict: The "event" dict of a state_changed message
+            :param state.OttoEngineState states: Optional store whose current EntityState
+                is reused as old_state_obj when it matches the event's old_state
+        """
         data = response_dict["data"]
 
-        time_fired = dateutil.parser.parse(response_dict["time_fired"])
+        # Timestamps are kept as strings until something reads them
+        time_fired = response_dict["time_fired"]
         entity_id = data["entity_id"]
 
-        old_state_value = data["old_state"]["state"]
-        old_attributes = data["old_state"]["attributes"]
-        old_last_changed = dateutil.parser.parse(data["old_state"]["last_changed"])
-        old_state_obj = EntityState(entity_id, old_state_value, old_attributes, old_last_changed)
+        old_state_obj = None
+        if states is not None:
+            stored = states.get_entity_state(entity_id, warn=False)
+            if stored is not None and stored.matches_dict(data["old_state"]):
+                old_state_obj = stored
+        if old_state_obj is None:
+            old_state_value = data["old_state"]["state"]
+            old_attributes = data["old_state"]["attributes"]
+            old_last_changed = data["old_state"]["last_changed"]
+            old_state_obj = EntityState(
+                entity_id, old_state_value, old_attributes, old_last_changed)
 
         new_state_value = data["new_state"]["state"]
         new_attributes = data["new_state"]["attributes"]
-        new_last_changed = dateutil.parser.parse(data["new_state"]["last_changed"])
+        new_last_changed = data["new_state"]["last_changed"]
         new_state_obj = EntityState(entity_id, new_state_value, new_attributes, new_last_changed)
 
         return StateChangedEvent(entity_id, old_state_obj, new_state_obj, time_fired)
@@ -96,21 +127,60 @@ class EntityState(object):
     #   "last_updated": "2017-05-06T01:04:26.579682+00:00"
     # }
 
+    # Installs can have tens of thousands of these, so they don't carry a __dict__.
+    # attributes may be shared with other EntityStates (see OttoEngineState), so treat
+    # it as read-only.
+    __slots__ = (
+        "entity_id", "state", "attributes", "_last_changed", "friendly_name", "hidden",
+        "_numeric_state"
+    )
+
     def __init__(
         self, entity_id, state, attributes,
         last_changed, friendly_name=None, hidden=False
     ):
-        self.entity_id = entity_id
-        self.state = state
+        self.entity_id = sys.intern(entity_id) if type(entity_id) is str else entity_id
+        self.state = sys.intern(state) if type(state) is str else state
         self.attributes = attributes
-        self.last_changed = last_changed
+        self._last_changed = last_changed    # datetime, or ISO-8601 string until first read
         self.friendly_name = friendly_name
+        self._numeric_state = _UNPARSED
 
         if (hidden is None):
             self.hidden = False
         else:
             self.hidden = hidden
 
+    @property
+    def numeric_state(self):
+        '''The state as a number, or None if the state is not numeric.
+        Parsed on first access, so all triggers evaluating an event share one parse.
+        '''
+        if self._numeric_state is _UNPARSED:
+            self._numeric_state = helpers.parse_number(self.state)
+        return self._numeric_state
+
+    @property
+    def last_changed(self):
+        if isinstance(self._last_changed, str):
+            self._last_changed = helpers.parse_iso8601(self._last_changed)
+        return self._last_changed
+
+    @last_changed.setter
+    def last_changed(self, value):
+        self._last_changed = value
+
+    def matches_dict(self, state_dict: dict) -> bool:
+        """True if a websocket state dict describes this same state, attributes included"""
+        last_changed = state_dict.get("last_changed")
+        return (
+            self.state == state_dict.get("state")
+            and self.entity_id == state_dict.get("entity_id", self.entity_id)
+            and (self._last_changed == last_changed
+                 or self.last_changed == helpers.parse_iso8601(last_changed))
+            and self.attributes == state_dict.get("attributes")
+        )
+
     def is_equal(self, state):
         if type(self) != type(state):
             return False
@@ -118,7 +188,8 @@ class EntityState(object):
             return False
         if self.state != state.state:
             return False
-        if self.last_changed != state.last_changed:
+        # Identical timestamp strings are equal without parsing either one
+        if self._last_changed != state._last_changed and self.last_changed != state.last_changed:
             return False
         return True
 
@@ -274,14 +345,16 @@ class ServiceCall(object):
     #     }
     # }
 
-    def __init__(self, domain, service, service_data_dict):
+    def __init__(self, domain, service, service_data_dict, traces=None):
         '''Creates a ServiceCall object.
 
         Field: service_data_dict can be {} or None
+        Field: traces is a list of the tracing.Spans of the calls this one carries, or None
         '''
         self.domain = domain                    # i.e. input_boolean
         self.service = service                  # i.e. toggle
         self.service_data = service_data_dict   # fields: {entity_id:value, visible:True}
+        self.traces = traces
 
         if self.service_data is None:
             self.service_data = {}
@@ -1,4 +1,3 @@
-import numbers
 import logging
 import uuid
 
@@ -57,6 +56,14 @@ class StateTrigger(ListenerTrigger):
     def entity_id(self):
         return self._entity_id
 
+    @property
+    def to_state(self):
+        return self._to_state
+
+    @property
+    def from_state(self):
+        return self._from_state
+
     @staticmethod
     def from_dict(json):
         j = json
@@ -125,8 +132,8 @@ class NumericStateTrigger(ListenerTrigger):
         self._entity_id = entity_id         # string
 
         # One of these must be specified
-        self._above_value = above_value     # int or float
-        self._below_value = below_value     # int or float
+        self._above_value = _numeric_value(above_value, "above_value")     # int or float
+        self._below_value = _numeric_value(below_value, "below_value")     # int or float
 
         if (above_value is None) and (below_value is None):
             raise helpers.ValidationError(
@@ -138,6 +145,14 @@ class NumericStateTrigger(ListenerTrigger):
     def entity_id(self):
         return self._entity_id
 
+    @property
+    def above_value(self):
+        return self._above_value
+
+    @property
+    def below_value(self):
+        return self._below_value
+
     @staticmethod
     def from_dict(json):
         j = json
@@ -152,9 +167,9 @@ class NumericStateTrigger(ListenerTrigger):
             ATTR_PLATFORM: self._platform,
             ATTR_ENTITY_ID: self._entity_id
         }
-        if self._above_value:
+        if self._above_value is not None:
             d["above_value"] = self._above_value
-        if self._below_value:
+        if self._below_value is not None:
             d["below_value"] = self._below_value
         return d
 
@@ -163,19 +178,24 @@ class NumericStateTrigger(ListenerTrigger):
 
         if isinstance(event_obj, dataobjects.StateChangedEvent):
             if self._entity_id in event_obj.entity_id:
-                if isinstance(event_obj.new_state_obj.state, numbers.Number):
-                    if (
-                        (self._above_value is None)
-                        or (event_obj.new_state_obj.state > self._above_value)
-                    ):
-                        if (
-                            (self._below_value is None)
-                            or (event_obj.new_state_obj.state < self._below_value)
-                        ):
+                # States arrive as strings; the parsed value is cached on the state object
+                value = event_obj.new_state_obj.numeric_state
+                if value is not None:
+                    if (self._above_value is None) or (value > self._above_value):
+                        if (self._below_value is None) or (value < self._below_value):
                             run = True
         return run
 
 
+def _numeric_value(value, name):
+    if value is None:
+        return None
+    number = helpers.parse_number(value)
+    if number is None:
+        raise helpers.ValidationError("NumericStateTrigger: {} is not a number".format(name))
+    return number
+
+
 class EventTrigger(ListenerTrigger):
     # Mandatory
     # platform: event
@@ -196,6 +216,10 @@ class EventTrigger(ListenerTrigger):
     def event_type(self):
         return self._event_type
 
+    @property
+    def event_data(self) -> dict:
+        return self._event_data_obj
+
     @staticmethod
     def from_dict(json):
         j = json
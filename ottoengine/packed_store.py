@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""Single-file rule store: an append-only file of length-prefixed JSON records,
+read through mmap with an in-memory offset index.
+
+Import an existing JSON rules directory, or compact a store, with:
+
+    python -m ottoengine.packed_store import <json_rules_dir> <packed_path>
+    python -m ottoengine.packed_store compact <packed_path>
+"""
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import zlib
+
+_LOG = logging.getLogger(__name__)
+# _LOG.setLevel(logging.DEBUG)
+
+JSON_EXTENSION = 'json'
+
+MAGIC = b"OTTOPAK1"
+
+# Record header: body length, crc32 of the body, flags, rule id length.
+# The body is the rule id followed by the rule JSON.
+RECORD_HEADER = struct.Struct("<IIBH")
+FLAG_PUT = 0
+FLAG_DELETE = 1
+
+# Compact automatically once dead records take more than this share of the file
+COMPACT_DEAD_RATIO = 0.5
+COMPACT_MIN_BYTES = 64 * 1024
+
+
+class PackedRuleStore(object):
+    """Stores serialized rules as records appended to a single file.
+
+    Saving a rule appends a new record and deleting one appends a tombstone, so a write
+    never rewrites existing data. Each append is flushed and fsync'd before the index is
+    updated, and a torn or corrupt record at the end of the file (i.e. from a crash
+    mid-append) is truncated away when the store is opened.
+
+    The index maps each rule id to the offset of its latest record. Reads go through an
+    mmap of the file, so load_rule_dict() only decodes the one record it needs.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._lock = threading.RLock()
+        self._index = {}        # rule_id -> (body offset, body length, id length)
+        self._dead_bytes = 0    # Bytes held by superseded records and tombstones
+        self._file = None
+        self._mmap = None
+        self._open()
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def dead_bytes(self) -> int:
+        return self._dead_bytes
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, rule_id):
+        return rule_id in self._index
+
+    def close(self):
+        with self._lock:
+            self._close_map()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    # ~~~~~~~~~~~~~~
+    # Public methods
+    # ~~~~~~~~~~~~~~
+
+    def get_rule_ids(self) -> list:
+        """Returns the rule ids, in file order
+        :rtype: list(str)
+        """
+        with self._lock:
+            return list(self._index)
+
+    def load_rule_dict(self, rule_id: str) -> dict:
+        """Decodes and returns the one rule's dict, or None if there is no such rule"""
+        with self._lock:
+            location = self._index.get(rule_id)
+            if location is None:
+                return None
+            return self._decode(location)
+
+    def iter_rule_dicts(self):
+        """Yields each rule dict in file order, decoding one record at a time. A rule saved
+        while this runs is read as saved, and one deleted is skipped, since a save can
+        compact the file and move every record.
+        """
+        with self._lock:
+            rule_ids = list(self._index)
+        for rule_id in rule_ids:
+            with self._lock:
+                location = self._index.get(rule_id)
+                if location is None:
+                    continue
+                rule_dict = self._decode(location)
+            yield rule_dict
+
+    def save_rule_dict(self, rule_dict: dict):
+        self.save_rule_dicts([rule_dict])
+
+    def save_rule_dicts(self, rule_dicts: list):
+        """Appends the rules with a single fsync"""
+        records = []
+        for rule_dict in rule_dicts:
+            records.append((FLAG_PUT, str(rule_dict["id"]), json.dumps(rule_dict).encode()))
+        self._append(records)
+
+    def delete_rule(self, rule_id: str) -> bool:
+        """Returns True if the rule existed, False if it did not"""
+        with self._lock:
+            if rule_id not in self._index:
+                return False
+            self._append([(FLAG_DELETE, rule_id, b"")])
+            return True
+
+    def compact(self):
+        """Rewrites the file with only the live records, then swaps it into place"""
+        with self._lock:
+            tmp_path = self._path + ".compact"
+            with open(tmp_path, "wb") as outfile:
+                outfile.write(MAGIC)
+                for location in self._index.values():
+                    offset, length, id_len = location
+                    outfile.write(RECORD_HEADER.pack(
+                        length, zlib.crc32(self._mmap[offset:offset + length]), FLAG_PUT, id_len))
+                    outfile.write(self._mmap[offset:offset + length])
+                outfile.flush()
+                os.fsync(outfile.fileno())
+
+            self.close()
+            os.replace(tmp_path, self._path)
+            self._fsync_dir()
+            self._open()
+            _LOG.info("Compacted rule store {}: {} rules".format(self._path, len(self._index)))
+
+    def import_json_dir(self, json_rules_dir: str) -> int:
+        """Appends every rule file in json_rules_dir. Returns the number of rules imported."""
+        rule_dicts = []
+        for file in sorted(os.listdir(json_rules_dir)):
+            if not file.endswith(JSON_EXTENSION):
+                continue
+            filename = os.path.join(json_rules_dir, file)
+            try:
+                with open(filename) as infile:
+                    rule_dicts.append(json.load(infile))
+            except Exception:
+                _LOG.error("Skipping rule file {}: {}".format(filename, sys.exc_info()[1]))
+        self.save_rule_dicts(rule_dicts)
+        _LOG.info("Imported {} rules from {} into {}".format(
+            len(rule_dicts), json_rules_dir, self._path))
+        return len(rule_dicts)
+
+    # ~~~~~~~~~~~~~~~
+    # Private methods
+    # ~~~~~~~~~~~~~~~
+
+    def _open(self):
+        if not os.path.exists(self._path):
+            with open(self._path, "wb") as outfile:
+                outfile.write(MAGIC)
+                outfile.flush()
+                os.fsync(outfile.fileno())
+            self._fsync_dir()
+
+        self._file = open(self._path, "r+b")
+        self._remap()
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError("Not a packed rule store: {}".format(self._path))
+        self._scan()
+
+    def _scan(self):
+        """Builds the offset index, truncating any torn record at the end of the file"""
+        self._index = {}
+        self._dead_bytes = 0
+        size = len(self._mmap)
+        pos = len(MAGIC)
+
+        while pos < size:
+            if pos + RECORD_HEADER.size > size:
+                break
+            length, crc, flags, id_len = RECORD_HEADER.unpack_from(self._mmap, pos)
+            start = pos + RECORD_HEADER.size
+            if start + length > size or zlib.crc32(self._mmap[start:start + length]) != crc:
+                break
+            self._apply(flags, start, length, id_len)
+            pos = start + length
+
+        if pos < size:
+            _LOG.warning("Truncating {} bytes of incomplete records from {}".format(
+                size - pos, self._path))
+            self._close_map()
+            self._file.truncate(pos)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._remap()
+
+    def _apply(self, flags: int, start: int, length: int, id_len: int):
+        """Updates the index for the record with this body"""
+        rule_id = self._mmap[start:start + id_len].decode()
+        previous = self._index.pop(rule_id, None)
+        if previous is not None:
+            self._dead_bytes += RECORD_HEADER.size + previous[1]
+        if flags == FLAG_DELETE:
+            self._dead_bytes += RECORD_HEADER.size + length
+        else:
+            self._index[rule_id] = (start, length, id_len)
+
+    def _append(self, records: list):
+        """Appends (flags, rule_id, payload) records, fsyncs, then updates the index"""
+        with self._lock:
+            chunks = []
+            for flags, rule_id, payload in records:
+                body = rule_id.encode() + payload
+                chunks.append(RECORD_HEADER.pack(
+                    len(body), zlib.crc32(body), flags, len(rule_id.encode())))
+                chunks.append(body)
+
+            self._file.seek(0, os.SEEK_END)
+            pos = self._file.tell()
+            self._file.write(b"".join(chunks))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._remap()
+
+            for flags, rule_id, payload in records:
+                id_len = len(rule_id.encode())
+                length = id_len + len(payload)
+                start = pos + RECORD_HEADER.size
+                self._apply(flags, start, length, id_len)
+                pos = start + length
+
+            if (self._dead_bytes > COMPACT_MIN_BYTES
+                    and self._dead_bytes > len(self._mmap) * COMPACT_DEAD_RATIO):
+                self.compact()
+
+    def _decode(self, location: tuple) -> dict:
+        offset, length, id_len = location
+        return json.loads(self._mmap[offset + id_len:offset + length].decode())
+
+    def _remap(self):
+        self._close_map()
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _close_map(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def _fsync_dir(self):
+        """Makes a file creation or rename durable"""
+        try:
+            fd = os.open(os.path.dirname(os.path.abspath(self._path)), os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Manage an otto-engine packed rule store")
+    subparsers = arg_parser.add_subparsers(dest="command")
+    import_parser = subparsers.add_parser("import", help="Import a JSON rules directory")
+    import_parser.add_argument("json_rules_dir")
+    import_parser.add_argument("packed_path")
+    compact_parser = subparsers.add_parser("compact", help="Drop superseded records")
+    compact_parser.add_argument("packed_path")
+    args = arg_parser.parse_args(argv)
+
+    if args.command not in ["import", "compact"]:
+        arg_parser.print_help()
+        return 1
+
+    logging.basicConfig(level=logging.INFO)
+    store = PackedRuleStore(args.packed_path)
+    try:
+        if args.command == "import":
+            count = store.import_json_dir(args.json_rules_dir)
+            print("Imported {} rules into {}".format(count, args.packed_path))
+        else:
+            store.compact()
+            print("Compacted {}: {} rules".format(args.packed_path, len(store)))
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
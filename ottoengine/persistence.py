@@ -1,9 +1,13 @@
+import asyncio
+import concurrent.futures
 import os
 import sys
 import json
 import logging
+import time
 import traceback
 
+from ottoengine import packed_store, sqlite_store
 from ottoengine.model import rule_objects, trigger_objects, condition_objects, action_objects
 
 _LOG = logging.getLogger(__name__)
@@ -12,8 +16,13 @@ _LOG = logging.getLogger(__name__)
 BACKEND_FILE = 'file'
 BACKEND_MYSQL = 'mysql'
 BACKEND_SQLITE = 'sqlite'
+BACKEND_PACKED = 'packed'
 
 JSON_EXTENSION = 'json'
+SQLITE_FILENAME = 'rules.sqlite'    # Default database, kept in the json_rules_dir
+PACKED_FILENAME = 'rules.pack'      # Default packed store, kept in the json_rules_dir
+
+LOADER_THREADS = 4  # Threads used to read and parse rule files off the event loop
 
 ATTR_PLATFORM = "platform"
 ATTR_CONDITION = "condition"
@@ -30,55 +39,150 @@ def _error_not_implemented(backend, operation):
 
 class PersistenceManager:
 
-    def __init__(self, json_rules_dir):
+    def __init__(self, json_rules_dir, backend: str = BACKEND_FILE, sqlite_path: str = None,
+                 packed_path: str = None):
         """
-            :param engine.OttoEngine engine_obj:
             :param str json_rules_dir:
+            :param str backend: BACKEND_FILE, BACKEND_SQLITE or BACKEND_PACKED
+            :param str sqlite_path: SQLite database for BACKEND_SQLITE
+            :param str packed_path: Packed rule store file for BACKEND_PACKED
         """
         self._json_rules_dir = json_rules_dir
+        self._backend = backend
+        self._rule_cache = {}       # filename -> ((mtime_ns, size), AutomationRule)
+        self._load_times = {}       # filename -> seconds spent loading it on the last load
+        self._executor = None       # ThreadPoolExecutor, created on first async load
 
         if not os.path.exists(self._json_rules_dir):
             os.makedirs(self._json_rules_dir)
 
+        self._sqlite_store = None
+        self._packed_store = None
+        if backend == BACKEND_SQLITE:
+            self._sqlite_store = sqlite_store.SqliteRuleStore(
+                sqlite_path or os.path.join(self._json_rules_dir, SQLITE_FILENAME))
+        elif backend == BACKEND_PACKED:
+            self._packed_store = packed_store.PackedRuleStore(
+                packed_path or os.path.join(self._json_rules_dir, PACKED_FILENAME))
+        elif backend != BACKEND_FILE:
+            _error_not_implemented(backend, "PersistenceManager")
+
     # ~~~~~~~~~~~~~~
     # Public methods
     # ~~~~~~~~~~~~~~
 
-    def get_rules(self, json_rules_dir: str, backend: str='file') -> list:
+    @property
+    def backend(self) -> str:
+        return self._backend
+
+    def get_rules(self, json_rules_dir: str, backend: str = None) -> list:
         """ Load the AutomationRules from JSON from the BACKEND
         Returns list of AutomationRules
         :rtype: list(rule_objects.AutomationRule)
         """
         rules = []
+        backend = backend or self._backend
 
         if backend == BACKEND_FILE:
-            for file in os.listdir(json_rules_dir):
-                if file.endswith(JSON_EXTENSION):
-                    filename = os.path.join(json_rules_dir, file)
-                    _LOG.info("Found rule file: {}".format(filename))
-                    rule = self.load_rule_from_file(filename)
-                    if rule is None:
-                        _LOG.error("Rule did not load properly: {}".format(filename))
-                        continue
-                    rules.append(rule)
+            results = [
+                self._load_cached_rule_file(filename)
+                for filename in self._list_rule_files(json_rules_dir)
+            ]
+            rules = self._collect_rule_files(json_rules_dir, results)
 
         elif backend == BACKEND_MYSQL:
             _error_not_implemented(backend, "get_rule_ids")
 
         elif backend == BACKEND_SQLITE:
-            _error_not_implemented(backend, "get_rule_ids")
+            # Bulk load of every rule in one query
+            rules = self._rules_from_dicts(self._sqlite_store.get_rule_dicts())
+
+        elif backend == BACKEND_PACKED:
+            rules = self._rules_from_dicts(self._packed_store.iter_rule_dicts())
 
         _LOG.info("Completed reading rules from peristence")
         return rules
 
+    async def async_get_rules(self, json_rules_dir: str, backend: str = None) -> list:
+        """ Same as get_rules(), but rule files are read and parsed in a thread pool
+        so the event loop is not blocked. Files that have not changed since the
+        last load (same mtime and size) are not parsed again.
+        :rtype: list(rule_objects.AutomationRule)
+        """
+        backend = backend or self._backend
+        loop = asyncio.get_event_loop()
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=LOADER_THREADS, thread_name_prefix="rule-loader")
+
+        if backend != BACKEND_FILE:
+            return await loop.run_in_executor(
+                self._executor, self.get_rules, json_rules_dir, backend)
+
+        filenames = await loop.run_in_executor(
+            self._executor, self._list_rule_files, json_rules_dir)
+        # One job per thread rather than per file, to keep the scheduling overhead low
+        chunks = await asyncio.gather(*[
+            loop.run_in_executor(
+                self._executor, self._load_cached_rule_files, filenames[i::LOADER_THREADS])
+            for i in range(LOADER_THREADS)
+        ])
+        results = [result for chunk in chunks for result in chunk]
+        rules = self._collect_rule_files(json_rules_dir, results)
+
+        _LOG.info("Completed reading rules from peristence")
+        return rules
+
+    def get_load_times(self) -> dict:
+        """ Seconds spent loading each rule file during the last get_rules()
+        :rtype: dict
+        """
+        return dict(self._load_times)
+
+    def query_rules(self, group: str = None, enabled: bool = None) -> list:
+        """ Returns the persisted rules in the group and/or with this enabled flag.
+        The SQLite backend answers with an indexed query, the file backend loads and filters.
+        This is for tools reading the store; the REST routes filter the rules the engine has
+        loaded instead (see rest_responses.rules).
+        :rtype: list(rule_objects.AutomationRule)
+        """
+        if self._backend == BACKEND_SQLITE:
+            return self._rules_from_dicts(
+                self._sqlite_store.get_rule_dicts(group=group, enabled=enabled))
+
+        return [
+            rule for rule in self.get_rules(self._json_rules_dir)
+            if (group is None or rule.group == group)
+            and (enabled is None or rule.enabled == enabled)
+        ]
+
     def load_rule(self, rule_id: str) -> rule_objects.AutomationRule:
+        if self._backend == BACKEND_SQLITE:
+            rule_dicts = [self._sqlite_store.get_rule_dict(rule_id)]
+            rules = self._rules_from_dicts([d for d in rule_dicts if d is not None])
+            return rules[0] if rules else None
+
+        if self._backend == BACKEND_PACKED:
+            rule_dict = self._packed_store.load_rule_dict(rule_id)
+            rules = self._rules_from_dicts([rule_dict] if rule_dict is not None else [])
+            return rules[0] if rules else None
+
         filename = self._build_filename(rule_id)
         return self.load_rule_from_file(filename)
 
     def save_rule(self, rule: rule_objects.AutomationRule):
-        self._save_file_rule(rule)
+        if self._backend == BACKEND_SQLITE:
+            self._sqlite_store.save_rule_dict(rule.serialize())
+        elif self._backend == BACKEND_PACKED:
+            self._packed_store.save_rule_dict(rule.serialize())
+        else:
+            self._save_file_rule(rule)
 
     def delete_rule(self, rule_id: str) -> bool:
+        if self._backend == BACKEND_SQLITE:
+            return self._sqlite_store.delete_rule(rule_id)
+        if self._backend == BACKEND_PACKED:
+            return self._packed_store.delete_rule(rule_id)
         return self._delete_file_rule(rule_id)
 
     def load_rule_from_file(self, filename: str) -> rule_objects.AutomationRule:
@@ -91,7 +195,8 @@ class PersistenceManager:
         _LOG.info("Opening JSON rules file: {}".format(filename))
 
         try:
-            json_rule = json.load(open(filename))
+            with open(filename) as infile:
+                json_rule = json.load(infile)
         except Exception as e:
             _LOG.error(
                 "Error loading rule file: {}: {}".format(sys.exc_info()[0], sys.exc_info()[1]))
@@ -104,15 +209,91 @@ class PersistenceManager:
 
         return result.get("rule")
 
+    def _rules_from_dicts(self, rule_dicts: list) -> list:
+        rules = []
+        for rule_dict in rule_dicts:
+            result = self.rule_from_dict(rule_dict)
+            if not result.get("success"):
+                _LOG.error("Rule did not load properly: {}: {}".format(
+                    rule_dict.get("id"), result.get("message")))
+                continue
+            rules.append(result.get("rule"))
+        return rules
+
+    def _list_rule_files(self, json_rules_dir: str) -> list:
+        return [
+            os.path.join(json_rules_dir, file)
+            for file in os.listdir(json_rules_dir) if file.endswith(JSON_EXTENSION)
+        ]
+
+    def _load_cached_rule_files(self, filenames: list) -> list:
+        return [self._load_cached_rule_file(filename) for filename in filenames]
+
+    def _load_cached_rule_file(self, filename: str) -> tuple:
+        """ Returns (filename, stat_key, rule, cached, elapsed_secs).
+        Safe to run in a worker thread; it only reads the cache.
+        """
+        start = time.perf_counter()
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return (filename, None, None, False, time.perf_counter() - start)
+        stat_key = (stat.st_mtime_ns, stat.st_size)
+
+        cached = self._rule_cache.get(filename)
+        if cached is not None and cached[0] == stat_key:
+            return (filename, stat_key, cached[1], True, time.perf_counter() - start)
+
+        _LOG.info("Found rule file: {}".format(filename))
+        rule = self.load_rule_from_file(filename)
+        return (filename, stat_key, rule, False, time.perf_counter() - start)
+
+    def _collect_rule_files(self, json_rules_dir: str, results: list) -> list:
+        """ Updates the rule cache and load times from _load_cached_rule_file() results"""
+        rules = []
+        cache = {}
+        self._load_times = {}
+        parsed = 0
+
+        for filename, stat_key, rule, cached, elapsed in results:
+            self._load_times[filename] = elapsed
+            _LOG.debug("Loaded rule file in {:.2f} ms{}: {}".format(
+                elapsed * 1000, " (cached)" if cached else "", filename))
+            if rule is None:
+                _LOG.error("Rule did not load properly: {}".format(filename))
+                continue
+            if not cached:
+                parsed += 1
+            cache[filename] = (stat_key, rule)
+            rules.append(rule)
+
+        # Drop files that have been deleted from the directory
+        rules_dir = os.path.dirname(os.path.join(json_rules_dir, JSON_EXTENSION))
+        for filename in list(self._rule_cache):
+            if os.path.dirname(filename) != rules_dir or filename in cache:
+                continue
+            del self._rule_cache[filename]
+        self._rule_cache.update(cache)
+
+        if self._load_times:
+            slowest = max(self._load_times, key=self._load_times.get)
+            _LOG.info(
+                "Loaded {} rule files ({} parsed, {} cached); slowest {:.2f} ms: {}".format(
+                    len(results), parsed, len(results) - parsed,
+                    self._load_times[slowest] * 1000, slowest))
+        return rules
+
     def _save_file_rule(self, rule: rule_objects.AutomationRule):
         filename = self._build_filename(rule.id)
         _LOG.info("Saving rule with filename: {}".format(filename))
+        self._rule_cache.pop(filename, None)
         with open(filename, 'w') as outfile:
             json.dump(rule.serialize(), outfile)
 
     def _delete_file_rule(self, rule_id: str) -> bool:
         '''Returns True if file existed, False if file did not exist'''
         filename = self._build_filename(rule_id)
+        self._rule_cache.pop(filename, None)
         try:
             os.remove(filename)
         except FileNotFoundError:
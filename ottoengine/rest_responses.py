@@ -0,0 +1,315 @@
+"""Response bodies of the REST API routes, shared by the Flask server (restapi) and the
+asyncio server (async_restapi) so both return the same data
+
+The list routes (rules, entities, services, logs, traces) take these query arguments:
+
+    limit=N             return at most N items, and a next_cursor for the following page
+    cursor=C            continue after the page that returned next_cursor C
+    fields=a,b          return only these fields of each item
+    format=ndjson       one JSON item per line, written as it is serialized
+    group=G, enabled=true|false             (rules)
+    prefix=light.kitchen_, domain=light     (entities; services take domain)
+    since=SEQ, type=trigger_fired, rule=ID  (logs)
+    since=TRACE_ID, rule=ID                 (traces, and the Chrome export of them)
+
+Paged lists are ordered by their key (rule id, entity id, domain, log seq, trace id) so a
+cursor stays valid when items are added or removed between requests.
+"""
+import base64
+import bisect
+import json
+import logging
+
+from ottoengine import tracing
+
+_LOG = logging.getLogger(__name__)
+# _LOG.setLevel(logging.DEBUG)
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+CURSOR_HEADER = "X-Next-Cursor"     # next_cursor of an NDJSON response
+FILTERS = ("group", "enabled", "prefix", "domain", "since", "type", "rule")
+
+
+class ListQuery(object):
+    """The paging, field selection, format and filter arguments of a list request"""
+
+    def __init__(self, limit: int = None, cursor=None, fields: list = None,
+                 ndjson: bool = False, filters: dict = None):
+        self.limit = limit
+        self.cursor = cursor        # Decoded key of the last item of the previous page
+        self.fields = fields
+        self.ndjson = ndjson
+        self.filters = filters if filters is not None else {}
+
+    @property
+    def paged(self) -> bool:
+        return self.limit is not None or self.cursor is not None
+
+    @classmethod
+    def from_args(cls, args: dict):
+        '''Parses the request's query arguments. Raises ValueError if one is invalid.'''
+        query = cls()
+        if args.get("limit"):
+            query.limit = int(args["limit"])
+            if query.limit < 1:
+                raise ValueError("limit must be at least 1")
+        if args.get("cursor"):
+            query.cursor = _decode_cursor(args["cursor"])
+        if args.get("fields"):
+            query.fields = [field.strip() for field in args["fields"].split(",")]
+        if args.get("format", "json") not in ("json", "ndjson"):
+            raise ValueError("format must be json or ndjson")
+        query.ndjson = args.get("format") == "ndjson"
+        for name in FILTERS:
+            if args.get(name):
+                query.filters[name] = args[name]
+        if "enabled" in query.filters:
+            enabled = query.filters["enabled"].lower()
+            if enabled not in ("true", "false", "1", "0"):
+                raise ValueError("enabled must be true or false")
+            query.filters["enabled"] = enabled in ("true", "1")
+        if "since" in query.filters:
+            query.filters["since"] = int(query.filters["since"])
+        return query
+
+
+class Page(object):
+    """One page of a list response, serialized as it is iterated"""
+
+    def __init__(self, items: list, serialize, query: ListQuery, next_cursor: str = None):
+        self._items = items
+        self._serialize = serialize
+        self._query = query
+        self.next_cursor = next_cursor
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def ndjson(self) -> bool:
+        return self._query.ndjson
+
+    def iter_dicts(self):
+        fields = self._query.fields
+        for item in self._items:
+            item_dict = self._serialize(item)
+            if fields is not None:
+                item_dict = {field: item_dict.get(field) for field in fields}
+            yield item_dict
+
+    def iter_ndjson(self):
+        '''Yields each item as a line of JSON (bytes)'''
+        for item_dict in self.iter_dicts():
+            yield (json.dumps(item_dict) + "\n").encode()
+
+    def to_dict(self) -> dict:
+        resp = {"data": list(self.iter_dicts())}
+        if self._query.paged:
+            resp["next_cursor"] = self.next_cursor
+        return resp
+
+
+def ping() -> dict:
+    return {"success": True}
+
+
+def reload_rules(result: dict) -> dict:
+    success = result.get("success")
+    if success:
+        return {"success": success, "message": "Rules reloaded successfully"}
+    return {"success": success, "message": result.get("message")}
+
+
+def rules(rule_list: list, query: ListQuery = None) -> Page:
+    query = query or ListQuery()
+    _check_filters(query, ("group", "enabled"))
+    group = query.filters.get("group")
+    enabled = query.filters.get("enabled")
+    # Filters the rules the engine has loaded, which is what the routes report; they can
+    # differ from the persisted rules until a reload, and are already decoded
+    if group is not None or enabled is not None:
+        rule_list = [
+            rule for rule in rule_list
+            if (group is None or rule.group == group)
+            and (enabled is None or rule.enabled == enabled)
+        ]
+    return _page(rule_list, lambda rule: rule.id, lambda rule: rule.serialize(), query)
+
+
+def entities(entity_list: list, query: ListQuery = None) -> Page:
+    query = query or ListQuery()
+    _check_filters(query, ("prefix", "domain"))
+    starts = []
+    if "domain" in query.filters:
+        starts.append(query.filters["domain"] + ".")
+    if "prefix" in query.filters:
+        starts.append(query.filters["prefix"])
+    for start in starts:
+        entity_list = [
+            entity for entity in entity_list if entity.get("entity_id").startswith(start)]
+    return _page(entity_list, lambda entity: entity.get("entity_id"), _entity_dict, query)
+
+
+def services(service_list: list, query: ListQuery = None) -> Page:
+    query = query or ListQuery()
+    _check_filters(query, ("domain",))
+    domain = query.filters.get("domain")
+    if domain is not None:
+        service_list = [service for service in service_list if service.name == domain]
+    return _page(
+        service_list, lambda service: service.name, lambda service: service.serialize(), query)
+
+
+def get_rule(rule_id: str, rule) -> dict:
+    if rule is None:
+        return {
+            "success": False,
+            "id": rule_id,
+            "message:": "Rule was not found"
+        }
+    return {
+        "success": True,
+        "id": rule_id,
+        "data": rule.serialize()
+    }
+
+
+def save_rule(rule_id: str, data: dict, result: dict) -> dict:
+    success = result.get("success")
+    if success:
+        return {
+            "success": success,
+            "id": data.get("id"),
+            "message": "Rule saved"
+        }
+    return {
+        "success": success,
+        "id": rule_id,
+        "message": result.get("message"),
+        "data": data
+    }
+
+
+def delete_rule(rule_id: str, success: bool) -> dict:
+    return {
+        "success": success,
+        "id": rule_id
+    }
+
+
+def clock_check(spec: dict, result: dict) -> dict:
+    success = result.get("success")
+    if success:
+        return {
+            "success": success,
+            "data": {"next_time": result.get("next_time")}
+        }
+    return {
+        "success": success,
+        "message": result.get("message"),
+        "data": {"spec": spec}
+    }
+
+
+def log_filters(query: ListQuery) -> dict:
+    """ The EngineLog.get_logs() arguments for the query, so only the entries for the page are
+    read from the log. The limit is one more than the page, to tell if there is another.
+    """
+    _check_filters(query, ("since", "type", "rule"))
+    since = query.filters.get("since")
+    if query.cursor is not None:
+        if not isinstance(query.cursor, int):
+            raise ValueError("The cursor is not from this list")
+        since = max(since or 0, query.cursor)
+    return {
+        "since": since,
+        "logtype": query.filters.get("type"),
+        "rule_id": query.filters.get("rule"),
+        "limit": query.limit + 1 if query.limit is not None else None,
+    }
+
+
+def logs(log_list: list, query: ListQuery = None) -> Page:
+    """ log_list is from EngineLog.get_logs(**log_filters(query)) """
+    query = query or ListQuery()
+    _check_filters(query, ("since", "type", "rule"))
+    return _page(log_list, _log_seq, _log_dict, query)
+
+
+def trace_filters(query: ListQuery) -> dict:
+    """ The Tracer.get_traces() arguments for the query """
+    _check_filters(query, ("since", "rule"))
+    return {"since": query.filters.get("since"), "rule_id": query.filters.get("rule")}
+
+
+def traces(trace_list: list, query: ListQuery = None) -> Page:
+    """ trace_list is from Tracer.get_traces(**trace_filters(query)) """
+    query = query or ListQuery()
+    _check_filters(query, ("since", "rule"))
+    return _page(trace_list, _trace_id, _trace_dict, query)
+
+
+def chrome_trace(trace_list: list) -> dict:
+    """ The traces as Chrome trace events, for chrome://tracing or Perfetto """
+    return tracing.to_chrome_trace(trace_list)
+
+
+def error(message: str) -> dict:
+    return {"success": False, "message": message}
+
+
+def _entity_dict(entity: dict) -> dict:
+    return {
+        "entity_id": entity.get("entity_id"),
+        "friendly_name": entity.get("friendly_name"),
+        "hidden": entity.get("hidden"),
+    }
+
+
+def _log_seq(log: dict) -> int:
+    return log["seq"]
+
+
+def _log_dict(log: dict) -> dict:
+    return log
+
+
+def _trace_id(trace: dict) -> int:
+    return trace["trace_id"]
+
+
+def _trace_dict(trace: dict) -> dict:
+    return trace
+
+
+def _check_filters(query: ListQuery, supported: tuple):
+    for name in query.filters:
+        if name not in supported:
+            raise ValueError("This list can't be filtered by {}".format(name))
+
+
+def _page(items: list, key, serialize, query: ListQuery) -> Page:
+    if not query.paged:
+        return Page(items, serialize, query)
+
+    items = sorted(items, key=key)
+    start = 0
+    if query.cursor is not None:
+        try:
+            start = bisect.bisect_right([key(item) for item in items], query.cursor)
+        except TypeError:
+            raise ValueError("The cursor is not from this list")
+    end = len(items) if query.limit is None else start + query.limit
+    next_cursor = _encode_cursor(key(items[end - 1])) if end < len(items) else None
+    return Page(items[start:end], serialize, query, next_cursor)
+
+
+def _encode_cursor(key) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def _decode_cursor(cursor: str):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except ValueError:
+        raise ValueError("Invalid cursor")
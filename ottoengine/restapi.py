@@ -3,10 +3,13 @@ import flask_cors
 import json
 import logging
 
+from ottoengine import metrics, rest_responses
+
 MIMETYPE = "application/json"
 
 app = flask.Flask(__name__)
-flask_cors.CORS(app)    # Allow all cross-origin requests
+# Allow all cross-origin requests
+flask_cors.CORS(app, expose_headers=[rest_responses.CURSOR_HEADER])
 _LOG = logging.getLogger(__name__)
 # _LOG.setLevel(logging.DEBUG)
 
@@ -17,8 +20,24 @@ def run_server():
     app.run(host='0.0.0.0')
 
 
-def dict_to_json_response(data_dict: dict) -> flask.Response:
-    return flask.Response(json.dumps(data_dict), mimetype=MIMETYPE)
+def dict_to_json_response(data_dict: dict, status: int = 200) -> flask.Response:
+    return flask.Response(json.dumps(data_dict), status=status, mimetype=MIMETYPE)
+
+
+def list_response(build_page, items: list, query=None) -> flask.Response:
+    """Pages, filters and serializes the items as the request's query arguments ask"""
+    try:
+        query = query or rest_responses.ListQuery.from_args(flask.request.args)
+        page = build_page(items, query)
+    except ValueError as e:
+        return dict_to_json_response(rest_responses.error(str(e)), status=400)
+    if page.ndjson:
+        headers = {}
+        if page.next_cursor is not None:
+            headers[rest_responses.CURSOR_HEADER] = page.next_cursor
+        return flask.Response(
+            page.iter_ndjson(), mimetype=rest_responses.NDJSON_MIMETYPE, headers=headers)
+    return dict_to_json_response(page.to_dict())
 
 
 @app.route('/shutdown', methods=['GET'])
@@ -33,50 +52,31 @@ def shutdown():
 
 @app.route('/rest/ping')
 def ping():
-    return dict_to_json_response({"success": True})
+    return dict_to_json_response(rest_responses.ping())
 
 
 @app.route('/rest/reload', methods=['GET'])
 def reload():
     result = engine_obj.reload_rules_threadsafe()
-    success = result.get("success")
-    if success:
-        resp = {"success": success, "message": "Rules reloaded successfully"}
-    else:
-        resp = {"success": success, "message": result.get("message")}
-    return dict_to_json_response(resp)
+    return dict_to_json_response(rest_responses.reload_rules(result))
 
 
 @app.route('/rest/rules', methods=['GET'])
 def rules():
     rules = engine_obj.get_rules_threadsafe()
-    resp = {"data": [rule.serialize() for rule in rules]}
-    return dict_to_json_response(resp)
+    return list_response(rest_responses.rules, rules)
 
 
 @app.route('/rest/entities', methods=['GET'])
 def entities():
     entities = engine_obj.get_entities_threadsafe()
-    resp = json.dumps({
-        "data": [
-            {
-                "entity_id": entity.get("entity_id"),
-                "friendly_name": entity.get("friendly_name"),
-                "hidden": entity.get("hidden"),
-            }
-            for entity in entities
-        ]
-    })
-    return resp
+    return list_response(rest_responses.entities, entities)
 
 
 @app.route('/rest/services', methods=['GET'])
 def services():
     services = engine_obj.get_services_threadsafe()
-    resp = json.dumps({
-        "data": [service.serialize() for service in services]
-    })
-    return resp
+    return list_response(rest_responses.services, services)
 
 
 @app.route('/rest/rule', methods=['PUT'])
@@ -87,19 +87,7 @@ def rule(rule_id=None):
         """Return the rule with ID <rule_id>"""
         _LOG.info("GET for rule {}".format(rule_id))
         rule = engine_obj.get_rule_threadsafe(rule_id)
-        if rule is None:
-            resp = json.dumps({
-                "success": False,
-                "id": rule_id,
-                "message:": "Rule was not found"
-            })
-        else:
-            resp = json.dumps({
-                "success": True,
-                "id": rule_id,
-                "data": rule.serialize()
-            })
-        return resp
+        return json.dumps(rest_responses.get_rule(rule_id, rule))
 
     if flask.request.method == 'PUT':
         """Store the rule as ID <rule_id>"""
@@ -109,31 +97,13 @@ def rule(rule_id=None):
         data = flask.request.get_json().get("data")
 
         result = engine_obj.save_rule_threadsafe(data)
-
-        success = result.get("success")
-        if success:
-            resp = json.dumps({
-                "success": success,
-                "id": data.get("id"),
-                "message": "Rule saved"
-            })
-        else:
-            resp = json.dumps({
-                "success": success,
-                "id": rule_id,
-                "message": result.get("message"),
-                "data": data
-            })
-        return resp
+        return json.dumps(rest_responses.save_rule(rule_id, data, result))
 
     if flask.request.method == 'DELETE':
         """Delete rule with ID <rule_id>"""
         _LOG.info("DELETE for rule {}".format(rule_id))
         success = engine_obj.delete_rule_threadsafe(rule_id)
-        return json.dumps({
-            "success": success,
-            "id": rule_id
-        })
+        return json.dumps(rest_responses.delete_rule(rule_id, success))
 
     else:
         # POST Error 405 Method Not Allowed
@@ -147,25 +117,44 @@ def clock_check():
     spec = flask.request.get_json().get('data')
     _LOG.info(spec)
     result = engine_obj.check_timespec_threadsafe(spec)
-
-    success = result.get("success")
-    if success:
-        resp = json.dumps({
-            "success": success,
-            "data": {"next_time": result.get("next_time")}
-        })
-    else:
-        resp = json.dumps({
-            "success": success,
-            "message": result.get("message"),
-            "data": {"spec": spec}
-        })
-    return resp
+    return json.dumps(rest_responses.clock_check(spec, result))
 
 
 @app.route('/rest/logs', methods=['GET'])
 def logs():
-    resp = json.dumps({
-        "data": [entry for entry in engine_obj.get_logs_threadsafe()]
-    })
-    return resp
+    try:
+        query = rest_responses.ListQuery.from_args(flask.request.args)
+        filters = rest_responses.log_filters(query)
+    except ValueError as e:
+        return dict_to_json_response(rest_responses.error(str(e)), status=400)
+    return list_response(rest_responses.logs, engine_obj.get_logs_threadsafe(**filters), query)
+
+
+@app.route('/rest/traces', methods=['GET'])
+def traces():
+    try:
+        query = rest_responses.ListQuery.from_args(flask.request.args)
+        filters = rest_responses.trace_filters(query)
+    except ValueError as e:
+        return dict_to_json_response(rest_responses.error(str(e)), status=400)
+    return list_response(
+        rest_responses.traces, engine_obj.get_traces_threadsafe(**filters), query)
+
+
+@app.route('/rest/traces/chrome', methods=['GET'])
+def chrome_trace():
+    """Traces as Chrome trace event JSON, to open in chrome://tracing or Perfetto"""
+    try:
+        filters = rest_responses.trace_filters(
+            rest_responses.ListQuery.from_args(flask.request.args))
+    except ValueError as e:
+        return dict_to_json_response(rest_responses.error(str(e)), status=400)
+    return dict_to_json_response(
+        rest_responses.chrome_trace(engine_obj.get_traces_threadsafe(**filters)))
+
+
+@app.route('/rest/metrics', methods=['GET'])
+def metrics_text():
+    """Rule metrics and engine stats in Prometheus text format"""
+    return flask.Response(
+        engine_obj.get_metrics_text_threadsafe(), content_type=metrics.CONTENT_TYPE)
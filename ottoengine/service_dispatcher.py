@@ -0,0 +1,245 @@
+import asyncio
+import json
+import logging
+
+from ottoengine.model import dataobjects
+
+_LOG = logging.getLogger(__name__)
+# _LOG.setLevel(logging.DEBUG)
+
+# A batch is sent when its window ends, or as soon as it holds this many calls
+MAX_BATCH_CALLS = 200
+
+# Services that set the same thing on an entity, so only the last one in a batch matters
+ON_OFF_SERVICES = frozenset(["turn_on", "turn_off", "toggle"])
+NO_DATA = json.dumps({})     # The data of a call with nothing but an entity_id
+
+
+def _entity_ids(service_data: dict) -> list:
+    """Returns the entity_ids a call targets, or None if it can't be merged with others"""
+    value = service_data.get("entity_id")
+    if isinstance(value, str):
+        entity_ids = [entity_id.strip() for entity_id in value.split(",")]
+    elif isinstance(value, list) and all(isinstance(entity_id, str) for entity_id in value):
+        entity_ids = list(value)
+    else:
+        return None
+    entity_ids = [entity_id for entity_id in entity_ids if entity_id]
+    return entity_ids or None
+
+
+def merge_key(domain: str, service: str, service_data: dict) -> tuple:
+    """Returns (key, entity_ids) for a call, where calls with the same key differ only in
+    the entities they target, or None if the call can't be merged with others
+    """
+    entity_ids = _entity_ids(service_data)
+    if entity_ids is None:
+        return None
+    data = {key: value for key, value in service_data.items() if key != "entity_id"}
+    return (domain, service, json.dumps(data, sort_keys=True, default=str)), entity_ids
+
+
+def _conflicts(key: tuple, other_key: tuple) -> bool:
+    """True if a later call on the same entity makes an earlier one pointless, so only the
+    later one is sent: the same call with the same data (other than a call with no data,
+    such as volume_up, which does something each time), or one of turn_on, turn_off and
+    toggle after a different one of them
+    """
+    service = key[1]
+    other_service = other_key[1]
+    if service in ON_OFF_SERVICES and other_service in ON_OFF_SERVICES:
+        return service != other_service or key == other_key
+    return key == other_key and key[2] != NO_DATA
+
+
+class _CallGroup(object):
+    """Calls merged into a single ServiceCall"""
+
+    __slots__ = ("seq", "key", "domain", "service", "data", "entity_ids", "waiters", "traces")
+
+    def __init__(self, seq, key, domain, service, data, entity_ids):
+        self.seq = seq
+        self.key = key                  # None for a call that isn't merged
+        self.domain = domain
+        self.service = service
+        self.data = data                # service_data without the entity_id
+        self.entity_ids = entity_ids    # None for a call that isn't merged
+        self.waiters = []               # Futures waiting on this call's result
+        self.traces = []                # Spans of the traced calls this one carries
+
+    @property
+    def dropped(self) -> bool:
+        """True once later calls have superseded every entity in the group"""
+        return self.entity_ids is not None and not self.entity_ids
+
+    def to_service_call(self) -> dataobjects.ServiceCall:
+        service_data = dict(self.data)
+        if self.entity_ids is not None:
+            if len(self.entity_ids) == 1:
+                service_data["entity_id"] = self.entity_ids[0]
+            else:
+                service_data["entity_id"] = list(self.entity_ids)
+        return dataobjects.ServiceCall(
+            self.domain, self.service, service_data, self.traces or None)
+
+
+class _Batch(object):
+    """The calls collected during one window, merged in the order they arrived"""
+
+    def __init__(self):
+        self.groups = []
+        self.num_calls = 0
+        self._open = {}             # key -> newest group with that key
+        self._entity_groups = {}    # entity_id -> groups targeting it
+
+    def add(self, service_call: dataobjects.ServiceCall, future: asyncio.Future):
+        self.num_calls += 1
+        service_data = service_call.service_data or {}
+        merge = merge_key(service_call.domain, service_call.service, service_data)
+        if merge is None:
+            group = _CallGroup(len(self.groups), None, service_call.domain,
+                               service_call.service, service_data, None)
+            group.waiters.append(future)
+            if service_call.traces:
+                group.traces.extend(service_call.traces)
+            self.groups.append(group)
+            return
+
+        key, entity_ids = merge
+        data = {name: value for name, value in service_data.items() if name != "entity_id"}
+
+        # Last one wins: take the entities out of earlier calls that set the same thing.
+        # Whoever waits on a call superseded entirely gets this call's result.
+        superseded = []     # Groups this call supersedes entirely
+        for entity_id in entity_ids:
+            for group in list(self._entity_groups.get(entity_id, [])):
+                if _conflicts(group.key, key):
+                    self._remove_entity(group, entity_id, superseded)
+
+        # Merge into the newest group with the same request, unless it already targets
+        # one of the entities (a call that repeats), or a later group does, which would
+        # change the order they run in
+        group = self._open.get(key)
+        if group is not None:
+            for entity_id in entity_ids:
+                if entity_id in group.entity_ids or any(
+                        other.seq > group.seq for other in self._entity_groups.get(entity_id, [])):
+                    group = None
+                    break
+        if group is None:
+            group = _CallGroup(len(self.groups), key, service_call.domain,
+                               service_call.service, data, [])
+            self.groups.append(group)
+            self._open[key] = group
+
+        for entity_id in entity_ids:
+            if entity_id not in group.entity_ids:
+                group.entity_ids.append(entity_id)
+                self._entity_groups.setdefault(entity_id, []).append(group)
+        group.waiters.append(future)
+        if service_call.traces:
+            group.traces.extend(service_call.traces)
+        for dropped in superseded:
+            group.waiters.extend(dropped.waiters)
+            group.traces.extend(dropped.traces)
+            dropped.waiters = []
+            dropped.traces = []
+
+    def _remove_entity(self, group: _CallGroup, entity_id: str, superseded: list):
+        group.entity_ids.remove(entity_id)
+        self._entity_groups[entity_id].remove(group)
+        if group.dropped:
+            superseded.append(group)
+            if self._open.get(group.key) is group:
+                del self._open[group.key]
+
+
+class ServiceCallDispatcher(object):
+    """Collects service calls for a short window, then sends them merged.
+
+    Calls with the same domain, service and data are sent as one call with a list of
+    entity_ids. When calls in the same window set the same thing on an entity (the same
+    call with the same data, or a change between turn_on/turn_off/toggle) only the last
+    one is sent for that entity. Calls with no data that repeat, such as volume_up, are
+    all sent. Everything else is sent in the order it arrived. Each caller gets the result
+    of the call that carried its request.
+
+    A batch is sent window_secs after its first call, or sooner if it reaches max_calls,
+    so no call waits longer than the window.
+    """
+
+    def __init__(self, async_send, window_secs: float, max_calls: int = MAX_BATCH_CALLS):
+        """
+            :param async_send: Coroutine function(ServiceCall) -> result message dict
+            :param float window_secs: How long a batch collects calls
+            :param int max_calls: Number of calls that sends a batch before its window ends
+        """
+        self._async_send = async_send
+        self._window_secs = window_secs
+        self._max_calls = max_calls
+        self._batch = None
+        self._flush_handle = None
+
+        self._calls_received = 0
+        self._calls_sent = 0
+        self._batches = 0
+
+    @property
+    def window_secs(self) -> float:
+        return self._window_secs
+
+    async def async_call(self, service_call: dataobjects.ServiceCall) -> dict:
+        """Adds the call to the current batch and returns the result message of the
+        call that carried it
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        if self._batch is None:
+            self._batch = _Batch()
+            self._flush_handle = loop.call_later(self._window_secs, self._flush)
+
+        self._batch.add(service_call, future)
+        self._calls_received += 1
+        if self._batch.num_calls >= self._max_calls:
+            self._flush()
+        return await future
+
+    def get_stats(self) -> dict:
+        """
+        :rtype: dict
+        """
+        return {
+            "window_secs": self._window_secs,
+            "calls_received": self._calls_received,
+            "calls_sent": self._calls_sent,
+            "batches": self._batches
+        }
+
+    def _flush(self):
+        if self._batch is None:
+            return
+        self._flush_handle.cancel()
+        batch = self._batch
+        self._batch = None
+        self._flush_handle = None
+        asyncio.ensure_future(self._async_send_batch(batch))
+
+    async def _async_send_batch(self, batch: _Batch):
+        groups = [group for group in batch.groups if not group.dropped]
+        service_calls = [group.to_service_call() for group in groups]
+        self._batches += 1
+        self._calls_sent += len(service_calls)
+        _LOG.debug("Sending {} service calls for {} requested".format(
+            len(service_calls), batch.num_calls))
+
+        # Sent together so they are pipelined, in the order they were merged
+        results = await asyncio.gather(
+            *[self._async_send(service_call) for service_call in service_calls],
+            return_exceptions=True)
+
+        for group, result in zip(groups, results):
+            if isinstance(result, Exception):
+                result = {"success": False, "error": {"message": str(result)}}
+            for future in group.waiters:
+                if not future.done():
+                    future.set_result(result)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""SQLite storage for rules, one row per rule.
+
+Import an existing JSON rules directory with:
+
+    python -m ottoengine.sqlite_store import <json_rules_dir> <sqlite_path>
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+
+_LOG = logging.getLogger(__name__)
+# _LOG.setLevel(logging.DEBUG)
+
+JSON_EXTENSION = 'json'
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS rules (
+        id TEXT PRIMARY KEY,
+        rule_group TEXT NOT NULL DEFAULT '',
+        enabled INTEGER NOT NULL DEFAULT 1,
+        body TEXT NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS rule_entities (
+        entity_id TEXT NOT NULL,
+        rule_id TEXT NOT NULL REFERENCES rules(id) ON DELETE CASCADE,
+        PRIMARY KEY (entity_id, rule_id)
+    )""",
+    "CREATE INDEX IF NOT EXISTS rules_group_idx ON rules (rule_group)",
+    "CREATE INDEX IF NOT EXISTS rules_enabled_idx ON rules (enabled)",
+    "CREATE INDEX IF NOT EXISTS rule_entities_rule_idx ON rule_entities (rule_id)",
+]
+
+
+def _trigger_entity_ids(rule_dict: dict) -> set:
+    """Returns the entity_ids referenced by the rule's triggers"""
+    entity_ids = set()
+    for trigger in rule_dict.get("triggers", []):
+        value = trigger.get("entity_id")
+        if not value:
+            continue
+        for entity_id in str(value).split(","):
+            if entity_id.strip():
+                entity_ids.add(entity_id.strip())
+    return entity_ids
+
+
+class SqliteRuleStore(object):
+    """Stores serialized rules in an SQLite database.
+
+    The rule JSON is kept in a body column, with the id, group, enabled flag and the
+    trigger entity_ids in indexed columns so they can be queried without parsing rules.
+    Methods return rule dicts; turning them into AutomationRules is left to the caller.
+    The connection is shared between threads, so every access holds a lock.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA foreign_keys = ON")
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        with self._lock, self._conn:
+            for statement in SCHEMA:
+                self._conn.execute(statement)
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # ~~~~~~~~~~~~~~
+    # Public methods
+    # ~~~~~~~~~~~~~~
+
+    def get_rule_dicts(self, group: str = None, enabled: bool = None) -> list:
+        """Returns the rule dicts, in id order, optionally filtered by group and enabled flag
+        :rtype: list(dict)
+        """
+        sql = "SELECT body FROM rules"
+        clauses = []
+        params = []
+        if group is not None:
+            clauses.append("rule_group = ?")
+            params.append(group)
+        if enabled is not None:
+            clauses.append("enabled = ?")
+            params.append(1 if enabled else 0)
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY id"
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [json.loads(body) for body, in rows]
+
+    def get_rule_dict(self, rule_id: str) -> dict:
+        """Returns the rule dict, or None if there is no rule with this id"""
+        with self._lock:
+            row = self._conn.execute("SELECT body FROM rules WHERE id = ?", (rule_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_rule_ids_for_entity(self, entity_id: str) -> list:
+        """Returns the ids of the rules with a trigger on entity_id
+        :rtype: list(str)
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT rule_id FROM rule_entities WHERE entity_id = ? ORDER BY rule_id",
+                (entity_id,)).fetchall()
+        return [rule_id for rule_id, in rows]
+
+    def save_rule_dicts(self, rule_dicts: list):
+        """Inserts or replaces the rules in a single transaction"""
+        with self._lock, self._conn:
+            for rule_dict in rule_dicts:
+                self._save(rule_dict)
+
+    def save_rule_dict(self, rule_dict: dict):
+        self.save_rule_dicts([rule_dict])
+
+    def delete_rule(self, rule_id: str) -> bool:
+        """Returns True if the rule existed, False if it did not"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute("DELETE FROM rules WHERE id = ?", (rule_id,))
+        return cursor.rowcount > 0
+
+    def import_json_dir(self, json_rules_dir: str) -> int:
+        """Imports every rule file in json_rules_dir in one transaction.
+        Returns the number of rules imported.
+        """
+        rule_dicts = []
+        for file in sorted(os.listdir(json_rules_dir)):
+            if not file.endswith(JSON_EXTENSION):
+                continue
+            filename = os.path.join(json_rules_dir, file)
+            try:
+                with open(filename) as infile:
+                    rule_dicts.append(json.load(infile))
+            except Exception:
+                _LOG.error("Skipping rule file {}: {}".format(filename, sys.exc_info()[1]))
+        self.save_rule_dicts(rule_dicts)
+        _LOG.info("Imported {} rules from {} into {}".format(
+            len(rule_dicts), json_rules_dir, self._path))
+        return len(rule_dicts)
+
+    # ~~~~~~~~~~~~~~~
+    # Private methods
+    # ~~~~~~~~~~~~~~~
+
+    def _save(self, rule_dict: dict):
+        rule_id = rule_dict["id"]
+        self._conn.execute(
+            "INSERT OR REPLACE INTO rules (id, rule_group, enabled, body) VALUES (?, ?, ?, ?)",
+            (
+                rule_id,
+                rule_dict.get("group") or '',
+                1 if rule_dict.get("enabled", True) else 0,
+                json.dumps(rule_dict)
+            )
+        )
+        self._conn.execute("DELETE FROM rule_entities WHERE rule_id = ?", (rule_id,))
+        self._conn.executemany(
+            "INSERT INTO rule_entities (entity_id, rule_id) VALUES (?, ?)",
+            [(entity_id, rule_id) for entity_id in _trigger_entity_ids(rule_dict)]
+        )
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Manage an otto-engine SQLite rule store")
+    subparsers = arg_parser.add_subparsers(dest="command")
+    import_parser = subparsers.add_parser("import", help="Import a JSON rules directory")
+    import_parser.add_argument("json_rules_dir")
+    import_parser.add_argument("sqlite_path")
+    args = arg_parser.parse_args(argv)
+
+    if args.command != "import":
+        arg_parser.print_help()
+        return 1
+
+    logging.basicConfig(level=logging.INFO)
+    store = SqliteRuleStore(args.sqlite_path)
+    try:
+        count = store.import_json_dir(args.json_rules_dir)
+    finally:
+        store.close()
+    print("Imported {} rules into {}".format(count, args.sqlite_path))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,83 @@
-import copy
+import collections.abc
+import contextlib
 import logging
 
 _LOG = logging.getLogger(__name__)
 
+# Distinct attribute sets kept for sharing between entity states before the pool is reset
+ATTRIBUTE_POOL_MAX = 20000
+
+# Entity states are split into this many dicts, so a write after a snapshot was published
+# only has to copy the one shard it changes. Must be a power of 2.
+SNAPSHOT_SHARDS = 256
+_SHARD_MASK = SNAPSHOT_SHARDS - 1
+
+
+def _attributes_key(attributes: dict):
+    """Hashable key for an attributes dict, or None if a value is unhashable (i.e. a list).
+    Value types are part of the key so that i.e. 1 and True are not shared.
+    """
+    try:
+        return frozenset((key, type(value), value) for key, value in attributes.items())
+    except TypeError:
+        return None
+
+
+class EntityStateSnapshot(collections.abc.Mapping):
+    """Immutable, versioned view of every entity state: entity_id -> EntityState.
+
+    A snapshot's shards are never modified after it is published, so it can be read
+    from any thread, i.e. the REST API's, without locking or copying.
+    """
+
+    __slots__ = ("_version", "_shards", "_len")
+
+    def __init__(self, version: int, shards: tuple, length: int):
+        self._version = version
+        self._shards = shards
+        self._len = length
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def __getitem__(self, entity_id):
+        return self._shards[hash(entity_id) & _SHARD_MASK][entity_id]
+
+    def get(self, entity_id, default=None):
+        return self._shards[hash(entity_id) & _SHARD_MASK].get(entity_id, default)
+
+    def __contains__(self, entity_id):
+        return entity_id in self._shards[hash(entity_id) & _SHARD_MASK]
+
+    def __iter__(self):
+        for shard in self._shards:
+            yield from shard
+
+    def __len__(self):
+        return self._len
+
 
 class OttoEngineState(object):
 
     def __init__(self):
         self._engine_states = {}
-        self._entity_states = {}
         self._services_states = {}
         self._rules = {}
+        self._attribute_pool = {}   # _attributes_key() -> shared attributes dict
+
+        # Entity states, copy-on-write: a shard shared with the published snapshot is
+        # copied before it is first written to. A shard is owned (safe to write in place)
+        # when it was copied in the current generation; publishing starts a new generation.
+        self._shards = [{} for i in range(SNAPSHOT_SHARDS)]
+        self._shard_generations = [0] * SNAPSHOT_SHARDS
+        self._generation = 1
+        self._entity_count = 0
+        self._version = 0
+        self._batch_depth = 0
+        self._publish_scheduler = None  # i.e. loop.call_soon, to publish once per iteration
+        self._publish_pending = False
+        self._snapshot = EntityStateSnapshot(0, tuple({} for i in range(SNAPSHOT_SHARDS)), 0)
 
     # Generic
     def get_state(self, group, key):
@@ -44,30 +111,101 @@ class OttoEngineState(object):
 
     # Entity states
     def set_entity_state(self, entity_id, state_obj):
-        '''Sets an entity state'''
-        _LOG.debug("{} -> {}".format(entity_id, state_obj.state))
-        self._entity_states[entity_id] = state_obj
-
-    def get_entity_state(self, entity_id):
-        '''Sets an entity state'''
-        state = self._entity_states.get(entity_id)
-        if state is None:
+        '''Sets an entity state.
+        Its attributes dict is replaced by an equal one already stored, when there is one.
+        '''
+        if _LOG.isEnabledFor(logging.DEBUG):
+            _LOG.debug("{} -> {}".format(entity_id, state_obj.state))
+        index = hash(entity_id) & _SHARD_MASK
+        shard = self._shards[index]
+
+        previous = shard.get(entity_id)
+        if previous is not None and previous.attributes == state_obj.attributes:
+            state_obj.attributes = previous.attributes
+        else:
+            state_obj.attributes = self._share_attributes(state_obj.attributes)
+
+        if self._shard_generations[index] != self._generation:
+            shard = self._shards[index] = shard.copy()
+            self._shard_generations[index] = self._generation
+        if previous is None:
+            self._entity_count += 1
+        shard[entity_id] = state_obj
+
+        if self._batch_depth > 0 or self._publish_pending:
+            return
+        if self._publish_scheduler is None:
+            self._publish()
+        else:
+            self._publish_pending = True
+            self._publish_scheduler(self._publish)
+
+    def get_entity_state(self, entity_id, warn=True):
+        '''Gets an entity state'''
+        state = self._shards[hash(entity_id) & _SHARD_MASK].get(entity_id)
+        if state is None and warn:
             _LOG.warn(f"STATE: entity {entity_id} is not in _entity_states")
         return state
 
+    @contextlib.contextmanager
+    def batch_update(self):
+        '''Publishes one snapshot for all the set_entity_state() calls made in the block'''
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._publish()
+
+    def set_publish_scheduler(self, scheduler):
+        '''Defers publishing snapshots with scheduler(callback), i.e. loop.call_soon, so a
+        burst of writes is published once. Without one, every write publishes immediately.
+        '''
+        self._publish_scheduler = scheduler
+
+    def snapshot(self) -> EntityStateSnapshot:
+        '''The latest published entity states. Safe to call from any thread.'''
+        return self._snapshot
+
+    def _share_attributes(self, attributes):
+        # A friendly_name makes the set unique to one entity, so pooling it would only cost
+        if not isinstance(attributes, dict) or "friendly_name" in attributes:
+            return attributes
+        key = _attributes_key(attributes)
+        if key is None:
+            return attributes
+
+        shared = self._attribute_pool.get(key)
+        if shared is not None:
+            return shared
+        if len(self._attribute_pool) >= ATTRIBUTE_POOL_MAX:
+            self._attribute_pool = {}
+        self._attribute_pool[key] = attributes
+        return attributes
+
     def get_all_entity_state_copy(self):
-        return copy.deepcopy(self._entity_states)
+        '''Returns a dict of the latest snapshot. The EntityStates are shared, not copied.'''
+        return dict(self._snapshot)
 
     def get_entities(self) -> list:
+        '''Reads the latest snapshot, so it is safe to call from any thread'''
         return [
             {
-                "entity_id": entity,
-                "friendly_name": self._entity_states.get(entity).friendly_name,
-                "hidden": self._entity_states[entity].hidden
+                "entity_id": entity_id,
+                "friendly_name": entity.friendly_name,
+                "hidden": entity.hidden
             }
-            for entity in self._entity_states.keys()
+            for entity_id, entity in self._snapshot.items()
         ]
 
+    def _publish(self):
+        self._publish_pending = False
+        self._version += 1
+        self._snapshot = EntityStateSnapshot(
+            self._version, tuple(self._shards), self._entity_count)
+        self._generation += 1
+
     # Services States
     def set_service_info(self, service_domain):
         _LOG.debug("set_service_info({})".format(service_domain))
@@ -89,5 +227,8 @@ class OttoEngineState(object):
     def get_rules(self) -> list:
         return list(self._rules.values())
 
+    def remove_rule(self, rule_id):
+        self._rules.pop(rule_id, None)
+
     def clear_rules(self):
         self._rules = {}
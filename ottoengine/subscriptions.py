@@ -0,0 +1,121 @@
+import logging
+
+from ottoengine import const
+from ottoengine.model import trigger_objects, action_objects
+
+_LOG = logging.getLogger(__name__)
+# _LOG.setLevel(logging.DEBUG)
+
+# Subscribe to every state_changed event, or only to the entities the rules use
+MODE_ALL = "all"
+MODE_FILTERED = "filtered"
+
+
+def get_rule_needs(rule) -> tuple:
+    """Returns (entity_ids, event_types) a rule's triggers and conditions depend on.
+
+    entity_ids are the entities of State/NumericStateTriggers and of every rule, action
+    and sequence condition, since conditions read the engine's copy of their state.
+    event_types are the EventTriggers' event types.
+        :param rule_objects.AutomationRule rule:
+        :rtype: tuple(set, set)
+    """
+    entity_ids = set()
+    event_types = set()
+    for trigger in rule.triggers:
+        if isinstance(trigger, trigger_objects.EventTrigger):
+            event_types.add(trigger.event_type)
+        elif isinstance(trigger, (trigger_objects.StateTrigger,
+                                  trigger_objects.NumericStateTrigger)):
+            entity_ids.add(trigger.entity_id)
+
+    conditions = [rule.rule_condition]
+    for action in rule.actions:
+        conditions.append(action.action_condition)
+        for item in action.action_sequence:
+            if isinstance(item, action_objects.ConditionAction):
+                conditions.append(item.condition)
+    for condition in conditions:
+        if condition is not None:
+            entity_ids.update(condition.get_entity_ids())
+
+    return (entity_ids, event_types)
+
+
+class RuleSubscriptions(object):
+    """Reference counts the entities and event types needed by the loaded rules.
+
+    Rules are added and removed one at a time as they are loaded, saved and deleted,
+    so the wanted subscriptions are always up to date without rescanning every rule.
+    """
+
+    def __init__(self, mode: str = MODE_ALL):
+        if mode not in [MODE_ALL, MODE_FILTERED]:
+            raise ValueError("Unknown subscription mode: {}".format(mode))
+        self._mode = mode
+        self._rule_needs = {}       # rule_id -> (entity_ids, event_types)
+        self._entity_counts = {}    # entity_id -> number of rules that need it
+        self._event_counts = {}     # event_type -> number of rules that need it
+
+    @property
+    def mode(self) -> str:
+        return self._mode
+
+    def add_rule(self, rule):
+        """Adds an enabled rule's needs, replacing any previous needs for its id
+            :param rule_objects.AutomationRule rule:
+        """
+        self.remove_rule(rule.id)
+        entity_ids, event_types = get_rule_needs(rule)
+        self._rule_needs[rule.id] = (entity_ids, event_types)
+        for entity_id in entity_ids:
+            self._entity_counts[entity_id] = self._entity_counts.get(entity_id, 0) + 1
+        for event_type in event_types:
+            self._event_counts[event_type] = self._event_counts.get(event_type, 0) + 1
+
+    def remove_rule(self, rule_id: str):
+        """Removes a rule's needs. Unknown rules are ignored."""
+        entity_ids, event_types = self._rule_needs.pop(rule_id, (set(), set()))
+        for entity_id in entity_ids:
+            _decrement(self._entity_counts, entity_id)
+        for event_type in event_types:
+            _decrement(self._event_counts, event_type)
+
+    def clear(self):
+        self._rule_needs = {}
+        self._entity_counts = {}
+        self._event_counts = {}
+
+    def get_event_types(self) -> set:
+        """The event types to subscribe to with subscribe_events"""
+        event_types = set(self._event_counts)
+        if self._mode == MODE_ALL:
+            event_types.add(const.STATE_CHANGED)
+        return event_types
+
+    def get_entity_ids(self) -> set:
+        """The entities to subscribe to with a subscribe_trigger state trigger each.
+        Empty in MODE_ALL, where the state_changed subscription already covers them.
+        """
+        if self._mode == MODE_ALL:
+            return set()
+        return set(self._entity_counts)
+
+    def get_stats(self) -> dict:
+        """
+        :rtype: dict
+        """
+        return {
+            "mode": self._mode,
+            "rules": len(self._rule_needs),
+            "entities": len(self._entity_counts),
+            "event_types": len(self._event_counts)
+        }
+
+
+def _decrement(counts: dict, key):
+    count = counts.get(key, 0) - 1
+    if count > 0:
+        counts[key] = count
+    else:
+        counts.pop(key, None)
@@ -0,0 +1,63 @@
+import asyncio
+import tempfile
+
+from ottoengine import config, engine, enginelog, persistence
+from ottoengine.fibers import clock
+
+
+class RecordingWebsocket(object):
+    """Stands in for AsyncHassWebsocket, recording the service calls and subscription
+    messages the engine sends. Calls to the "fail" service fail.
+    """
+
+    def __init__(self):
+        self.connected = True
+        self.service_calls = []
+        self.sent = []          # Subscription messages, i.e. ("subscribe_trigger", entity_id, id)
+        self.rtt_stats = {"pending": 0, "requests": {}}
+        self._id = 0
+
+    async def async_call_service(self, service_call):
+        self.service_calls.append(service_call)
+        return {
+            "id": len(self.service_calls), "type": "result",
+            "success": service_call.service != "fail", "result": None
+        }
+
+    async def async_subscribe_events(self, event_type):
+        self._id += 1
+        self.sent.append(("subscribe_events", event_type, self._id))
+        return self._id
+
+    async def async_subscribe_trigger(self, trigger):
+        self._id += 1
+        self.sent.append(("subscribe_trigger", trigger["entity_id"], self._id))
+        return self._id
+
+    async def async_unsubscribe_events(self, subscription_id):
+        self.sent.append(("unsubscribe_events", subscription_id))
+
+    def get_rtt_stats(self):
+        return self.rtt_stats
+
+
+def setup_engine(testcase, websocket=None, **settings) -> engine.OttoEngine:
+    """ Builds an OttoEngine on the current event loop, with its rules in a temporary
+    directory that is removed when the test ends
+        :param TestCase testcase: TestCase object
+        :param websocket: Stands in for the AsyncHassWebsocket, i.e. a RecordingWebsocket
+        :param settings: EngineConfig attributes to set, i.e. service_batch_window_ms=5
+        :rtype: engine.OttoEngine
+    """
+    loop = asyncio.get_event_loop()
+    tmpdir = tempfile.TemporaryDirectory()
+    testcase.addCleanup(tmpdir.cleanup)
+
+    cfg = config.EngineConfig()
+    for name, value in settings.items():
+        setattr(cfg, name, value)
+    engine_obj = engine.OttoEngine(
+        cfg, loop, clock.EngineClock(cfg.tz, loop),
+        persistence.PersistenceManager(tmpdir.name), enginelog.EngineLog())
+    engine_obj._websocket = websocket
+    return engine_obj
@@ -0,0 +1,491 @@
+"""Replays a recording of Home Assistant websocket frames into the engine, with no Home
+Assistant or network, so performance can be measured the same way every time.
+
+A recording is NDJSON, one frame per line with its time in seconds from the start:
+
+    {"t": 0.0, "frame": {"type": "auth_ok", "ha_version": "0.80.0"}}
+    {"t": 0.01, "frame": {"id": 2, "type": "result", "success": true, "result": [...]}}
+    {"t": 1.5, "frame": {"id": 1, "type": "event", "event": {"event_type": "state_changed", ...}}}
+
+The frames are read by the engine's own HassWebSocketReader, from a ReplayWebsocket whose
+socket delivers them at their recorded times divided by the speed, or as fast as the
+reader takes them when the speed is None. It answers every request the engine sends with
+a successful result, and keeps the service calls made. Recorded results are delivered
+without their id, so the reader handles them by their content (a get_states list, a
+get_services dict) and they can't complete the engine's own requests.
+
+Rules are loaded as the engine loads them, but the clock isn't started, so time triggers
+don't fire during a replay.
+
+    python -m ottoengine.testing.replay generate tests/json_realworld_rules rec.ndjson
+    python -m ottoengine.testing.replay run rec.ndjson tests/json_realworld_rules --speed max
+"""
+import argparse
+import asyncio
+import collections
+import datetime
+import gc
+import json
+import logging
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+from ottoengine import config, engine, enginelog, hass_websocket_client, histogram, metrics
+from ottoengine import persistence
+from ottoengine.fibers import clock, hass_websocket_reader
+
+_LOG = logging.getLogger(__name__)
+# _LOG.setLevel(logging.DEBUG)
+
+RECORDING_START = datetime.datetime(2018, 10, 1, 12, 0, tzinfo=datetime.timezone.utc)
+SETTLE_TIMEOUT_SECS = 30.0      # Longest a replay waits for rules to finish after the last frame
+TOP_ALLOCATIONS = 10
+
+
+# ~~~~~~~~~~~~~~~~~~~~
+#   Recordings
+# ~~~~~~~~~~~~~~~~~~~~
+
+def load_recording(path: str) -> list:
+    """ Reads a recording, encoding each frame as the websocket would deliver it.
+    :rtype: list((float, str))
+    """
+    frames = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                frames.append((float(record["t"]), _encode_frame(record["frame"])))
+    return frames
+
+
+def write_recording(path: str, frames: list):
+    """ Writes (t, frame dict) pairs as a recording """
+    with open(path, "w") as f:
+        for t, frame in frames:
+            f.write(json.dumps({"t": round(t, 6), "frame": frame}) + "\n")
+
+
+def generate_recording(rules_dir: str, num_events: int, rate: float = 50.0,
+                       seed: int = 0, unrelated: float = 0.25) -> list:
+    """ Makes a recording of the frames Home Assistant would send a house run by the rules
+    in rules_dir: auth_ok, the get_states result with every entity the rules mention, then
+    num_events events at rate per second, cycling through the rules' state and event
+    triggers. The same arguments always make the same recording.
+    :param float unrelated: fraction of the events for entities no rule mentions
+    :rtype: list((float, dict))
+    """
+    rng = random.Random(seed)
+    entity_ids = set()
+    trigger_entity_ids = set()
+    event_types = set()
+    for name in sorted(os.listdir(rules_dir)):
+        if not name.endswith(".json"):
+            continue
+        with open(os.path.join(rules_dir, name)) as f:
+            rule_dict = json.load(f)
+        entity_ids.update(_entity_ids_in(rule_dict))
+        for trigger in rule_dict.get("triggers", []):
+            if trigger.get("platform") == "state" and trigger.get("entity_id"):
+                trigger_entity_ids.add(trigger["entity_id"])
+            elif trigger.get("platform") == "event" and trigger.get("event_type"):
+                event_types.add(trigger["event_type"])
+
+    states = {entity_id: _initial_value(entity_id) for entity_id in sorted(entity_ids)}
+    sources = [("state", entity_id) for entity_id in sorted(trigger_entity_ids)]
+    sources.extend(("event", event_type) for event_type in sorted(event_types))
+    num_unrelated = max(1, len(sources))
+
+    frames = [(0.0, {"type": "auth_ok", "ha_version": "0.80.0"})]
+    frames.append((0.001, {
+        "id": 1, "type": "result", "success": True,
+        "result": [_state_dict(entity_id, value, 0.0) for entity_id, value in states.items()],
+    }))
+    for i in range(num_events):
+        t = 0.01 + i / rate
+        if not sources or rng.random() < unrelated:
+            kind, name = "state", "sensor.unrelated_{}".format(rng.randrange(num_unrelated))
+        else:
+            kind, name = sources[i % len(sources)]
+        if kind == "event":
+            event = {"event_type": name, "data": {}}
+        else:
+            old_value = states.get(name, _initial_value(name))
+            states[name] = _next_value(name, old_value, rng)
+            event = {"event_type": "state_changed", "data": {
+                "entity_id": name,
+                "old_state": _state_dict(name, old_value, t),
+                "new_state": _state_dict(name, states[name], t),
+            }}
+        event["origin"] = "LOCAL"
+        event["time_fired"] = _timestamp(t)
+        frames.append((t, {"id": 2, "type": "event", "event": event}))
+    return frames
+
+
+def _encode_frame(frame: dict) -> str:
+    if frame.get("type") == "result":
+        frame = {key: value for key, value in frame.items() if key != "id"}
+    return json.dumps(frame)
+
+
+def _entity_ids_in(obj) -> set:
+    '''Every entity id in a rule dict, wherever it is'''
+    found = set()
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            if key == "entity_id" and isinstance(value, str):
+                found.update(
+                    entity_id.strip() for entity_id in value.split(",") if entity_id.strip())
+            elif key == "entity_id" and isinstance(value, list):
+                found.update(entity_id for entity_id in value if isinstance(entity_id, str))
+            else:
+                found.update(_entity_ids_in(value))
+    elif isinstance(obj, list):
+        for value in obj:
+            found.update(_entity_ids_in(value))
+    return found
+
+
+def _initial_value(entity_id: str) -> str:
+    domain = entity_id.split(".", 1)[0]
+    if domain == "sensor":
+        return "20"
+    if domain in ("device_tracker", "person"):
+        return "home"
+    return "on"
+
+
+def _next_value(entity_id: str, value: str, rng: random.Random) -> str:
+    domain = entity_id.split(".", 1)[0]
+    if domain == "sensor":
+        return str(rng.randrange(0, 40))
+    if domain in ("device_tracker", "person"):
+        return "not_home" if value == "home" else "home"
+    return "off" if value == "on" else "on"
+
+
+def _timestamp(t: float) -> str:
+    return (RECORDING_START + datetime.timedelta(seconds=t)).isoformat()
+
+
+def _state_dict(entity_id: str, value: str, t: float) -> dict:
+    return {
+        "entity_id": entity_id,
+        "state": value,
+        "attributes": {"friendly_name": entity_id.split(".", 1)[1].replace("_", " ")},
+        "last_changed": _timestamp(t),
+        "last_updated": _timestamp(t),
+    }
+
+
+# ~~~~~~~~~~~~~~~~~~~~
+#   Mock websocket
+# ~~~~~~~~~~~~~~~~~~~~
+
+class ReplaySocket(object):
+    """Stands in for the asyncws websocket: delivers the recorded frames on schedule,
+    answers the engine's requests, and keeps the service calls it sends
+    """
+
+    def __init__(self, frames: list, speed: float = None):
+        """
+            :param list frames: (t, frame str) pairs, from load_recording()
+            :param float speed: 1.0 replays at the recorded speed, 10.0 ten times faster;
+                None delivers each frame as soon as the reader asks for it
+        """
+        self._frames = frames
+        self._speed = speed
+        self._next = 0
+        self._answers = collections.deque()   # Results for requests, sent before frames
+        self._wakeup = asyncio.Event()
+        self._closed = False
+        self._start = None
+        self.writer = self                      # AsyncHassWebsocket.async_close(force=True)
+        self.finished = asyncio.Event()         # Set once every frame has been delivered
+        self.service_calls = []                 # call_service requests, in the order sent
+        self.lag = histogram.LatencyHistogram()  # How late frames were delivered
+
+    @property
+    def frames_delivered(self) -> int:
+        return self._next
+
+    async def recv(self) -> str:
+        if self._start is None:
+            self._start = time.perf_counter()
+        while True:
+            if self._answers:
+                return self._answers.popleft()
+            if self._closed:
+                return None
+            if self._next >= len(self._frames):
+                self.finished.set()
+                await self._wait(None)
+                continue
+
+            t, frame = self._frames[self._next]
+            if self._speed is None:
+                # A busy socket: let the rules that are ready run, then read on
+                await asyncio.sleep(0)
+                if self._answers:
+                    continue
+            else:
+                wait_secs = self._start + t / self._speed - time.perf_counter()
+                if wait_secs > 0:
+                    await self._wait(wait_secs)
+                    continue
+                self.lag.record(-wait_secs)
+            self._next += 1
+            return frame
+
+    async def send(self, frame: str):
+        request = json.loads(frame)
+        if request.get("type") == "call_service":
+            self.service_calls.append(request)
+        if "id" in request:
+            self._answers.append(json.dumps({
+                "id": request["id"], "type": "result", "success": True, "result": None}))
+            self._wakeup.set()
+
+    def close(self):
+        self._closed = True
+        self._wakeup.set()
+
+    async def _wait(self, timeout: float):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class ReplayWebsocket(hass_websocket_client.AsyncHassWebsocket):
+    """An AsyncHassWebsocket connected to a ReplaySocket instead of Home Assistant"""
+
+    def __init__(self, socket: ReplaySocket):
+        super().__init__("replay", 0)
+        self._replay_socket = socket
+
+    async def async_connect(self) -> bool:
+        self._socket = self._replay_socket
+        self._socket_connected = True
+        return True
+
+
+# ~~~~~~~~~~~~~~~~~~~~
+#   Harness
+# ~~~~~~~~~~~~~~~~~~~~
+
+class ReplayHarness(object):
+    """Runs recordings through a new engine with the rules in rules_dir"""
+
+    def __init__(self, rules_dir: str, loop: asyncio.AbstractEventLoop = None, **settings):
+        """
+            :param settings: EngineConfig attributes to set, i.e. service_batch_window_ms=5
+        """
+        self._rules_dir = rules_dir
+        self._loop = loop or asyncio.get_event_loop()
+        self._settings = settings
+        self.engine = None
+        self.socket = None
+
+    @property
+    def service_calls(self) -> list:
+        '''The call_service requests the last replay sent'''
+        return self.socket.service_calls if self.socket is not None else []
+
+    def run(self, frames: list, speed: float = None, trace_malloc: bool = False) -> dict:
+        """ Replays the frames and returns the report (see format_report)
+        :param list frames: (t, frame str) pairs, from load_recording()
+        :param bool trace_malloc: also report where memory was allocated, with tracemalloc,
+            which slows the replay down several times
+        :rtype: dict
+        """
+        return self._loop.run_until_complete(self.async_run(frames, speed, trace_malloc))
+
+    async def async_run(self, frames: list, speed: float = None,
+                        trace_malloc: bool = False) -> dict:
+        cfg = config.EngineConfig()
+        cfg.json_rules_dir = self._rules_dir
+        for name, value in self._settings.items():
+            setattr(cfg, name, value)
+        self.engine = engine.OttoEngine(
+            cfg, self._loop, clock.EngineClock(cfg.tz, self._loop),
+            persistence.PersistenceManager(self._rules_dir), enginelog.EngineLog())
+        self.socket = ReplaySocket(frames, speed)
+        websocket = ReplayWebsocket(self.socket)
+        await websocket.async_connect()
+        self.engine._websocket = websocket
+        # The answers to the rules' event subscriptions are read before the first frame
+        await self.engine._async_reload_rules()
+
+        reader = hass_websocket_reader.HassWebSocketReader(self.engine, websocket)
+        self.engine._fiber_websocket_reader = reader
+
+        gc.collect()
+        gc_before = [stats["collections"] for stats in gc.get_stats()]
+        blocks_before = sys.getallocatedblocks()
+        if trace_malloc:
+            tracemalloc.start()
+        start = time.perf_counter()
+
+        # The reader's read loop alone: the fiber would restart the engine's setup when the
+        # replay's socket closed
+        reader_task = self._loop.create_task(reader._read())
+        await self.socket.finished.wait()
+        delivered_secs = time.perf_counter() - start
+        settled = await _async_settle(
+            set([asyncio.current_task(), reader_task]), SETTLE_TIMEOUT_SECS)
+        wall_secs = time.perf_counter() - start
+
+        allocations = {
+            "gc_collections": [
+                stats["collections"] - before
+                for stats, before in zip(gc.get_stats(), gc_before)],
+            "blocks_retained": sys.getallocatedblocks() - blocks_before,
+        }
+        if trace_malloc:
+            snapshot = tracemalloc.take_snapshot()
+            allocations["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            allocations["top"] = [
+                {"line": "{}:{}".format(stat.traceback[0].filename, stat.traceback[0].lineno),
+                 "bytes": stat.size, "blocks": stat.count}
+                for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]
+            ]
+
+        reader_task.cancel()
+        try:
+            await reader_task
+        except asyncio.CancelledError:
+            pass
+        self.socket.close()
+        return self._report(frames, speed, delivered_secs, wall_secs, settled, allocations)
+
+    def _report(self, frames, speed, delivered_secs, wall_secs, settled, allocations) -> dict:
+        rule_counts = self.engine.metrics.get_rule_counts()
+        outcomes = {
+            name: sum(counts[name] for counts in rule_counts.values())
+            for name in metrics.COUNTER_NAMES
+        }
+        decoder = self.engine.get_stats()["message_decoder"]
+        events = sum(1 for t, frame in frames if '"type": "event"' in frame[:40])
+        report = {
+            "speed": speed,
+            "frames": self.socket.frames_delivered,
+            "events": events,
+            "events_dropped": decoder["dropped"],
+            "delivered_secs": delivered_secs,
+            "wall_secs": wall_secs,
+            "settled": settled,
+            "events_per_sec": events / delivered_secs if delivered_secs else None,
+            "service_calls": len(self.socket.service_calls),
+            "rule_outcomes": outcomes,
+            "stages": self.engine.metrics.get_stats()["stages"],
+            "allocations": allocations,
+        }
+        if speed is not None:
+            report["delivery_lag"] = self.socket.lag.get_stats()
+        return report
+
+
+async def _async_settle(own_tasks: set, timeout: float) -> bool:
+    '''Waits until the only tasks left are own_tasks. False if they didn't within timeout.'''
+    deadline = time.perf_counter() + timeout
+    while True:
+        # Collected again each time, since the tasks waited on can start others
+        pending = asyncio.all_tasks() - own_tasks
+        if not pending:
+            return True
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return False
+        await asyncio.wait(pending, timeout=remaining)
+
+
+def format_report(report: dict) -> str:
+    lines = []
+    speed = "max" if report["speed"] is None else "x{:g}".format(report["speed"])
+    lines.append("{} frames ({} events, {} dropped unread) at {} speed in {:.3f}s".format(
+        report["frames"], report["events"], report["events_dropped"], speed,
+        report["delivered_secs"]))
+    lines.append("Rules {} {:.3f}s after the first frame".format(
+        "finished" if report["settled"] else "were still running", report["wall_secs"]))
+    lines.append("{:.0f} events/s, {} service calls".format(
+        report["events_per_sec"] or 0, report["service_calls"]))
+    lines.append("Rule outcomes: " + ", ".join(
+        "{} {}".format(name, count) for name, count in report["rule_outcomes"].items()))
+
+    lines.append("{:>22} {:>8} {:>10} {:>10} {:>10}".format(
+        "stage", "count", "p50 ms", "p99 ms", "max ms"))
+    stages = list(report["stages"].items())
+    if "delivery_lag" in report:
+        stages.insert(0, ("delivery_lag", report["delivery_lag"]))
+    for stage, stats in stages:
+        lines.append("{:>22} {:>8} {:>10} {:>10} {:>10}".format(
+            stage, stats["count"], _ms(stats["p50_secs"]), _ms(stats["p99_secs"]),
+            _ms(stats["max_secs"])))
+
+    allocations = report["allocations"]
+    lines.append("Allocations: {} blocks retained, gc collections by generation {}".format(
+        allocations["blocks_retained"], allocations["gc_collections"]))
+    if "peak_bytes" in allocations:
+        lines.append("Peak traced memory {} KB; most allocated:".format(
+            allocations["peak_bytes"] // 1024))
+        for top in allocations["top"]:
+            lines.append("  {:>8} KB {:>8} blocks  {}".format(
+                top["bytes"] // 1024, top["blocks"], top["line"]))
+    return "\n".join(lines)
+
+
+def _ms(secs) -> str:
+    return "-" if secs is None else "{:.3f}".format(secs * 1000)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(
+        description="Replay recorded Home Assistant websocket frames into the engine")
+    subparsers = arg_parser.add_subparsers(dest="command")
+    generate_parser = subparsers.add_parser(
+        "generate", help="Make a recording of events for the rules in a directory")
+    generate_parser.add_argument("rules_dir")
+    generate_parser.add_argument("recording")
+    generate_parser.add_argument("--events", type=int, default=10000)
+    generate_parser.add_argument("--rate", type=float, default=50.0, help="Events per second")
+    generate_parser.add_argument("--seed", type=int, default=0)
+    run_parser = subparsers.add_parser("run", help="Replay a recording and report")
+    run_parser.add_argument("recording")
+    run_parser.add_argument("rules_dir")
+    run_parser.add_argument(
+        "--speed", default="max", help="max, or a multiple of the recorded speed")
+    run_parser.add_argument("--tracemalloc", action="store_true")
+    run_parser.add_argument("--batch-window-ms", type=int, default=0)
+    run_parser.add_argument("--trace-spans", type=int, default=0)
+    args = arg_parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    # The rule runner and service calls log at DEBUG whatever their loggers' levels are set to
+    logging.disable(logging.INFO)
+    if args.command == "generate":
+        frames = generate_recording(args.rules_dir, args.events, args.rate, args.seed)
+        write_recording(args.recording, frames)
+        print("Wrote {} frames to {}".format(len(frames), args.recording))
+        return 0
+    if args.command != "run":
+        arg_parser.print_help()
+        return 1
+
+    harness = ReplayHarness(
+        args.rules_dir, service_batch_window_ms=args.batch_window_ms,
+        trace_spans=args.trace_spans)
+    speed = None if args.speed == "max" else float(args.speed)
+    report = harness.run(load_recording(args.recording), speed, args.tracemalloc)
+    print(format_report(report))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
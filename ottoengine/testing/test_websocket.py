@@ -1,5 +1,6 @@
 import asyncio
 import asyncws
+import json
 import logging
 
 from ottoengine.fibers import Fiber
@@ -9,6 +10,11 @@ _LOG = logging.getLogger(__name__)
 
 HOST = "127.0.0.1"
 
+# Requests the server answers with a successful result, so callers waiting on them finish
+REQUEST_TYPES = [
+    "call_service", "subscribe_events", "subscribe_trigger", "unsubscribe_events"
+]
+
 
 class TestWebSocketServer(Fiber):
     def __init__(self, port):
@@ -48,6 +54,10 @@ class TestWebSocketServer(Fiber):
                             continue
                         await client.send(frame)
 
+                result = _result_for(frame)
+                if result is not None:
+                    await websocket.send(result)
+
         except RuntimeError as e:
             _LOG.warn(str(e))
 
@@ -55,3 +65,14 @@ class TestWebSocketServer(Fiber):
             with (await self._clients_lock):
                 self._clients.remove(websocket)
             _LOG.info("Test websocket closed")
+
+
+def _result_for(frame: str) -> str:
+    """Returns a successful result message for a request frame, or None for other frames"""
+    try:
+        msg = json.loads(frame)
+    except ValueError:
+        return None
+    if not isinstance(msg, dict) or msg.get("type") not in REQUEST_TYPES:
+        return None
+    return json.dumps({"id": msg.get("id"), "type": "result", "success": True, "result": None})
@@ -0,0 +1,243 @@
+"""Traces of how an event from Home Assistant makes its way through the engine to the
+service calls its rules make, for finding where the time goes between HA firing an event
+and Otto Engine writing the resulting call to the websocket.
+
+A trace starts when the websocket reader receives an event. It is carried on the event
+(HassEvent.trace) to the rules the event invokes, from each rule to its actions, and from
+a ServiceAction to its ServiceCall (ServiceCall.traces), each of which opens a span:
+
+    event               received -> rules' listeners matched (process_event)
+      rule              async_invoke_rule, for a rule whose trigger passed
+        action          RuleActionItem.async_execute
+          service_call  ServiceCall made -> its frame written by AsyncHassWebsocket
+
+The spans of a trace are only kept once a rule's trigger passes, so an event no rule acts
+on costs a Span and nothing more. Kept spans go into a ring buffer, which /rest/traces
+reads and which can be exported as Chrome trace events (chrome://tracing, Perfetto).
+
+Spans are timed with time.perf_counter() and reported as seconds since the epoch. HA's
+time_fired comes from HA's clock, so the time before an event was received includes any
+difference between the two hosts' clocks.
+
+Tracing is off by default. TRACE_SPANS in config.ini turns it on, e.g. TRACE_SPANS = 10000
+(DEFAULT_MAX_SPANS) keeps the newest 10000 spans.
+"""
+import collections
+import itertools
+import logging
+import time
+
+from ottoengine import helpers
+
+_LOG = logging.getLogger(__name__)
+# _LOG.setLevel(logging.DEBUG)
+
+DEFAULT_MAX_SPANS = 10000
+
+EVENT = "event"
+RULE = "rule"
+ACTION = "action"
+SERVICE_CALL = "service_call"
+TRANSIT = "hass_to_otto"    # From HA's time_fired to received, added when traces are read
+
+
+class Span(object):
+    """One timed step of a trace. Finishing it the first time records it."""
+
+    __slots__ = (
+        "_tracer", "trace_id", "span_id", "parent", "name", "start", "end", "attrs", "kept")
+
+    def __init__(self, tracer, trace_id: int, parent, name: str, start: float, attrs: dict):
+        self._tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = next(tracer.span_ids)
+        self.parent = parent
+        self.name = name
+        self.start = start      # time.perf_counter()
+        self.end = None
+        self.attrs = attrs
+        self.kept = False       # Set once the span is in the tracer's buffer
+
+    def child(self, name: str, **attrs):
+        '''Starts a span under this one'''
+        return Span(self._tracer, self.trace_id, self, name, time.perf_counter(), attrs)
+
+    def finish(self, keep: bool = True, **attrs):
+        """ Ends the span, if it hasn't ended already.
+        :param bool keep: False leaves the span out of the buffer unless a span under it
+            is kept later
+        """
+        if self.end is not None:
+            return
+        self.end = time.perf_counter()
+        if attrs:
+            self.attrs.update(attrs)
+        if keep:
+            self._tracer.keep(self)
+
+
+class Tracer(object):
+    """Starts traces, and keeps the newest max_spans of their spans"""
+
+    def __init__(self, max_spans: int = DEFAULT_MAX_SPANS):
+        self._spans = collections.deque(maxlen=max_spans)
+        self._trace_ids = itertools.count(1)
+        self._traces_started = 0
+        self._traces = 0    # Traces with a kept span
+        self.span_ids = itertools.count(1)
+        # Converts perf_counter() times to seconds since the epoch
+        self._epoch_offset = time.time() - time.perf_counter()
+
+    @property
+    def max_spans(self) -> int:
+        return self._spans.maxlen
+
+    def start_trace(self, received: float = None, time_fired=None, **attrs) -> Span:
+        """ Starts the trace of an event, returning its root span.
+        :param float received: time.perf_counter() when the event was received
+        :param time_fired: HA's time_fired of the event, a datetime or ISO-8601 string
+        """
+        self._traces_started += 1
+        if time_fired is not None:
+            attrs["time_fired"] = time_fired
+        return Span(
+            self, next(self._trace_ids), None, EVENT,
+            received if received is not None else time.perf_counter(), attrs)
+
+    def keep(self, span: Span):
+        '''Adds a finished span, and the finished spans above it not kept yet, to the buffer'''
+        parent = span.parent
+        if parent is not None and not parent.kept and parent.end is not None:
+            self.keep(parent)
+        elif parent is None:
+            self._traces += 1
+        span.kept = True
+        self._spans.append(span)
+
+    def get_traces(self, since: int = None, rule_id: str = None, trace_id: int = None) -> list:
+        """ The traces with spans in the buffer, oldest first.
+        :param int since: only traces after this trace id
+        :param str rule_id: only traces that ran this rule
+        :param int trace_id: only this trace
+        :rtype: list(dict)
+        """
+        by_trace = collections.OrderedDict()
+        for span in self._spans:
+            if since is not None and span.trace_id <= since:
+                continue
+            if trace_id is not None and span.trace_id != trace_id:
+                continue
+            by_trace.setdefault(span.trace_id, []).append(span)
+
+        traces = []
+        for spans in by_trace.values():
+            if rule_id is not None and not any(
+                    span.name == RULE and span.attrs.get("rule") == rule_id for span in spans):
+                continue
+            traces.append(self._trace_dict(spans))
+        return traces
+
+    def get_stats(self) -> dict:
+        """
+        :rtype: dict
+        """
+        return {
+            "max_spans": self._spans.maxlen,
+            "spans": len(self._spans),
+            "traces_started": self._traces_started,
+            "traces_kept": self._traces,
+        }
+
+    def _trace_dict(self, spans: list) -> dict:
+        spans = sorted(spans, key=lambda span: span.start)
+        span_dicts = [self._span_dict(span) for span in spans]
+        trace = {"trace_id": spans[0].trace_id, "spans": span_dicts}
+
+        root = spans[0] if spans[0].parent is None else None
+        fired_ts = None
+        if root is not None:
+            fired_ts = _epoch(root.attrs.get("time_fired"))
+        if fired_ts is not None:
+            received_ts = span_dicts[0]["start_ts"]
+            span_dicts.insert(0, {
+                "span_id": 0,
+                "parent_id": None,
+                "name": TRANSIT,
+                "start_ts": fired_ts,
+                "duration_secs": received_ts - fired_ts,
+                "attrs": {},
+            })
+            trace["fired_to_received_secs"] = received_ts - fired_ts
+
+        # What the trace is for: the time from the event to the first call written
+        written = [
+            span_dict["start_ts"] + span_dict["duration_secs"] for span_dict in span_dicts
+            if span_dict["name"] == SERVICE_CALL and span_dict["attrs"].get("written")]
+        if written and fired_ts is not None:
+            trace["fired_to_first_call_secs"] = min(written) - fired_ts
+        return trace
+
+    def _span_dict(self, span: Span) -> dict:
+        end = span.end if span.end is not None else time.perf_counter()
+        attrs = span.attrs
+        if "time_fired" in attrs:
+            attrs = dict(attrs)
+            attrs["time_fired"] = str(attrs["time_fired"])
+        return {
+            "span_id": span.span_id,
+            "parent_id": span.parent.span_id if span.parent is not None else None,
+            "name": span.name,
+            "start_ts": span.start + self._epoch_offset,
+            "duration_secs": end - span.start,
+            "attrs": attrs,
+        }
+
+
+def finish_written(spans: list):
+    '''Ends the service_call spans of a ServiceCall once its frame is written'''
+    for span in spans:
+        span.finish(written=True)
+
+
+def to_chrome_trace(traces: list) -> dict:
+    """ Converts traces from Tracer.get_traces() to the Chrome trace event format, with each
+    trace on its own row.
+    :rtype: dict
+    """
+    events = []
+    for trace in traces:
+        for span_dict in trace["spans"]:
+            args = dict(span_dict["attrs"])
+            args["span_id"] = span_dict["span_id"]
+            events.append({
+                "name": _chrome_name(span_dict),
+                "cat": span_dict["name"],
+                "ph": "X",
+                "ts": int(span_dict["start_ts"] * 1e6),
+                "dur": max(int(span_dict["duration_secs"] * 1e6), 0),
+                "pid": 1,
+                "tid": trace["trace_id"],
+                "args": args,
+            })
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def _chrome_name(span_dict: dict) -> str:
+    attrs = span_dict["attrs"]
+    detail = attrs.get("rule") or attrs.get("action") or attrs.get("service") or attrs.get(
+        "entity_id") or attrs.get("event_type")
+    if detail is None:
+        return span_dict["name"]
+    return "{} {}".format(span_dict["name"], detail)
+
+
+def _epoch(time_fired) -> float:
+    '''Seconds since the epoch of a time_fired datetime or ISO-8601 string, None if unknown'''
+    if time_fired is None:
+        return None
+    if isinstance(time_fired, str):
+        try:
+            time_fired = helpers.parse_iso8601(time_fired)
+        except Exception:
+            return None
+    return time_fired.timestamp()
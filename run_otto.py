@@ -6,7 +6,8 @@ import urllib.request
 import sys
 import os
 
-from ottoengine import engine, restapi, config, persistence, utils, enginelog
+from ottoengine import (
+    engine, restapi, async_restapi, config, persistence, utils, enginelog, log_sink)
 from ottoengine.fibers import clock
 
 CONFIG_DIR = "/config"
@@ -31,20 +32,39 @@ if len(sys.argv) > 1:
 
 # Initialize the engine
 loop = asyncio.get_event_loop()
-clock = clock.EngineClock(config.tz, loop=loop)
-persistence_mgr = persistence.PersistenceManager(config.json_rules_dir)
-engine_log = enginelog.EngineLog()
+clock = clock.EngineClock(config.tz, loop=loop, precise=config.clock_precise)
+persistence_mgr = persistence.PersistenceManager(
+    config.json_rules_dir, backend=config.persistence_backend, sqlite_path=config.sqlite_path,
+    packed_path=config.packed_path)
+engine_log_sink = None
+if config.engine_log_dir:
+    _LOG.info("Writing the engine log to {}".format(config.engine_log_dir))
+    engine_log_sink = log_sink.LogSink(
+        config.engine_log_dir, segment_bytes=config.engine_log_segment_kb * 1024,
+        max_segments=config.engine_log_segments)
+    engine_log_sink.start()
+engine_log = enginelog.EngineLog(sink=engine_log_sink)
 
 engine_obj = engine.OttoEngine(config, loop, clock, persistence_mgr, engine_log)
 
-# Start the Flask web server
-_LOG.info("Starting web thread")
-restapi.engine_obj = engine_obj
-web_thread = threading.Thread(target=restapi.run_server)
-web_thread.start()
+if config.rest_server == "async":
+    # Serve the REST API from the engine's event loop
+    _LOG.info("Starting async REST server")
+    rest_server = async_restapi.AsyncRestServer(engine_obj, port=config.rest_port)
+    loop.run_until_complete(rest_server.async_start())
+else:
+    # Start the Flask web server
+    _LOG.info("Starting web thread")
+    restapi.engine_obj = engine_obj
+    web_thread = threading.Thread(target=restapi.run_server)
+    web_thread.start()
 
 # Start the engine's BaseLoop
 engine_obj.start_engine()
 
+if engine_log_sink is not None:
+    engine_log_sink.close()
+
 # Shutdown the webui
-urllib.request.urlopen("http://localhost:{}/shutdown".format(config.rest_port))
+if config.rest_server != "async":
+    urllib.request.urlopen("http://localhost:{}/shutdown".format(config.rest_port))
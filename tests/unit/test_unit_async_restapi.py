@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+import asyncio
+import json
+import unittest
+
+from ottoengine import async_restapi
+from ottoengine.model import dataobjects
+from ottoengine.testing import engine_helpers
+
+
+async def _async_request(reader, writer, method, path, body=None):
+    """Sends one request on a keep-alive connection and returns (status, json body), or
+    (status, text) for a body that isn't JSON
+    """
+    payload = json.dumps(body).encode() if body is not None else b""
+    writer.write("{} {} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {}\r\n\r\n".format(
+        method, path, len(payload)).encode() + payload)
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line == b"\r\n":
+            break
+        name, _, value = line.decode().partition(":")
+        headers[name.lower()] = value.strip()
+    if headers.get("transfer-encoding") == "chunked":
+        data = b""
+        while True:
+            size = int(await reader.readline(), 16)
+            data += await reader.readexactly(size + 2)
+            if size == 0:
+                break
+        return (status, [json.loads(line) for line in data.splitlines() if line])
+    data = await reader.readexactly(int(headers["content-length"]))
+    if not headers.get("content-type", "").startswith("application/json"):
+        return (status, data.decode())
+    return (status, json.loads(data) if data else None)
+
+
+class TestAsyncRestServer(unittest.TestCase):
+
+    def setUp(self):
+        print()
+        self.loop = asyncio.get_event_loop()
+        self.engine_obj = engine_helpers.setup_engine(self)
+        self.engine_obj.states.set_entity_state(
+            "light.hall", dataobjects.EntityState(
+                "light.hall", "on", {}, "2018-10-01T12:00:00+00:00", "Hall light"))
+
+        self.server = async_restapi.AsyncRestServer(self.engine_obj, host="127.0.0.1", port=0)
+        self.loop.run_until_complete(self.server.async_start())
+        self.addCleanup(lambda: self.loop.run_until_complete(self.server.async_stop()))
+
+    def _requests(self, requests):
+        """Sends the (method, path, body) requests on one connection"""
+        async def _run():
+            reader, writer = await asyncio.open_connection("127.0.0.1", self.server.port)
+            responses = []
+            for method, path, body in requests:
+                responses.append(await _async_request(reader, writer, method, path, body))
+            writer.close()
+            return responses
+        responses = self.loop.run_until_complete(_run())
+        for request, response in zip(requests, responses):
+            print(request[:2], response)
+        return responses
+
+    def test_routes(self):
+        rule_dict = {
+            "id": "r1",
+            "triggers": [{"platform": "state", "entity_id": "light.hall", "to": "on"}],
+            "actions": [{"action_sequence": [{"log_message": "on"}]}]
+        }
+        responses = self._requests([
+            ("GET", "/rest/ping", None),
+            ("GET", "/rest/entities", None),
+            ("PUT", "/rest/rule/r1", {"data": rule_dict}),
+            ("GET", "/rest/rules", None),
+            ("GET", "/rest/rule/r1", None),
+            ("PUT", "/rest/clock/check", {"data": {"tz": "UTC", "minute": 5}}),
+            ("DELETE", "/rest/rule/r1", None),
+            ("GET", "/rest/rule/r1", None),
+            ("GET", "/rest/metrics", None),
+            ("GET", "/rest/traces?limit=10", None),
+            ("GET", "/rest/traces/chrome", None),
+        ])
+        self.assertEqual(responses[0], (200, {"success": True}))
+        self.assertEqual(responses[1][1]["data"], [
+            {"entity_id": "light.hall", "friendly_name": "Hall light", "hidden": False}])
+        self.assertEqual(responses[2][1]["success"], True)
+        self.assertEqual([rule["id"] for rule in responses[3][1]["data"]], ["r1"])
+        self.assertEqual(responses[4][1]["data"]["id"], "r1")
+        self.assertTrue(responses[5][1]["success"])
+        self.assertEqual(responses[6][1], {"success": True, "id": "r1"})
+        self.assertEqual(responses[7][1]["success"], False)
+        self.assertEqual(responses[8][0], 200)
+        self.assertIn("otto_entity_snapshot_entities 1\n", responses[8][1])
+        self.assertEqual(responses[9][1], {"data": [], "next_cursor": None})
+        self.assertEqual(responses[10][1]["traceEvents"], [])
+
+    def test_streamed_entities(self):
+        for i in range(2000):
+            entity_id = "sensor.s{:04d}".format(i)
+            self.engine_obj.states.set_entity_state(entity_id, dataobjects.EntityState(
+                entity_id, "on", {}, "2018-10-01T12:00:00+00:00", "Sensor {}".format(i)))
+        responses = self._requests([
+            ("GET", "/rest/entities?format=ndjson&domain=sensor&fields=entity_id", None),
+            ("GET", "/rest/entities?domain=light&limit=1", None),
+        ])
+        status, lines = responses[0]
+        print("Streamed {} lines in chunks, then the connection is reused".format(len(lines)))
+        self.assertEqual(
+            sorted(line["entity_id"] for line in lines),
+            ["sensor.s{:04d}".format(i) for i in range(2000)])
+        self.assertEqual(responses[1][1]["data"][0]["entity_id"], "light.hall")
+        self.assertIsNone(responses[1][1]["next_cursor"])
+
+    def test_errors(self):
+        statuses = [status for status, body in self._requests([
+            ("GET", "/rest/nothing", None),
+            ("POST", "/rest/rules", None),
+            ("PUT", "/rest/rule/r1", {"no_data": True}),
+            ("GET", "/rest/logs?group=x", None),
+            ("OPTIONS", "/rest/rules", None),
+            ("GET", "/rest/ping", None),
+        ])]
+        self.assertEqual(statuses, [404, 405, 400, 400, 204, 200])
+
+    def test_bad_content_length(self):
+        async def _send(head):
+            reader, writer = await asyncio.open_connection("127.0.0.1", self.server.port)
+            writer.write(head.encode() + b"\r\n")
+            status = int((await reader.readline()).split()[1])
+            await reader.read()     # The server closes the connection after an error
+            writer.close()
+            return status
+
+        # (request head, expected status)
+        tests = [
+            ("PUT /rest/rule HTTP/1.1\r\nContent-Length: abc\r\n", 400),
+            ("PUT /rest/rule HTTP/1.1\r\nContent-Length: -5\r\n", 400),
+            ("PUT /rest/rule HTTP/1.1\r\n", 400),
+            ("PUT /rest/rule HTTP/1.1\r\nContent-Length: {}\r\n".format(
+                async_restapi.MAX_BODY_BYTES + 1), 413),
+            ("GET /rest/ping?{} HTTP/1.1\r\n".format("a" * 70000), 414),
+            ("GET /rest/ping HTTP/1.1\r\nCookie: {}\r\n".format("a" * 70000), 431),
+            ("GET /rest/ping HTTP/1.1\r\n" + "X-Header: a\r\n" * (
+                async_restapi.MAX_HEADER_LINES + 1), 431),
+            ("GET /rest/ping HTTP/1.1\r\n" + "X-Header: a\r\n" * (
+                async_restapi.MAX_HEADER_LINES - 1) + "Connection: close\r\n", 200),
+            ("GET /rest/ping HTTP/1.1\r\nConnection: close\r\n", 200),
+        ]
+        for head, expected in tests:
+            status = self.loop.run_until_complete(_send(head))
+            print([line[:40] for line in head.splitlines()[:2]], status)
+            self.assertEqual(status, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -85,6 +85,92 @@ class TestClock(unittest.TestCase):
             len(self.clock.timeline), 0,
             msg="Expecing an empty timeline, but it found non-empty")
 
+    def test_shared_alarm_time(self):
+        """Actions due at the same time share one ClockAlarm, and are removed independently
+        """
+        async def _noop():
+            pass
+
+        nowtime = parser.parse("2018-05-08 21:38:00-00:00")
+        spec_ids = [uuid.uuid4() for i in range(3)]
+        for spec_id in spec_ids:
+            self.clock.add_timespec_action(
+                spec_id, _noop, clock.TimeSpec.from_dict({"tz": "UTC"}), nowtime)
+
+        self.assertEqual(len(self.clock.timeline), 1)
+        self.assertEqual(len(self.clock.timeline[0].actions), 3)
+
+        self.clock.remove_timespec_action(spec_ids[1])
+        self.assertEqual(len(self.clock.timeline), 1)
+        self.assertEqual(
+            [action.id for action in self.clock.timeline[0].actions],
+            [spec_ids[0], spec_ids[2]])
+
+        # Removing an unknown ID is a no-op
+        self.clock.remove_timespec_action(uuid.uuid4())
+        self.assertEqual(len(self.clock.timeline[0].actions), 2)
+
+    def test_timeline_order(self):
+        """Alarms pop in time order regardless of insertion order, and removed alarms never fire
+        """
+        nowtime = parser.parse("2018-05-08 21:38:30-00:00")
+        self.fired = []
+
+        def _make_action(minute):
+            async def _action():
+                self.fired.append(minute)
+            return _action
+
+        minutes = [45, 40, 59, 41, 50, 39]
+        ids = {}
+        for minute in minutes:
+            ids[minute] = uuid.uuid4()
+            self.clock.add_timespec_action(
+                ids[minute], _make_action(minute),
+                clock.TimeSpec.from_dict({"tz": "UTC", "minute": minute}), nowtime)
+        self.clock.remove_timespec_action(ids[50])
+
+        self.assertEqual(
+            [alarm.alarm_time.minute for alarm in self.clock.timeline], [39, 40, 41, 45, 59])
+
+        self.loop.run_until_complete(
+            self.clock._async_tick(parser.parse("2018-05-08 21:59:00-00:00")))
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.assertEqual(self.fired, [39, 40, 41, 45, 59])
+
+        # Each action is rescheduled for the next hour
+        self.assertEqual(
+            [alarm.alarm_time.hour for alarm in self.clock.timeline], [22, 22, 22, 22, 22])
+
+    def test_precise_wakeup(self):
+        """A precise clock sleeping on an empty timeline is woken by a newly added alarm
+        """
+        class _SoonSpec:
+            def next_time_from(self, dt):
+                return dt + datetime.timedelta(seconds=0.2)
+
+        self.action_count = 0
+
+        async def myfunc():
+            self.action_count += 1
+
+        precise_clock = clock.EngineClock(TZ, loop=self.loop, precise=True)
+
+        async def _run_test():
+            task = self.loop.create_task(precise_clock.async_run())
+            await asyncio.sleep(0.05)
+            precise_clock.add_timespec_action(uuid.uuid4(), myfunc, _SoonSpec(), nowutc())
+            await asyncio.sleep(0.5)
+            precise_clock.stop()
+            task.cancel()
+
+        self.loop.run_until_complete(_run_test())
+        lag = precise_clock.get_lag_stats()
+        print("Lag stats: {}".format(lag))
+        self.assertGreaterEqual(self.action_count, 1)
+        self.assertEqual(lag["count"], self.action_count)
+        self.assertLess(lag["max_secs"], 0.1)
+
     def test_except_invalid_action_function(self):
         spec = clock.TimeSpec.from_dict({"tz": "UTC"})
         spec_id = uuid.uuid4()
@@ -19,6 +19,17 @@ class TestConfig(unittest.TestCase):
             ("TZ", "America/Los_Angeles", "tz", "America/Los_Angeles"),
             ("JSON_RULES_DIR", "json_rules", "json_rules_dir", "json_rules"),
             ("LOG_LEVEL", "INFO", "log_level", "INFO"),
+            ("CLOCK_PRECISE", "yes", "clock_precise", True),
+            ("PERSISTENCE_BACKEND", "SQLite", "persistence_backend", "sqlite"),
+            ("SQLITE_PATH", "/json_rules/rules.sqlite", "sqlite_path", "/json_rules/rules.sqlite"),
+            ("PACKED_PATH", "/json_rules/rules.pack", "packed_path", "/json_rules/rules.pack"),
+            ("SUBSCRIPTION_MODE", "Filtered", "subscription_mode", "filtered"),
+            ("SERVICE_BATCH_WINDOW_MS", "5", "service_batch_window_ms", 5),
+            ("REST_SERVER", "Async", "rest_server", "async"),
+            ("ENGINE_LOG_DIR", "/config/engine_log", "engine_log_dir", "/config/engine_log"),
+            ("ENGINE_LOG_SEGMENT_KB", "1024", "engine_log_segment_kb", 1024),
+            ("ENGINE_LOG_SEGMENTS", "3", "engine_log_segments", 3),
+            ("TRACE_SPANS", "10000", "trace_spans", 10000),
         ]
         section = "ENGINE"
         cfg = config.EngineConfig()
@@ -32,6 +43,22 @@ class TestConfig(unittest.TestCase):
             print("Expecting {} to be {}".format(obj_name, obj_val))
             self.assertEqual(getattr(cfg, obj_name), obj_val)
 
+    def test_log_segments_at_least_one(self):
+        required = [
+            ("OTTO_REST_PORT", "5000"), ("HASS_HOST", "localhost"), ("HASS_PORT", "8123"),
+            ("HASS_TOKEN", "a_token"), ("HASS_SSL", "no"), ("TZ", "America/Los_Angeles"),
+            ("JSON_RULES_DIR", "json_rules"),
+        ]
+        for param in ("ENGINE_LOG_SEGMENT_KB", "ENGINE_LOG_SEGMENTS"):
+            for ini_val in ("0", "-1"):
+                print("Setting {} to {}".format(param, ini_val))
+                cfg = config.EngineConfig()
+                cfg._config.add_section("ENGINE")
+                for name, value in required + [(param, ini_val)]:
+                    cfg._config.set("ENGINE", name, value)
+                with self.assertRaises(ValueError):
+                    cfg._read_parameters()
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+import datetime
+from dateutil import parser
+import unittest
+
+from ottoengine import cronschedule, helpers
+from ottoengine.fibers import clock
+
+PT_TZ = "America/Los_Angeles"
+
+
+class TestCronSchedule(unittest.TestCase):
+
+    def setUp(self):
+        print()
+
+    def test_parse_field(self):
+        # (value, range, names, expected values)
+        tests = [
+            (None, cronschedule.MINUTE_RANGE, None, set(range(0, 60))),
+            ("*", cronschedule.HOUR_RANGE, None, set(range(0, 24))),
+            (30, cronschedule.MINUTE_RANGE, None, {30}),
+            ("*/15", cronschedule.MINUTE_RANGE, None, {0, 15, 30, 45}),
+            ("10-20/5", cronschedule.MINUTE_RANGE, None, {10, 15, 20}),
+            ("50/5", cronschedule.MINUTE_RANGE, None, {50, 55}),
+            ("1,5,9", cronschedule.HOUR_RANGE, None, {1, 5, 9}),
+            ("jan,Jul", cronschedule.MONTH_RANGE, cronschedule.MONTH_NAMES, {1, 7}),
+            ("mon-fri", cronschedule.WEEKDAY_RANGE, cronschedule.WEEKDAY_NAMES, {1, 2, 3, 4, 5}),
+        ]
+        for value, value_range, names, expected in tests:
+            mask = cronschedule.parse_field(value, value_range, names)
+            actual = {v for v in range(0, 64) if (mask >> v) & 1}
+            print("Field: {} --> {}".format(value, sorted(actual)))
+            self.assertEqual(actual, expected)
+
+    def test_parse_field_invalid(self):
+        tests = [
+            ("one", cronschedule.HOUR_RANGE),
+            ("60", cronschedule.MINUTE_RANGE),
+            ("0", cronschedule.DAY_OF_MONTH_RANGE),
+            ("10-5", cronschedule.MINUTE_RANGE),
+            ("*/0", cronschedule.MINUTE_RANGE),
+        ]
+        for value, value_range in tests:
+            self.assertRaises(
+                helpers.ValidationError, cronschedule.parse_field, value, value_range)
+
+    def test_matches_croniter(self):
+        """The compiled schedule should produce the same times as the croniter path
+        """
+        specs = [
+            {"tz": "UTC"},
+            {"tz": "UTC", "minute": "*/7"},
+            {"tz": PT_TZ, "minute": 30, "hour": 18},
+            {"tz": PT_TZ, "minute": "0,30", "hour": "8-17", "weekdays": "1-5"},
+            {"tz": PT_TZ, "minute": 0, "hour": 12, "day_of_month": 15, "weekdays": "0"},
+            {"tz": "UTC", "minute": 30, "hour": 9, "day_of_month": 4, "month": 7},
+            {"tz": "UTC", "minute": 0, "hour": 0, "day_of_month": 29, "month": 2},
+            {"tz": "UTC", "minute": 30, "hour": 8, "weekdays": "5,6,7"},
+            {"tz": "Europe/London", "minute": 15, "hour": "*/3", "month": "jun-aug"},
+        ]
+        starts = [
+            parser.parse("2018-01-01 00:00:00-00:00"),
+            parser.parse("2018-06-15 13:29:59-00:00"),
+            parser.parse("2019-12-31 23:59:01-00:00"),
+        ]
+        # croniter is only right on the days the clocks change when the hour isn't fixed
+        dst_specs = [
+            {"tz": "UTC", "minute": "*/7"},
+            {"tz": PT_TZ, "minute": "*/20"},
+            {"tz": PT_TZ, "minute": 0},
+            {"tz": PT_TZ, "minute": 45, "hour": "0-3"},
+            {"tz": "Europe/London", "minute": "*/30", "hour": "0-2"},
+        ]
+        dst_starts = [
+            parser.parse("2018-11-04 00:00:00-07:00"),      # Before the clocks go back
+            parser.parse("2018-11-04 01:10:00-07:00"),      # In the first 1 AM
+            parser.parse("2018-11-04 01:10:00-08:00"),      # In the second 1 AM
+            parser.parse("2018-03-11 00:00:00-08:00"),      # Before the clocks go forward
+            parser.parse("2018-10-28 00:00:00+01:00"),
+            parser.parse("2018-03-25 00:00:00+00:00"),
+        ]
+        cases = [(specdict, start) for specdict in specs for start in starts]
+        cases.extend((specdict, start) for specdict in dst_specs for start in dst_starts)
+        for specdict, start in cases:
+            spec = clock.TimeSpec.from_dict(specdict)
+            compiled = spec.next_times_from(start, 20)
+
+            expected = []
+            dt = start
+            for i in range(20):
+                dt = spec._next_time_from_croniter(dt)
+                expected.append(dt)
+
+            self.assertEqual(
+                compiled, expected,
+                msg="Spec: {}, Start: {}".format(specdict, start))
+
+    def test_dst_changes(self):
+        """Times the clocks go back over fire twice; times they skip fire an hour later.
+        croniter is an hour off for these on the days the clocks change.
+        """
+        # (spec, start, expected times)
+        tests = [
+            ({"tz": PT_TZ, "minute": "*/20", "hour": 1}, "2018-11-04 00:00:00-07:00", [
+                "2018-11-04 01:00:00-07:00", "2018-11-04 01:20:00-07:00",
+                "2018-11-04 01:40:00-07:00", "2018-11-04 01:00:00-08:00",
+                "2018-11-04 01:20:00-08:00", "2018-11-04 01:40:00-08:00",
+                "2018-11-05 01:00:00-08:00"]),
+            ({"tz": PT_TZ, "minute": "*/20", "hour": 1}, "2018-11-04 01:30:00-07:00", [
+                "2018-11-04 01:40:00-07:00", "2018-11-04 01:00:00-08:00"]),
+            ({"tz": PT_TZ, "minute": 30, "hour": 18}, "2018-11-04 00:00:00-07:00", [
+                "2018-11-04 18:30:00-08:00", "2018-11-05 18:30:00-08:00"]),
+            ({"tz": PT_TZ, "minute": 30, "hour": 2}, "2018-03-10 12:00:00-08:00", [
+                "2018-03-11 03:30:00-07:00", "2018-03-12 02:30:00-07:00"]),
+            ({"tz": PT_TZ, "minute": 30, "hour": 18}, "2018-03-11 00:00:00-08:00", [
+                "2018-03-11 18:30:00-07:00", "2018-03-12 18:30:00-07:00"]),
+        ]
+        for specdict, start, expected in tests:
+            spec = clock.TimeSpec.from_dict(specdict)
+            times = spec.next_times_from(parser.parse(start), len(expected))
+            print("Spec: {}, Start: {} --> {}".format(specdict, start, [str(t) for t in times]))
+            self.assertEqual(times, [parser.parse(t) for t in expected])
+
+    def test_next_times_from(self):
+        spec = clock.TimeSpec.from_dict({"tz": "UTC", "minute": 0})
+        start = parser.parse("2018-01-01 10:30:00-00:00")
+        times = spec.next_times_from(start, 3)
+        self.assertEqual(times, [
+            start + datetime.timedelta(minutes=30),
+            start + datetime.timedelta(minutes=90),
+            start + datetime.timedelta(minutes=150),
+        ])
+
+    def test_croniter_fallback(self):
+        """Syntax the compiled schedule does not support falls back to croniter
+        """
+        spec = clock.TimeSpec.from_dict({"tz": "UTC", "minute": 0, "hour": 0, "weekdays": "5#2"})
+        nexttime = spec.next_time_from(parser.parse("2018-01-01 00:00:00-00:00"))
+        self.assertEqual(nexttime, parser.parse("2018-01-12 00:00:00-00:00"))
+
+
+if __name__ == "__main__":
+    unittest.main()
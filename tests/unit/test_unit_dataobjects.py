@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+import datetime
+from dateutil import parser
+import sys
+import unittest
+
+from ottoengine import helpers, state
+from ottoengine.model import dataobjects
+from ottoengine.testing import websocket_helpers
+
+
+class TestDataObjects(unittest.TestCase):
+
+    def setUp(self):
+        print()
+
+    def test_parse_iso8601(self):
+        tests = [
+            "2017-05-06T01:08:38.324629+00:00",
+            "2017-05-06T01:08:38+00:00",
+            "2017-05-06T01:08:38.324629-07:00",
+            "2017-05-06T01:08:38.324629Z",     # Not fromisoformat() syntax; uses dateutil
+            "2017-05-06 01:08:38",
+        ]
+        for value in tests:
+            actual = helpers.parse_iso8601(value)
+            print("{} --> {}".format(value, repr(actual)))
+            self.assertEqual(actual, parser.parse(value))
+            self.assertEqual(actual.utcoffset(), parser.parse(value).utcoffset())
+
+        now = helpers.nowutc()
+        self.assertIs(helpers.parse_iso8601(now), now)
+        self.assertIsNone(helpers.parse_iso8601(None))
+
+    def test_state_changed_timestamps_are_lazy(self):
+        msg = websocket_helpers.event_state_changed(1, "light.den", "off", "on")
+        event = dataobjects.StateChangedEvent.from_websocket_dict(msg["event"])
+
+        self.assertIsInstance(event._time_fired, str)
+        self.assertIsInstance(event.new_state_obj._last_changed, str)
+
+        self.assertEqual(event.time_fired, parser.parse(msg["event"]["time_fired"]))
+        self.assertEqual(event.new_state_obj.last_changed, parser.parse(
+            msg["event"]["data"]["new_state"]["last_changed"]))
+        self.assertIsInstance(event.new_state_obj._last_changed, datetime.datetime)
+        self.assertIsInstance(event.old_state_obj._last_changed, str)
+
+    def test_is_equal_across_formats(self):
+        now = helpers.nowutc()
+        parsed = dataobjects.EntityState("light.den", "on", {}, now)
+        unparsed = dataobjects.EntityState("light.den", "on", {}, now.isoformat())
+        self.assertTrue(parsed.is_equal(unparsed))
+        self.assertTrue(unparsed.is_equal(
+            dataobjects.EntityState("light.den", "on", {}, now.isoformat())))
+
+        later = dataobjects.EntityState(
+            "light.den", "on", {}, (now + datetime.timedelta(seconds=1)).isoformat())
+        self.assertFalse(unparsed.is_equal(later))
+
+    def test_compact_entity_state(self):
+        self.assertIn("_numeric_state", dataobjects.EntityState.__slots__)
+        entity_id = "".join(["sensor.", "temperature"])     # Built at runtime, not interned
+        entity = dataobjects.EntityState(entity_id, "".join(["2", "1"]), {}, None)
+        self.assertFalse(hasattr(entity, "__dict__"))
+        self.assertIs(entity.entity_id, sys.intern("sensor.temperature"))
+        self.assertIs(entity.state, sys.intern("21"))
+        self.assertEqual(entity.numeric_state, 21)
+
+    def test_old_state_reuses_stored_instance(self):
+        states = state.OttoEngineState()
+        first = websocket_helpers.event_state_changed(1, "light.den", "off", "on")
+        first_event = dataobjects.StateChangedEvent.from_websocket_dict(first["event"], states)
+        states.set_entity_state("light.den", first_event.new_state_obj)
+
+        # The next event's old_state is the state stored from the first event
+        second = websocket_helpers.event_state_changed(2, "light.den", "on", "off")
+        second["event"]["data"]["old_state"] = first["event"]["data"]["new_state"]
+        second_event = dataobjects.StateChangedEvent.from_websocket_dict(
+            second["event"], states)
+        self.assertIs(second_event.old_state_obj, first_event.new_state_obj)
+
+        # An old_state that doesn't match the stored state gets its own object
+        third = websocket_helpers.event_state_changed(3, "light.den", "unavailable", "on")
+        third_event = dataobjects.StateChangedEvent.from_websocket_dict(third["event"], states)
+        self.assertIsNot(third_event.old_state_obj, first_event.new_state_obj)
+        self.assertEqual(third_event.old_state_obj.state, "unavailable")
+
+    def test_shared_attributes(self):
+        states = state.OttoEngineState()
+        for i in range(3):
+            states.set_entity_state("binary_sensor.motion_{}".format(i), dataobjects.EntityState(
+                "binary_sensor.motion_{}".format(i), "off", {"device_class": "motion"}, None))
+        shared = states.get_entity_state("binary_sensor.motion_0").attributes
+        self.assertIs(states.get_entity_state("binary_sensor.motion_2").attributes, shared)
+
+        # 1 and True are equal, but must not share a dict
+        states.set_entity_state("sensor.a", dataobjects.EntityState(
+            "sensor.a", "on", {"level": 1}, None))
+        states.set_entity_state("sensor.b", dataobjects.EntityState(
+            "sensor.b", "on", {"level": True}, None))
+        self.assertIs(states.get_entity_state("sensor.b").attributes["level"], True)
+
+        # A new state with the same attributes reuses the entity's stored dict
+        named = {"friendly_name": "Den", "entity_id": ["light.a", "light.b"]}
+        states.set_entity_state("group.den", dataobjects.EntityState(
+            "group.den", "on", named, None))
+        states.set_entity_state("group.den", dataobjects.EntityState(
+            "group.den", "off", dict(named), None))
+        self.assertIs(states.get_entity_state("group.den").attributes, named)
+
+
+if __name__ == "__main__":
+    unittest.main()
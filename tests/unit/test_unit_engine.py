@@ -2,6 +2,7 @@
 
 import asyncio
 import os
+import tempfile
 import unittest
 import pytz
 import datetime as dt
@@ -9,6 +10,7 @@ import datetime as dt
 from ottoengine import engine, config, enginelog, persistence, helpers
 from ottoengine.utils import setup_debug_logging
 from ottoengine.fibers import clock
+from ottoengine.model import dataobjects
 
 setup_debug_logging()
 
@@ -105,6 +107,111 @@ class TestEngine(unittest.TestCase):
         print(num_rules_loaded, "rules loaded into engine state")
         self.assertEqual(num_rules_loaded, num_rule_files)
 
+    def test_incremental_rule_save_and_delete(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.persist_mgr = persistence.PersistenceManager(tmpdir.name)
+        self.clock = clock.EngineClock(self.config.tz, self.loop)
+        self._setup_engine()
+
+        def _rule_dict(rule_id, entity_id, enabled=True):
+            return {
+                "id": rule_id,
+                "enabled": enabled,
+                "triggers": [
+                    {"platform": "state", "entity_id": entity_id, "to": "on"},
+                    {"platform": "time", "tz": "UTC", "minute": 0}
+                ],
+                "actions": [{"action_sequence": [{"log_message": rule_id}]}]
+            }
+
+        def _save(rule_dict):
+            result = self.loop.run_until_complete(self.engine_obj._async_save_rule(rule_dict))
+            self.assertTrue(result.get("success"), msg=result)
+
+        def _listened():
+            index = self.engine_obj._state_listener_index
+            return [entity_id for entity_id in ("input_boolean.a", "input_boolean.b",
+                                                "input_boolean.c")
+                    if index.has_listeners(entity_id)]
+
+        _save(_rule_dict("rule_a", "input_boolean.a"))
+        _save(_rule_dict("rule_b", "input_boolean.b"))
+        self.assertEqual(_listened(), ["input_boolean.a", "input_boolean.b"])
+        self.assertEqual(len(self.engine_obj._time_listeners), 2)
+        self.assertEqual(len(self.clock.timeline[0].actions), 2)
+
+        print("Re-saving rule_a with a new trigger should replace only its listeners")
+        _save(_rule_dict("rule_a", "input_boolean.c"))
+        self.assertEqual(_listened(), ["input_boolean.b", "input_boolean.c"])
+        self.assertEqual(len(self.engine_obj._time_listeners), 2)
+        self.assertEqual(len(self.clock.timeline[0].actions), 2)
+        self.assertEqual(len(self.engine_obj.states.get_rules()), 2)
+
+        print("Disabling rule_b should remove its listeners but keep the rule")
+        _save(_rule_dict("rule_b", "input_boolean.b", enabled=False))
+        self.assertEqual(_listened(), ["input_boolean.c"])
+        self.assertEqual(len(self.engine_obj._time_listeners), 1)
+        self.assertEqual(len(self.engine_obj.states.get_rules()), 2)
+
+        print("Deleting rule_a should remove its listeners and the rule")
+        deleted = self.loop.run_until_complete(self.engine_obj._async_delete_rule("rule_a"))
+        self.assertTrue(deleted)
+        self.assertEqual(_listened(), [])
+        self.assertEqual(len(self.engine_obj._time_listeners), 0)
+        self.assertEqual(self.clock.timeline, [])
+        self.assertEqual([rule.id for rule in self.engine_obj.states.get_rules()], ["rule_b"])
+
+    def test_apply_entity_states_replays_changes(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.persist_mgr = persistence.PersistenceManager(tmpdir.name)
+        self._setup_engine()
+
+        invoked = []
+        checked = []
+
+        async def _async_invoke_rule(engine_obj, rule, trigger=None, event=None,
+                                     trigger_checked=False):
+            invoked.append((rule.id, event.entity_id, event.new_state_obj.state))
+            checked.append(trigger_checked)
+
+        original_invoke_rule = engine.async_invoke_rule
+        engine.async_invoke_rule = _async_invoke_rule
+        self.addCleanup(setattr, engine, "async_invoke_rule", original_invoke_rule)
+
+        rule_dict = {
+            "id": "light_on",
+            "triggers": [{"platform": "state", "entity_id": "light.hall", "to": "on"}],
+            "actions": [{"action_sequence": [{"log_message": "on"}]}]
+        }
+        result = self.loop.run_until_complete(self.engine_obj._async_save_rule(rule_dict))
+        self.assertTrue(result.get("success"), msg=result)
+
+        def _states(hall, porch):
+            return [
+                dataobjects.EntityState("light.hall", hall, {}, "2018-10-01T12:00:00+00:00"),
+                dataobjects.EntityState("light.porch", porch, {}, "2018-10-01T12:00:00+00:00"),
+            ]
+
+        print("The first get_states result only seeds the state")
+        self.assertEqual(self.engine_obj.apply_entity_states(_states("off", "off")), 2)
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.assertEqual(invoked, [])
+
+        print("An unchanged result does nothing")
+        self.assertEqual(self.engine_obj.apply_entity_states(_states("off", "off")), 0)
+
+        print("A change missed while disconnected triggers the rule")
+        listeners = self.engine_obj._rule_listeners["light_on"]
+        self.assertEqual(self.engine_obj.apply_entity_states(_states("on", "off")), 1)
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.assertEqual(invoked, [("light_on", "light.hall", "on")])
+        print("The listener index already passed the trigger, so the rule doesn't check it")
+        self.assertEqual(checked, [True])
+        self.assertEqual(self.engine_obj.states.get_entity_state("light.hall").state, "on")
+        self.assertIs(self.engine_obj._rule_listeners["light_on"], listeners)
+
 
 def _get_event_loop() -> asyncio.AbstractEventLoop:
     """ This simply wraps the asyncio function so we have typing for autocomplet/linting"""
@@ -85,6 +85,53 @@ class TestEnginelog(unittest.TestCase):
         self.assertEqual(log_type, "error")
         self.assertEqual(log_entry.get("message"), error_message)
 
+    def test_sequence_numbers(self):
+        enlog = enginelog.EngineLog(max_logs=10)
+        self.assertEqual(enlog.last_seq, 0)
+        logs = _fill_logs(enlog, 25)
+        print([log["seq"] for log in logs])
+        self.assertEqual([log["seq"] for log in logs], list(range(16, 26)))
+        self.assertEqual(enlog.last_seq, 25)
+
+        self.assertEqual([log["seq"] for log in enlog.get_logs(since=22)], [23, 24, 25])
+        self.assertEqual([log["seq"] for log in enlog.get_logs(since=3, limit=2)], [16, 17])
+        self.assertEqual(enlog.get_logs(since=25), [])
+
+        enlog.set_max_logs(4)
+        self.assertEqual([log["seq"] for log in enlog.get_logs()], [22, 23, 24, 25])
+        enlog.add(enginelog.DEBUG, {})
+        self.assertEqual([log["seq"] for log in enlog.get_logs()], [23, 24, 25, 26])
+
+    def test_filtered_queries(self):
+        enlog = enginelog.EngineLog(max_logs=300)
+        for i in range(1000):
+            rule_id = "rule_{}".format(i % 4)
+            enlog.add(enginelog.TRIGGER_FIRED, {"i": i}, rule_id=rule_id)
+            if i % 10 == 0:
+                enlog.add(enginelog.RULE_COMPLETED, {"i": i}, rule_id=rule_id)
+
+        fired = enlog.get_logs(logtype=enginelog.TRIGGER_FIRED, rule_id="rule_2")
+        print("{} trigger_fired entries for rule_2 of {}".format(
+            len(fired), len(enlog.get_logs())))
+        self.assertTrue(all(log["rule"] == "rule_2" for log in fired))
+        self.assertTrue(all(log["type"] == enginelog.TRIGGER_FIRED for log in fired))
+        self.assertEqual(
+            fired, [
+                log for log in enlog.get_logs()
+                if log["rule"] == "rule_2" and log["type"] == enginelog.TRIGGER_FIRED])
+
+        completed = enlog.get_logs(logtype=enginelog.RULE_COMPLETED)
+        self.assertEqual([log["entry"]["i"] for log in completed][-3:], [970, 980, 990])
+        newer = enlog.get_logs(since=completed[-2]["seq"], logtype=enginelog.RULE_COMPLETED)
+        self.assertEqual(newer, completed[-1:])
+        self.assertEqual(enlog.get_logs(rule_id="no_such_rule"), [])
+
+        print("Types and rules that aged out of the log are dropped from the indexes")
+        for i in range(300):
+            enlog.add(enginelog.DEBUG, {"i": i})
+        self.assertEqual(enlog.get_logs(logtype=enginelog.TRIGGER_FIRED), [])
+        self.assertEqual(enlog._rule_index, {})
+
 
 def _fill_logs(enlog: enginelog.EngineLog, num_add_logs: int) -> int:
     for i in range(num_add_logs):
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+
+import random
+import unittest
+
+from ottoengine import listener_index
+from ottoengine.model import dataobjects, rule_objects
+from ottoengine.model.trigger_objects import StateTrigger, NumericStateTrigger, EventTrigger
+from ottoengine.testing import websocket_helpers
+
+
+def _listener(rule_id, trigger):
+    return rule_objects.HassListener(rule_objects.AutomationRule(rule_id), trigger)
+
+
+def _state_event(entity_id, old_state, new_state):
+    msg = websocket_helpers.event_state_changed(1, entity_id, old_state, new_state)
+    return dataobjects.StateChangedEvent.from_websocket_dict(msg["event"])
+
+
+def _hass_event(event_type, event_data):
+    msg = websocket_helpers.event_hass_event(1, event_type, event_data)
+    return dataobjects.HassEvent.from_websocket_dict(msg["event"])
+
+
+class TestNumericIntervalIndex(unittest.TestCase):
+
+    def setUp(self):
+        print()
+
+    def test_stab_matches_brute_force(self):
+        rand = random.Random(1234)
+        index = listener_index.NumericIntervalIndex()
+        intervals = []
+        for i in range(300):
+            low = rand.choice([None, rand.randint(-50, 50)])
+            high = rand.choice([None, rand.randint(-50, 50)])
+            if low is None and high is None:
+                low = 0
+            intervals.append((low, high, i))
+            index.add(low, high, i)
+
+        for value in [v / 2 for v in range(-120, 121)]:
+            expected = sorted(
+                i for low, high, i in intervals
+                if (low is None or value > low) and (high is None or value < high)
+            )
+            self.assertEqual(sorted(index.stab(value)), expected, msg="value: {}".format(value))
+
+    def test_empty_range(self):
+        index = listener_index.NumericIntervalIndex()
+        index.add(30, 10, "never")
+        index.add(5, 5, "never")
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.stab(20), [])
+
+
+class TestStateListenerIndex(unittest.TestCase):
+
+    def setUp(self):
+        print()
+        self.index = listener_index.StateListenerIndex()
+
+    def test_match_state_triggers(self):
+        entity = "input_boolean.test"
+        self.index.add(_listener("any", StateTrigger(entity)))
+        self.index.add(_listener("to_on", StateTrigger(entity, to_state="on")))
+        self.index.add(_listener("to_off", StateTrigger(entity, to_state="off")))
+        self.index.add(_listener("off_on", StateTrigger(entity, to_state="on", from_state="off")))
+        self.index.add(_listener("from_on", StateTrigger(entity, from_state="on")))
+        self.index.add(_listener("other", StateTrigger("input_boolean.other")))
+
+        # (old_state, new_state, expected rule ids in registration order)
+        tests = [
+            ("off", "on", ["any", "to_on", "off_on"]),
+            ("on", "off", ["any", "to_off", "from_on"]),
+            ("unavailable", "on", ["any", "to_on"]),
+            ("on", "on", []),
+        ]
+        for old_state, new_state, expected in tests:
+            event = _state_event(entity, old_state, new_state)
+            actual = [listener.rule.id for listener in self.index.match(event)]
+            print("{} -> {}: {}".format(old_state, new_state, actual))
+            self.assertEqual(actual, expected)
+
+            # The index must agree with each trigger's own evaluation
+            for listener in self.index.match(event):
+                self.assertTrue(listener.trigger.eval_trigger(event))
+
+    def test_match_unknown_entity(self):
+        self.index.add(_listener("any", StateTrigger("input_boolean.test")))
+        event = _state_event("sensor.chatty", "1", "2")
+        self.assertEqual(self.index.match(event), [])
+
+    def test_numeric_trigger_is_evaluated(self):
+        entity = "sensor.temperature"
+        self.index.add(_listener("hot", NumericStateTrigger(entity, above_value=30)))
+        self.index.add(_listener("any", StateTrigger(entity)))
+        event = _state_event(entity, 20, 35)
+        self.assertEqual(
+            [listener.rule.id for listener in self.index.match(event)], ["hot", "any"])
+
+    def test_numeric_string_states(self):
+        """Home Assistant sends numeric states as strings"""
+        entity = "sensor.temperature"
+        self.index.add(_listener("cold", NumericStateTrigger(entity, below_value=10)))
+        self.index.add(
+            _listener("mild", NumericStateTrigger(entity, above_value="10", below_value=25)))
+        self.index.add(_listener("hot", NumericStateTrigger(entity, above_value=25)))
+
+        # (new_state, expected rule ids)
+        tests = [
+            ("-3.5", ["cold"]),
+            ("10", []),
+            ("21.5", ["mild"]),
+            ("25.01", ["hot"]),
+            ("unavailable", []),
+        ]
+        for new_state, expected in tests:
+            event = _state_event(entity, "0", new_state)
+            actual = [listener.rule.id for listener in self.index.match(event)]
+            print("{}: {}".format(new_state, actual))
+            self.assertEqual(actual, expected)
+            for listener in self.index.match(event):
+                self.assertTrue(listener.trigger.eval_trigger(event))
+
+    def test_stats(self):
+        entity = "input_boolean.test"
+        self.index.add(_listener("to_on", StateTrigger(entity, to_state="on")))
+        self.index.add(_listener("to_off", StateTrigger(entity, to_state="off")))
+        self.index.match(_state_event(entity, "off", "on"))
+        self.index.match(_state_event(entity, "on", "on"))
+
+        stats = self.index.get_stats()
+        print(stats)
+        self.assertEqual(stats["events"], 2)
+        self.assertEqual(stats["listeners_matched"], 1)
+        self.assertEqual(stats["tasks_avoided"], 3)
+
+    def test_remove(self):
+        entity = "sensor.temperature"
+        to_on = _listener("to_on", StateTrigger(entity, to_state="on"))
+        hot = _listener("hot", NumericStateTrigger(entity, above_value=30))
+        any_state = _listener("any", StateTrigger(entity))
+        for listener in [to_on, hot, any_state]:
+            self.index.add(listener)
+
+        self.index.remove(to_on)
+        self.index.remove(hot)
+        self.index.remove(hot)  # Removing twice is a no-op
+        self.assertEqual(self.index.match(_state_event(entity, "off", "on")), [any_state])
+        self.assertEqual(self.index.match(_state_event(entity, "20", "35")), [any_state])
+
+        self.index.remove(any_state)
+        self.index.match(_state_event(entity, "off", "on"))
+        self.assertEqual(self.index.get_stats()["tasks_avoided"], 0)
+
+    def test_clear(self):
+        self.index.add(_listener("any", StateTrigger("input_boolean.test")))
+        self.index.clear()
+        event = _state_event("input_boolean.test", "off", "on")
+        self.assertEqual(self.index.match(event), [])
+
+
+class TestEventListenerIndex(unittest.TestCase):
+
+    def setUp(self):
+        print()
+        self.index = listener_index.EventListenerIndex()
+
+    def test_match_event_data(self):
+        scene = "zwave.scene_activated"
+        self.index.add(_listener("any", EventTrigger(scene, {})))
+        for scene_id in range(1, 6):
+            self.index.add(_listener("scene{}".format(scene_id), EventTrigger(
+                scene, {"scene_id": scene_id})))
+        self.index.add(_listener("hall3", EventTrigger(
+            scene, {"scene_id": 3, "entity_id": "zwave.hall"})))
+        self.index.add(_listener("list", EventTrigger(scene, {"buttons": [1, 2]})))
+        self.index.add(_listener("other", EventTrigger("timer_ended", {})))
+
+        # (event_data, expected rule ids in registration order)
+        tests = [
+            ({"scene_id": 2, "entity_id": "zwave.hall"}, ["any", "scene2"]),
+            ({"scene_id": 3, "entity_id": "zwave.hall"}, ["any", "scene3", "hall3"]),
+            ({"scene_id": 3, "entity_id": "zwave.den"}, ["any", "scene3"]),
+            ({"scene_id": 9, "buttons": [1, 2]}, ["any", "list"]),
+            ({}, ["any"]),
+        ]
+        for event_data, expected in tests:
+            event = _hass_event(scene, event_data)
+            actual = [listener.rule.id for listener in self.index.match(event)]
+            print("{}: {}".format(event_data, actual))
+            self.assertEqual(actual, expected)
+
+        stats = self.index.get_stats()
+        print(stats)
+        self.assertEqual(stats["events"], len(tests))
+        self.assertEqual(stats["listeners_matched"], 10)
+
+    def test_remove(self):
+        scene = "zwave.scene_activated"
+        scene1 = _listener("scene1", EventTrigger(scene, {"scene_id": 1}))
+        any_scene = _listener("any", EventTrigger(scene, {}))
+        self.index.add(scene1)
+        self.index.add(any_scene)
+
+        self.index.remove(scene1)
+        self.assertEqual(self.index.match(_hass_event(scene, {"scene_id": 1})), [any_scene])
+        self.index.remove(any_scene)
+        self.assertEqual(self.index.match(_hass_event(scene, {"scene_id": 1})), [])
+
+    def test_match_unknown_event_type(self):
+        self.index.add(_listener("any", EventTrigger("timer_ended", {})))
+        self.assertEqual(self.index.match(_hass_event("call_service", {})), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
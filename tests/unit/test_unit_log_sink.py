@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+import os
+import tempfile
+import unittest
+
+from ottoengine import enginelog, log_sink
+
+START_TS = 1538395200.0
+
+
+def _records(num, rules=5):
+    """A record every 10ms, with the rule id also appearing inside some entries"""
+    types = [enginelog.TRIGGER_FIRED, enginelog.SERVICE_CALLED, enginelog.RULE_COMPLETED]
+    return [
+        (
+            i + 1,
+            START_TS + i * 0.01,
+            types[i % 3],
+            "rule_{}".format(i % rules) if i % 3 != 1 else None,
+            {"i": i, "rule": "rule_{}".format((i + 1) % rules)},
+        )
+        for i in range(num)
+    ]
+
+
+class TestLogSink(unittest.TestCase):
+
+    def setUp(self):
+        print()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.log_dir = os.path.join(self.tmpdir.name, "engine_log")
+
+    def _write(self, records, **kwargs):
+        sink = log_sink.LogSink(self.log_dir, **kwargs)
+        sink.start()
+        for record in records:
+            sink.write(record)
+        sink.close()
+        print(sink.get_stats())
+        return sink
+
+    def test_time_range_and_rule_queries(self):
+        records = _records(3000)
+        sink = self._write(records, segment_bytes=16 * 1024, max_segments=100)
+        segments = log_sink.list_segments(self.log_dir)
+        print("{} segments".format(len(segments)))
+        self.assertGreater(len(segments), 5)
+        self.assertEqual(sink.get_stats()["written"], 3000)
+
+        reader = log_sink.LogReader(self.log_dir)
+        self.assertEqual([r["seq"] for r in reader.query()], list(range(1, 3001)))
+
+        in_range = reader.query(start_ts=START_TS + 10.005, end_ts=START_TS + 12.0)
+        self.assertEqual(in_range[0]["seq"], 1002)
+        self.assertEqual(in_range[-1]["seq"], 1201)
+
+        print("Lines with the rule id only inside the entry are not returned")
+        for_rule = reader.query(rule_id="rule_3", start_ts=START_TS + 5, end_ts=START_TS + 25)
+        expected = [
+            r[0] for r in records
+            if r[3] == "rule_3" and START_TS + 5 <= r[1] <= START_TS + 25]
+        self.assertEqual([r["seq"] for r in for_rule], expected)
+        self.assertEqual(for_rule[0]["entry"]["rule"], "rule_4")
+
+        completed = reader.query(rule_id="rule_3", logtype=enginelog.RULE_COMPLETED, limit=3)
+        self.assertEqual([r["seq"] for r in completed], [9, 24, 39])
+        self.assertEqual(reader.query(start_ts=START_TS + 1000), [])
+
+    def test_rotation_keeps_newest_segments(self):
+        self._write(_records(3000), segment_bytes=16 * 1024, max_segments=3)
+        self.assertEqual(len(log_sink.list_segments(self.log_dir)), 3)
+        records = log_sink.LogReader(self.log_dir).query()
+        print("Oldest kept: {}".format(records[0]["seq"]))
+        self.assertEqual(records[-1]["seq"], 3000)
+        self.assertEqual(
+            [r["seq"] for r in records], list(range(records[0]["seq"], 3001)))
+
+    def test_partial_line_ignored(self):
+        self._write(_records(10))
+        path = log_sink.list_segments(self.log_dir)[-1]
+        with open(path, "ab") as f:
+            f.write(b'{"ts":1538395300.000000,"seq":11,"ty')
+        self.assertEqual(len(log_sink.LogReader(self.log_dir).query()), 10)
+
+    def test_engine_log_sink(self):
+        sink = log_sink.LogSink(self.log_dir)
+        sink.start()
+        englog = enginelog.EngineLog(max_logs=0, sink=sink)
+        englog.add(enginelog.TRIGGER_FIRED, {"trigger": {}}, rule_id="porch")
+        englog.add(enginelog.DEBUG, {"not": "kept"})
+        englog.add(enginelog.RULE_COMPLETED, {"rule": "porch"}, rule_id="porch")
+        sink.close()
+
+        records = log_sink.LogReader(self.log_dir).query(rule_id="porch")
+        print(records)
+        self.assertEqual(
+            [r["type"] for r in records], [enginelog.TRIGGER_FIRED, enginelog.RULE_COMPLETED])
+        self.assertEqual(englog.get_logs(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+import json
+import unittest
+
+from ottoengine import message_decoder
+from ottoengine.testing import websocket_helpers
+
+
+class TestMessageDecoder(unittest.TestCase):
+
+    def setUp(self):
+        print()
+
+    def test_peek(self):
+        # (raw message, expected (type, event_type))
+        tests = [
+            ('{"id": 12, "type": "pong"}', ("pong", None)),
+            ('{"type": "auth_ok", "ha_version": "0.41.0"}', ("auth_ok", None)),
+            (json.dumps(websocket_helpers.event_state_changed(1, "light.den", "off", "on")),
+             ("event", "state_changed")),
+            (json.dumps(websocket_helpers.event_hass_event(1, "zwave.scene_activated", {})),
+             ("event", "zwave.scene_activated")),
+            (b'{"id":3,"type":"event","event":{"event_type":"timer_ended","data":{}}}',
+             ("event", "timer_ended")),
+            # Keys in an unexpected order can't be peeked, so the message gets decoded
+            ('{"event": {"event_type": "timer_ended"}, "type": "event", "id": 1}', (None, None)),
+            ('{"id": 1, "type": "event", "event": {"data": {}, "event_type": "x"}}',
+             ("event", None)),
+        ]
+        for raw_msg, expected in tests:
+            actual = message_decoder.peek(raw_msg)
+            print("{} --> {}".format(raw_msg[:40], actual))
+            self.assertEqual(actual, expected)
+
+    def test_decode_and_drop(self):
+        for backend in message_decoder.available_backends():
+            decoder = message_decoder.MessageDecoder(
+                event_filter=lambda event_type: event_type == "state_changed", backend=backend)
+            state_changed = websocket_helpers.event_state_changed(1, "light.den", "off", "on")
+
+            self.assertEqual(decoder.decode(json.dumps(state_changed)), state_changed)
+            self.assertIsNone(decoder.decode('{"id": 12, "type": "pong"}'))
+            self.assertIsNone(decoder.decode(json.dumps(
+                websocket_helpers.event_hass_event(2, "call_service", {}))))
+            self.assertEqual(decoder.decode('{"id": 3, "type": "result", "success": true}'),
+                             {"id": 3, "type": "result", "success": True})
+            self.assertRaises(ValueError, decoder.decode, '{"id": 4, "type": "result"')
+
+            stats = decoder.get_stats()
+            print(stats)
+            self.assertEqual(stats["backend"], backend)
+            self.assertEqual(stats["decoded"], 3)
+            self.assertEqual(stats["dropped"], 2)
+
+    def test_unknown_backend(self):
+        self.assertRaises(ValueError, message_decoder.MessageDecoder, backend="yaml")
+
+
+if __name__ == "__main__":
+    unittest.main()
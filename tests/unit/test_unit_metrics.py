@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+import asyncio
+import time
+import unittest
+
+from ottoengine import engine, metrics
+from ottoengine.model import dataobjects
+from ottoengine.testing import engine_helpers
+
+
+def _state(entity_id, value):
+    return dataobjects.EntityState(entity_id, value, {}, "2018-10-01T12:00:00+00:00")
+
+
+class TestRuleMetrics(unittest.TestCase):
+
+    def setUp(self):
+        print()
+        self.loop = asyncio.get_event_loop()
+        websocket = engine_helpers.RecordingWebsocket()
+        websocket.rtt_stats = {
+            "pending": 2,
+            "requests": {"call_service": {
+                "count": 4, "mean_secs": 0.01, "p50_secs": 0.008, "p99_secs": 0.03}},
+        }
+        self.engine_obj = engine_helpers.setup_engine(self, websocket)
+
+    def _rule(self, rule_id, service="turn_on", **rule_dict):
+        rule_dict.update({
+            "id": rule_id,
+            "triggers": [{"platform": "state", "entity_id": "switch.button", "to": "on"}],
+            "actions": [{"action_sequence": [
+                {"log_message": "pressed"},
+                {"domain": "light", "service": service, "data": {"entity_id": "light.hall"}},
+            ]}]
+        })
+        result = self.engine_obj._persistence_mgr.rule_from_dict(rule_dict)
+        self.assertTrue(result.get("success"), msg=result)
+        return result.get("rule")
+
+    def _invoke(self, rule, new_state):
+        event = dataobjects.StateChangedEvent(
+            "switch.button", _state("switch.button", "off"),
+            _state("switch.button", new_state), "2018-10-01T12:00:00+00:00")
+        event.received = time.perf_counter() - 0.002
+        self.loop.run_until_complete(
+            engine.async_invoke_rule(self.engine_obj, rule, rule.triggers[0], event))
+
+    def test_counters_and_stages(self):
+        self.engine_obj.states.set_entity_state(
+            "input_boolean.home", _state("input_boolean.home", "off"))
+        plain = self._rule("plain")
+        conditional = self._rule("conditional", rule_condition={
+            "condition": "state", "entity_id": "input_boolean.home", "state": "on"})
+        failing = self._rule("failing", service="fail")
+
+        self._invoke(plain, "on")
+        self._invoke(plain, "on")
+        self._invoke(plain, "off")
+        self._invoke(conditional, "on")
+        self._invoke(failing, "on")
+
+        counts = self.engine_obj.metrics.get_rule_counts()
+        print(counts)
+        self.assertEqual(
+            [counts["plain"][name] for name in metrics.COUNTER_NAMES], [2, 1, 0, 2, 0])
+        self.assertEqual(
+            [counts["conditional"][name] for name in metrics.COUNTER_NAMES], [1, 0, 1, 0, 0])
+        self.assertEqual(
+            [counts["failing"][name] for name in metrics.COUNTER_NAMES], [1, 0, 0, 0, 1])
+
+        stages = self.engine_obj.metrics.get_stats()["stages"]
+        print(stages)
+        self.assertEqual(stages[metrics.STAGE_TRIGGER]["count"], 4)
+        self.assertEqual(stages[metrics.STAGE_CONDITION]["count"], 1)
+        self.assertEqual(stages[metrics.STAGE_FIRST_SERVICE_CALL]["count"], 3)
+        self.assertEqual(stages[metrics.STAGE_COMPLETED]["count"], 2)
+        print("Stages are timed from when the event was received")
+        self.assertGreaterEqual(stages[metrics.STAGE_TRIGGER]["max_secs"], 0.002)
+
+    def test_event_trigger_rejected(self):
+        def _load(rule_id, event_data):
+            result = self.engine_obj._persistence_mgr.rule_from_dict({
+                "id": rule_id,
+                "triggers": [{"platform": "event", "event_type": "zwave.scene_activated",
+                              "event_data": event_data}],
+                "actions": [{"action_sequence": [{"log_message": "scene"}]}]
+            })
+            self.assertTrue(result.get("success"), msg=result)
+            self.loop.run_until_complete(self.engine_obj._async_load_rule(result.get("rule")))
+
+        _load("any", {})
+        _load("scene_1", {"entity_id": "zwave.remote", "scene_id": 1})
+        _load("other_remote", {"entity_id": "zwave.other", "scene_id": 1})
+        self.engine_obj.process_event(dataobjects.HassEvent(
+            "zwave.scene_activated", {"entity_id": "zwave.remote", "scene_id": 2},
+            "2018-10-01T12:00:00+00:00"))
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+
+        counts = self.engine_obj.metrics.get_rule_counts()
+        print(counts)
+        self.assertEqual(counts["any"]["completed"], 1)
+        print("scene_1 was evaluated by the index and rejected")
+        self.assertEqual(counts["scene_1"]["trigger_rejected"], 1)
+        self.assertEqual(counts["scene_1"]["triggered"], 0)
+        print("other_remote's indexed event_data didn't match, so it was never evaluated")
+        self.assertNotIn("other_remote", counts)
+        self.assertEqual(self.engine_obj.get_stats()["event_listener_index"]["tasks_avoided"], 2)
+
+    def test_prometheus_text(self):
+        self._invoke(self._rule('say "hi"'), "on")
+        text = self.engine_obj.get_metrics_text()
+        print(text)
+        lines = text.splitlines()
+        self.assertIn('otto_rule_completed_total{rule="say \\"hi\\""} 1', lines)
+        self.assertIn('otto_stage_latency_seconds_count{stage="completed"} 1', lines)
+        self.assertIn('otto_stage_latency_seconds_bucket{stage="completed",le="+Inf"} 1', lines)
+        self.assertIn("# TYPE otto_stage_latency_seconds histogram", lines)
+        self.assertIn("otto_state_listener_index_events 0", lines)
+        self.assertIn("otto_entity_snapshot_version 0", lines)
+        self.assertIn(
+            'otto_websocket_rtt_seconds{request="call_service",quantile="0.99"} 0.03', lines)
+        self.assertIn("otto_websocket_pending_requests 2", lines)
+
+        print("Every sample line is a metric name, optional labels and a number")
+        for line in lines:
+            if not line.startswith("#"):
+                float(line.rsplit(" ", 1)[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+
+from ottoengine import packed_store, persistence, sqlite_store
+
+REALWORLD_RULES_DIR = os.path.join(os.path.dirname(__file__), "..", "json_realworld_rules")
+
+
+class TestPersistenceManager(unittest.TestCase):
+
+    def setUp(self):
+        print()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.rules_dir = os.path.join(self.tmpdir.name, "rules")
+        shutil.copytree(REALWORLD_RULES_DIR, self.rules_dir)
+        self.persist_mgr = persistence.PersistenceManager(self.rules_dir)
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+        self.tmpdir.cleanup()
+
+    def _async_get_rules(self):
+        return self.loop.run_until_complete(self.persist_mgr.async_get_rules(self.rules_dir))
+
+    def test_async_get_rules_matches_get_rules(self):
+        expected = sorted(rule.id for rule in self.persist_mgr.get_rules(self.rules_dir))
+        fresh_mgr = persistence.PersistenceManager(self.rules_dir)
+        actual = self.loop.run_until_complete(fresh_mgr.async_get_rules(self.rules_dir))
+        self.assertEqual(sorted(rule.id for rule in actual), expected)
+        self.assertEqual(len(fresh_mgr.get_load_times()), len(os.listdir(self.rules_dir)))
+
+    def test_unchanged_files_are_cached(self):
+        first = {rule.id: rule for rule in self._async_get_rules()}
+        second = {rule.id: rule for rule in self._async_get_rules()}
+        self.assertEqual(first.keys(), second.keys())
+        for rule_id, rule in first.items():
+            self.assertIs(second[rule_id], rule)
+
+    def test_changed_and_deleted_files_are_reloaded(self):
+        first = {rule.id: rule for rule in self._async_get_rules()}
+        changed_id, deleted_id = sorted(first)[:2]
+
+        changed = self.persist_mgr.rule_from_dict(first[changed_id].serialize())["rule"]
+        changed.description = "Changed on disk"
+        self.persist_mgr.save_rule(changed)
+        self.assertTrue(self.persist_mgr.delete_rule(deleted_id))
+
+        second = {rule.id: rule for rule in self._async_get_rules()}
+        self.assertNotIn(deleted_id, second)
+        self.assertIsNot(second[changed_id], first[changed_id])
+        self.assertEqual(second[changed_id].description, "Changed on disk")
+
+
+class TestSqliteBackend(unittest.TestCase):
+
+    def setUp(self):
+        print()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.sqlite_path = os.path.join(self.tmpdir.name, "rules.sqlite")
+        self.assertEqual(
+            sqlite_store.main(["import", REALWORLD_RULES_DIR, self.sqlite_path]), 0)
+        self.persist_mgr = persistence.PersistenceManager(
+            self.tmpdir.name, backend=persistence.BACKEND_SQLITE, sqlite_path=self.sqlite_path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_get_rules_matches_file_backend(self):
+        file_mgr = persistence.PersistenceManager(REALWORLD_RULES_DIR)
+        expected = sorted(
+            (rule.serialize() for rule in file_mgr.get_rules(REALWORLD_RULES_DIR)),
+            key=lambda rule_dict: rule_dict["id"])
+        actual = [rule.serialize() for rule in self.persist_mgr.get_rules(self.tmpdir.name)]
+        self.assertEqual(actual, expected)
+
+    def test_query_rules(self):
+        lights = [rule.id for rule in self.persist_mgr.query_rules(group="Lights")]
+        self.assertEqual(lights, ["14846774", "333135", "335344", "335790"])
+        self.assertEqual(len(self.persist_mgr.query_rules(enabled=True)), 22)
+        self.assertEqual(self.persist_mgr.query_rules(enabled=False), [])
+
+    def test_rule_ids_for_entity(self):
+        store = sqlite_store.SqliteRuleStore(self.sqlite_path)
+        self.assertEqual(
+            store.get_rule_ids_for_entity("input_boolean.motion_in_kitchen"),
+            ["14846774", "335344", "335790"])
+        store.close()
+
+    def test_save_and_delete(self):
+        rule = self.persist_mgr.load_rule("14846774")
+        rule.enabled = False
+        rule.group = "Disabled"
+        self.persist_mgr.save_rule(rule)
+
+        self.assertEqual([r.id for r in self.persist_mgr.query_rules(enabled=False)], ["14846774"])
+        self.assertEqual(self.persist_mgr.load_rule("14846774").group, "Disabled")
+
+        self.assertTrue(self.persist_mgr.delete_rule("14846774"))
+        self.assertFalse(self.persist_mgr.delete_rule("14846774"))
+        self.assertIsNone(self.persist_mgr.load_rule("14846774"))
+        self.assertEqual(len(self.persist_mgr.get_rules(self.tmpdir.name)), 21)
+
+        # Deleting the rule also removes its entity_id rows
+        store = sqlite_store.SqliteRuleStore(self.sqlite_path)
+        self.assertEqual(
+            store.get_rule_ids_for_entity("input_boolean.motion_in_kitchen"),
+            ["335344", "335790"])
+        store.close()
+
+    def test_failed_save_is_rolled_back(self):
+        good = {"id": "good", "triggers": [], "actions": []}
+        bad = {"triggers": [], "actions": []}     # No id
+        store = sqlite_store.SqliteRuleStore(self.sqlite_path)
+        self.assertRaises(KeyError, store.save_rule_dicts, [good, bad])
+        self.assertIsNone(store.get_rule_dict("good"))
+        store.close()
+
+
+class TestPackedBackend(unittest.TestCase):
+
+    def setUp(self):
+        print()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.packed_path = os.path.join(self.tmpdir.name, "rules.pack")
+        self.assertEqual(
+            packed_store.main(["import", REALWORLD_RULES_DIR, self.packed_path]), 0)
+        self.persist_mgr = persistence.PersistenceManager(
+            self.tmpdir.name, backend=persistence.BACKEND_PACKED, packed_path=self.packed_path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_get_rules_matches_file_backend(self):
+        file_mgr = persistence.PersistenceManager(REALWORLD_RULES_DIR)
+        expected = sorted(
+            (rule.serialize() for rule in file_mgr.get_rules(REALWORLD_RULES_DIR)),
+            key=lambda rule_dict: rule_dict["id"])
+        actual = [rule.serialize() for rule in self.persist_mgr.get_rules(self.tmpdir.name)]
+        self.assertEqual(actual, expected)
+
+    def test_save_delete_and_reopen(self):
+        rule = self.persist_mgr.load_rule("14846774")
+        rule.description = "Saved twice"
+        self.persist_mgr.save_rule(rule)
+        self.assertTrue(self.persist_mgr.delete_rule("333135"))
+        self.assertFalse(self.persist_mgr.delete_rule("333135"))
+
+        store = packed_store.PackedRuleStore(self.packed_path)
+        self.assertEqual(len(store), 21)
+        self.assertNotIn("333135", store)
+        self.assertEqual(store.load_rule_dict("14846774")["description"], "Saved twice")
+        self.assertGreater(store.dead_bytes, 0)
+        store.close()
+
+    def test_torn_append_is_truncated(self):
+        store = packed_store.PackedRuleStore(self.packed_path)
+        size = os.path.getsize(self.packed_path)
+        store.save_rule_dict({"id": "torn", "triggers": [], "actions": []})
+        store.close()
+
+        # Simulate a crash part way through writing the last record
+        with open(self.packed_path, "r+b") as packed_file:
+            packed_file.truncate(os.path.getsize(self.packed_path) - 5)
+
+        store = packed_store.PackedRuleStore(self.packed_path)
+        self.assertNotIn("torn", store)
+        self.assertEqual(len(store), 22)
+        self.assertEqual(os.path.getsize(self.packed_path), size)
+
+        # The store is still appendable after the truncation
+        store.save_rule_dict({"id": "after", "triggers": [], "actions": []})
+        store.close()
+        store = packed_store.PackedRuleStore(self.packed_path)
+        self.assertIn("after", store)
+        store.close()
+
+    def test_compact(self):
+        store = packed_store.PackedRuleStore(self.packed_path)
+        for rule_id in store.get_rule_ids()[:10]:
+            store.save_rule_dict(store.load_rule_dict(rule_id))
+        store.delete_rule(store.get_rule_ids()[-1])
+        expected = {rule_dict["id"]: rule_dict for rule_dict in store.iter_rule_dicts()}
+        size = os.path.getsize(self.packed_path)
+
+        store.compact()
+        self.assertEqual(store.dead_bytes, 0)
+        self.assertLess(os.path.getsize(self.packed_path), size)
+        self.assertEqual(
+            {rule_dict["id"]: rule_dict for rule_dict in store.iter_rule_dicts()}, expected)
+        store.close()
+
+    def test_compact_while_iterating(self):
+        store = packed_store.PackedRuleStore(self.packed_path)
+        expected = {rule_dict["id"]: rule_dict for rule_dict in store.iter_rule_dicts()}
+        for rule_id in store.get_rule_ids()[:10]:
+            store.save_rule_dict(store.load_rule_dict(rule_id))
+
+        print("Records move when the file is compacted part way through reading the rules")
+        rule_dicts = store.iter_rule_dicts()
+        read = [next(rule_dicts)]
+        deleted = store.get_rule_ids()[-1]
+        store.delete_rule(deleted)
+        store.compact()
+        read.extend(rule_dicts)
+
+        del expected[deleted]
+        self.assertEqual({rule_dict["id"]: rule_dict for rule_dict in read}, expected)
+        store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+import asyncio
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from ottoengine.testing import replay
+
+RULES_DIR = os.path.join(os.path.dirname(__file__), "..", "json_realworld_rules")
+
+
+class TestReplay(unittest.TestCase):
+
+    def setUp(self):
+        print()
+        self.loop = asyncio.get_event_loop()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def _write_and_load(self, frames):
+        path = os.path.join(self.tmpdir.name, "recording.ndjson")
+        replay.write_recording(path, frames)
+        return replay.load_recording(path)
+
+    def test_generated_recording_at_max_speed(self):
+        frames = replay.generate_recording(RULES_DIR, num_events=200, seed=1)
+        self.assertEqual(frames, replay.generate_recording(RULES_DIR, num_events=200, seed=1))
+        self.assertEqual(frames[0][1]["type"], "auth_ok")
+        self.assertEqual(len(frames), 202)
+
+        harness = replay.ReplayHarness(RULES_DIR, self.loop)
+        report = harness.run(self._write_and_load(frames))
+        print(replay.format_report(report))
+
+        self.assertTrue(report["settled"])
+        self.assertEqual(report["frames"], 202)
+        self.assertEqual(report["events"], 200)
+        self.assertGreater(report["events_per_sec"], 0)
+        self.assertEqual(report["service_calls"], len(harness.service_calls))
+        self.assertGreater(report["service_calls"], 0)
+        self.assertEqual(report["rule_outcomes"]["errored"], 0)
+        self.assertGreater(report["stages"]["trigger_evaluated"]["count"], 0)
+        self.assertGreater(report["stages"]["first_service_call"]["count"], 0)
+        self.assertIn("gc_collections", report["allocations"])
+        self.assertNotIn("delivery_lag", report)
+
+        print("The recorded get_states result was applied, without an id")
+        self.assertEqual(
+            harness.engine.states.get_entity_state("input_boolean.is_sleeping").state, "on")
+
+        print("Rule 281340 turned the lights off when input_boolean.is_sleeping turned on")
+        self.assertIn(
+            ("scene", "turn_on", {"entity_id": "scene.all_lights_off"}),
+            [(call["domain"], call["service"], call["service_data"])
+             for call in harness.service_calls])
+
+    def test_recorded_speed(self):
+        def _state(value):
+            return {"entity_id": "input_boolean.is_sleeping", "state": value, "attributes": {},
+                    "last_changed": "2018-10-01T12:00:00+00:00",
+                    "last_updated": "2018-10-01T12:00:00+00:00"}
+        frames = [
+            (0.0, {"type": "auth_ok", "ha_version": "0.80.0"}),
+            (0.0, {"id": 1, "type": "result", "success": True, "result": [_state("off")]}),
+            (0.4, {"id": 2, "type": "event", "event": {
+                "event_type": "state_changed",
+                "data": {"entity_id": "input_boolean.is_sleeping",
+                         "old_state": _state("off"), "new_state": _state("on")},
+                "time_fired": "2018-10-01T12:00:00.400000+00:00"}}),
+        ]
+        harness = replay.ReplayHarness(RULES_DIR, self.loop)
+        report = harness.run(self._write_and_load(frames), speed=2.0, trace_malloc=True)
+        print(replay.format_report(report))
+
+        print("The event was delivered 0.2s in, at twice the recorded speed")
+        self.assertGreaterEqual(report["delivered_secs"], 0.19)
+        self.assertLess(report["delivered_secs"], 0.4)
+        self.assertEqual(report["delivery_lag"]["count"], 3)
+        self.assertEqual(
+            [json.dumps(call["service_data"]) for call in harness.service_calls],
+            ['{"entity_id": "scene.all_lights_off"}'])
+        self.assertGreater(report["allocations"]["peak_bytes"], 0)
+        self.assertTrue(report["allocations"]["top"])
+
+    def test_settle_waits_without_spinning(self):
+        async def _later():
+            await asyncio.sleep(0.1)
+            # A task started by one being waited on is waited on too
+            asyncio.get_event_loop().create_task(asyncio.sleep(0.1))
+
+        async def _run():
+            own_tasks = set([asyncio.current_task()])
+            self.loop.create_task(_later())
+            timed_out = await replay._async_settle(own_tasks, 0.05)
+            settled = await replay._async_settle(own_tasks, 5)
+            return timed_out, settled
+
+        start = time.process_time()
+        wall_start = time.perf_counter()
+        timed_out, settled = self.loop.run_until_complete(_run())
+        wall_secs = time.perf_counter() - wall_start
+        cpu_secs = time.process_time() - start
+        print("Settled in {:.3f}s using {:.3f}s of CPU".format(wall_secs, cpu_secs))
+        self.assertFalse(timed_out)
+        self.assertTrue(settled)
+        self.assertGreaterEqual(wall_secs, 0.19)
+        self.assertLess(cpu_secs, wall_secs / 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,7 +4,7 @@ import logging
 import json
 import unittest
 
-from ottoengine import restapi, utils, state, helpers
+from ottoengine import restapi, utils, state, helpers, enginelog, tracing
 from ottoengine.model.rule_objects import AutomationRule
 
 
@@ -17,6 +17,8 @@ class MockOttoEngine:
         self._hidden_states = state.OttoEngineState()
 
         self._hidden_states.set_engine_state("start_time", helpers.nowutc())
+        self.englog = enginelog.EngineLog()
+        self.tracer = tracing.Tracer()
         
         # Add some rules
         for i in range(1, 6):
@@ -37,6 +39,18 @@ class MockOttoEngine:
     def get_rules_threadsafe(self) -> list:
         return self._hidden_states.get_rules()
 
+    def get_logs_threadsafe(self, **filters) -> list:
+        return self.englog.get_logs(**filters)
+
+    def get_traces_threadsafe(self, **filters) -> list:
+        return self.tracer.get_traces(**filters)
+
+    def get_entities_threadsafe(self) -> list:
+        return [
+            {"entity_id": entity_id, "friendly_name": entity_id, "hidden": False}
+            for entity_id in ["light.den", "light.hall", "switch.fan", "light.hall_2"]
+        ]
+
 
     # def get_state_threadsafe(self, group, key):
     # def get_entity_state_threadsafe(self, entity_id):
@@ -83,13 +97,89 @@ class TestRestAPI(unittest.TestCase):
             self.assertTrue(rule["enabled"])
             self.assertEqual(rule["group"], "unittest")
 
+    def test_route_rules_paged(self):
+        self.eng._hidden_states.add_rule(
+            AutomationRule("00000", "Rule 00000", enabled=False, group="other"))
+        ids = []
+        cursor = ""
+        while cursor is not None:
+            resp = self.app.get("/rest/rules?limit=2&fields=id&cursor=" + cursor).get_json()
+            print(resp)
+            self.assertLessEqual(len(resp["data"]), 2)
+            ids.extend(rule["id"] for rule in resp["data"])
+            cursor = resp["next_cursor"]
+        self.assertEqual(ids, ["00000", "11111", "22222", "33333", "44444", "55555"])
+
+        resp = self.app.get("/rest/rules?group=unittest&enabled=true&fields=id").get_json()
+        self.assertEqual(len(resp["data"]), 5)
+        self.assertNotIn("next_cursor", resp)
+        resp = self.app.get("/rest/rules?enabled=false&fields=id,group").get_json()
+        self.assertEqual(resp["data"], [{"id": "00000", "group": "other"}])
+
+        for args in ["limit=0", "cursor=xyz", "format=xml", "prefix=light.", "enabled=maybe"]:
+            resp = self.app.get("/rest/rules?" + args)
+            print(args, resp.get_json())
+            self.assertEqual(resp.status_code, 400)
 
     # Tests: @app.route('/rest/entities', methods=['GET'])
+    def test_route_entities_ndjson(self):
+        resp = self.app.get("/rest/entities?domain=light&limit=2&format=ndjson")
+        lines = resp.get_data(as_text=True).splitlines()
+        print(resp.headers, lines)
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        self.assertEqual(
+            [json.loads(line)["entity_id"] for line in lines], ["light.den", "light.hall"])
+
+        cursor = resp.headers["X-Next-Cursor"]
+        resp = self.app.get("/rest/entities?domain=light&limit=2&cursor=" + cursor).get_json()
+        self.assertEqual(
+            [entity["entity_id"] for entity in resp["data"]], ["light.hall_2"])
+        self.assertIsNone(resp["next_cursor"])
+
+        resp = self.app.get("/rest/entities?prefix=light.hall").get_json()
+        self.assertEqual(len(resp["data"]), 2)
+
     # Tests: @app.route('/rest/services', methods=['GET'])
     # Tests: @app.route('/rest/rule', methods=['PUT'])
     # Tests: @app.route('/rest/rule/<rule_id>', methods=['GET', 'PUT', 'DELETE'])
     # Tests: @app.route('/rest/clock/check', methods=['PUT'])
     # Tests: @app.route('/rest/logs', methods=['GET'])
+    def test_route_logs(self):
+        for i in range(10):
+            self.eng.englog.add(enginelog.TRIGGER_FIRED, {"i": i}, rule_id="r{}".format(i % 2))
+            self.eng.englog.add(enginelog.DEBUG, {"i": i})
+
+        resp = self.app.get("/rest/logs?type=trigger_fired&rule=r1&since=5&limit=2").get_json()
+        print(resp)
+        self.assertEqual([log["entry"]["i"] for log in resp["data"]], [3, 5])
+        resp = self.app.get(
+            "/rest/logs?type=trigger_fired&rule=r1&limit=2&cursor=" + resp["next_cursor"])
+        resp = resp.get_json()
+        self.assertEqual([log["entry"]["i"] for log in resp["data"]], [7, 9])
+        self.assertIsNone(resp["next_cursor"])
+        self.assertEqual(len(self.app.get("/rest/logs").get_json()["data"]), 20)
+        self.assertEqual(self.app.get("/rest/logs?since=x").status_code, 400)
+
+    # Tests: @app.route('/rest/traces', methods=['GET'])
+    # Tests: @app.route('/rest/traces/chrome', methods=['GET'])
+    def test_route_traces(self):
+        for i in range(5):
+            root = self.eng.tracer.start_trace(event_type="test")
+            root.finish(keep=False)
+            root.child(tracing.RULE, rule="r{}".format(i % 2)).finish()
+
+        resp = self.app.get("/rest/traces?rule=r0&limit=2").get_json()
+        print(resp)
+        self.assertEqual([trace["trace_id"] for trace in resp["data"]], [1, 3])
+        resp = self.app.get("/rest/traces?rule=r0&limit=2&cursor=" + resp["next_cursor"])
+        self.assertEqual([trace["trace_id"] for trace in resp.get_json()["data"]], [5])
+
+        resp = self.app.get("/rest/traces/chrome?since=3").get_json()
+        self.assertEqual(
+            [event["name"] for event in resp["traceEvents"]],
+            ["event test", "rule r1", "event test", "rule r0"])
+        self.assertEqual(self.app.get("/rest/traces?type=x").status_code, 400)
+
 
     # Not covered:
     # @app.route('/shutdown', methods=['GET'])
@@ -19,11 +19,16 @@ setup_debug_logging()
 class MockWebSocketClient():
     def __init__(self):
         self.service_calls = []
+        self.success = True     # The result Home Assistant sends for each service call
 
     async def async_call_service(self, service_call_info):
         print("Websocket async_call_service called with: {}".format(
             service_call_info.serialize()))
         self.service_calls.append(service_call_info)
+        return {
+            "id": len(self.service_calls), "type": "result", "success": self.success,
+            "result": None
+        }
 
     def clear(self):
         self.service_calls = []
@@ -151,6 +156,56 @@ class TestRuleProcessing(unittest.TestCase):
         self._verify_websocket_service_call(0, "scene.all_lights_off", "turn_on")
         self.engine_obj._websocket.clear()
 
+    def test_failed_service_call_aborts_sequence(self):
+        self._setup_engine()
+        result = self.engine_obj._persistence_mgr.rule_from_dict({
+            "id": "two_calls",
+            "triggers": [{"platform": "state", "entity_id": "input_boolean.test"}],
+            "actions": [{"action_sequence": [
+                {"domain": "light", "service": "turn_on", "data": {"entity_id": "light.a"}},
+                {"domain": "light", "service": "turn_on", "data": {"entity_id": "light.b"}}
+            ]}]
+        })
+        rule = result.get("rule")
+
+        print("Both calls run when Home Assistant reports success")
+        self.loop.run_until_complete(engine.async_invoke_rule(self.engine_obj, rule))
+        self.assertEqual(len(self.engine_obj._websocket.service_calls), 2)
+        self.engine_obj._websocket.clear()
+
+        print("A failed call stops the sequence")
+        self.engine_obj._websocket.success = False
+        self.loop.run_until_complete(engine.async_invoke_rule(self.engine_obj, rule))
+        self.assertEqual(len(self.engine_obj._websocket.service_calls), 1)
+        self.assertEqual(self.enlog.get_logs()[-1]["type"], enginelog.ERROR)
+
+    def test_batched_sequence_runs_in_order(self):
+        cfg = config.EngineConfig()
+        cfg.service_batch_window_ms = 5
+        self._setup_engine(config_obj=cfg)
+        result = self.engine_obj._persistence_mgr.rule_from_dict({
+            "id": "on_then_dim",
+            "triggers": [{"platform": "state", "entity_id": "input_boolean.test"}],
+            "actions": [{"action_sequence": [
+                {"domain": "light", "service": "turn_on", "data": {"entity_id": "light.a"}},
+                {"domain": "light", "service": "turn_on",
+                 "data": {"entity_id": "light.a", "brightness": 50}}
+            ]}]
+        })
+        rule = result.get("rule")
+
+        print("The dispatcher gets each call after the one before it succeeded")
+        self.loop.run_until_complete(engine.async_invoke_rule(self.engine_obj, rule))
+        self.assertEqual(
+            [call.service_data for call in self.engine_obj._websocket.service_calls],
+            [{"entity_id": "light.a"}, {"entity_id": "light.a", "brightness": 50}])
+        self.engine_obj._websocket.clear()
+
+        print("A failed call stops the sequence")
+        self.engine_obj._websocket.success = False
+        self.loop.run_until_complete(engine.async_invoke_rule(self.engine_obj, rule))
+        self.assertEqual(len(self.engine_obj._websocket.service_calls), 1)
+
     def test_action_condition(self):
         rule_id = "action_condition"
         cfg = config.EngineConfig()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+import asyncio
+import unittest
+
+from ottoengine import engine, service_dispatcher
+from ottoengine.model import dataobjects
+from ottoengine.testing import engine_helpers
+
+
+def _call(domain, service, entity_id=None, **data):
+    if entity_id is not None:
+        data["entity_id"] = entity_id
+    return dataobjects.ServiceCall(domain, service, data)
+
+
+class TestServiceCallDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        print()
+        self.loop = asyncio.get_event_loop()
+        self.websocket = engine_helpers.RecordingWebsocket()
+        self.dispatcher = service_dispatcher.ServiceCallDispatcher(
+            self.websocket.async_call_service, 0.005, max_calls=50)
+
+    def _dispatch(self, service_calls):
+        """Makes the calls concurrently and returns their results"""
+        async def _run():
+            return await asyncio.gather(
+                *[self.dispatcher.async_call(service_call) for service_call in service_calls])
+        results = self.loop.run_until_complete(_run())
+        for service_call in self.websocket.service_calls:
+            print(service_call.serialize())
+        return results
+
+    def _sent(self):
+        return [(call.domain, call.service, call.service_data)
+                for call in self.websocket.service_calls]
+
+    def test_merge_identical_requests(self):
+        calls = [_call("light", "turn_off", "light.l{}".format(i)) for i in range(20)]
+        calls.append(_call("light", "turn_on", "light.hall", brightness=100))
+        calls.append(_call("light", "turn_on", "light.den, light.porch", brightness=100))
+        calls.append(_call("light", "turn_on", "light.attic", brightness=50))
+        results = self._dispatch(calls)
+
+        self.assertEqual(self._sent(), [
+            ("light", "turn_off", {"entity_id": ["light.l{}".format(i) for i in range(20)]}),
+            ("light", "turn_on", {
+                "brightness": 100, "entity_id": ["light.hall", "light.den", "light.porch"]}),
+            ("light", "turn_on", {"brightness": 50, "entity_id": "light.attic"}),
+        ])
+        self.assertTrue(all(result["success"] for result in results))
+        stats = self.dispatcher.get_stats()
+        print(stats)
+        self.assertEqual(stats["calls_received"], 23)
+        self.assertEqual(stats["calls_sent"], 3)
+
+    def test_last_conflicting_request_wins(self):
+        results = self._dispatch([
+            _call("light", "turn_on", "light.a"),
+            _call("light", "turn_on", ["light.b", "light.c"]),
+            _call("light", "fail", "light.d"),
+            _call("light", "turn_off", "light.a"),
+            _call("light", "fail", "light.d"),
+        ])
+        self.assertEqual(self._sent(), [
+            ("light", "turn_on", {"entity_id": ["light.b", "light.c"]}),
+            ("light", "fail", {"entity_id": "light.d"}),
+            ("light", "turn_off", {"entity_id": "light.a"}),
+            ("light", "fail", {"entity_id": "light.d"}),
+        ])
+
+        print("Callers whose request was superseded get the result of the one that won")
+        self.assertEqual(
+            [result["success"] for result in results], [True, True, False, True, False])
+
+    def test_different_data_is_not_replaced(self):
+        self._dispatch([
+            _call("light", "turn_on", "light.a", brightness=50),
+            _call("light", "turn_on", "light.a", rgb_color=[255, 0, 0]),
+            _call("light", "turn_on", "light.a", rgb_color=[255, 0, 0]),
+        ])
+        print("Only the repeated rgb_color call is dropped; the brightness is kept")
+        self.assertEqual(self._sent(), [
+            ("light", "turn_on", {"brightness": 50, "entity_id": "light.a"}),
+            ("light", "turn_on", {"rgb_color": [255, 0, 0], "entity_id": "light.a"}),
+        ])
+
+    def test_repeated_calls_without_data_are_all_sent(self):
+        results = self._dispatch([
+            _call("media_player", "volume_up", "media_player.den"),
+            _call("input_number", "increment", "input_number.count"),
+            _call("media_player", "volume_up", "media_player.den"),
+            _call("input_number", "increment", "input_number.count"),
+            _call("media_player", "volume_up", "media_player.kitchen"),
+        ])
+        self.assertEqual(self._sent(), [
+            ("media_player", "volume_up", {"entity_id": "media_player.den"}),
+            ("input_number", "increment", {"entity_id": "input_number.count"}),
+            ("media_player", "volume_up",
+             {"entity_id": ["media_player.den", "media_player.kitchen"]}),
+            ("input_number", "increment", {"entity_id": "input_number.count"}),
+        ])
+        self.assertTrue(all(result["success"] for result in results))
+
+    def test_order_kept_for_other_requests(self):
+        self._dispatch([
+            _call("media_player", "volume_set", "media_player.den", volume_level=0.5),
+            _call("media_player", "media_play", "media_player.den"),
+            _call("media_player", "volume_set", "media_player.den", volume_level=0.5),
+            _call("notify", "notify", message="one"),
+            _call("notify", "notify", message="one"),
+        ])
+        self.assertEqual(self._sent(), [
+            ("media_player", "media_play", {"entity_id": "media_player.den"}),
+            ("media_player", "volume_set", {"volume_level": 0.5, "entity_id": "media_player.den"}),
+            ("notify", "notify", {"message": "one"}),
+            ("notify", "notify", {"message": "one"}),
+        ])
+
+    def test_max_calls_sends_early(self):
+        dispatcher = service_dispatcher.ServiceCallDispatcher(
+            self.websocket.async_call_service, 60, max_calls=10)
+
+        async def _run():
+            return await asyncio.gather(*[
+                dispatcher.async_call(_call("light", "turn_off", "light.l{}".format(i)))
+                for i in range(10)])
+
+        # Would take a minute if the window had to end first
+        self.loop.run_until_complete(asyncio.wait_for(_run(), 1))
+        self.assertEqual(len(self.websocket.service_calls), 1)
+
+
+class TestBatchedRule(unittest.TestCase):
+
+    def setUp(self):
+        print()
+        self.loop = asyncio.get_event_loop()
+        self.websocket = engine_helpers.RecordingWebsocket()
+        self.engine_obj = engine_helpers.setup_engine(
+            self, self.websocket, service_batch_window_ms=5)
+
+    def test_sequence_of_service_actions(self):
+        sequence = [
+            {"domain": "light", "service": "turn_off", "data": {"entity_id": "light.l{}".format(i)}}
+            for i in range(20)
+        ]
+        sequence.append({"log_message": "lights off"})
+        sequence.append({"domain": "light", "service": "fail", "data": {"entity_id": "light.x"}})
+        sequence.append({"domain": "light", "service": "turn_on", "data": {"entity_id": "light.y"}})
+        result = self.engine_obj._persistence_mgr.rule_from_dict({
+            "id": "all_off",
+            "triggers": [{"platform": "state", "entity_id": "input_boolean.test"}],
+            "actions": [{"action_sequence": sequence}]
+        })
+        self.assertTrue(result.get("success"), msg=result)
+
+        self.loop.run_until_complete(
+            engine.async_invoke_rule(self.engine_obj, result.get("rule")))
+        for service_call in self.websocket.service_calls:
+            print(service_call.serialize())
+
+        print("The 20 turn_off actions go out as one call; the failed call ends the sequence")
+        self.assertEqual(len(self.websocket.service_calls), 2)
+        self.assertEqual(len(self.websocket.service_calls[0].service_data["entity_id"]), 20)
+        self.assertEqual(self.websocket.service_calls[1].service, "fail")
+
+
+if __name__ == "__main__":
+    unittest.main()
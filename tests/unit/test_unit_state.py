@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+import threading
+import unittest
+
+from ottoengine import state
+from ottoengine.model import dataobjects
+
+
+def _entity(entity_id, state_value):
+    return dataobjects.EntityState(entity_id, state_value, {}, None)
+
+
+class TestEntityStateSnapshots(unittest.TestCase):
+
+    def setUp(self):
+        print()
+        self.states = state.OttoEngineState()
+
+    def test_snapshot_is_not_changed_by_later_writes(self):
+        for i in range(200):
+            self.states.set_entity_state("sensor.s{}".format(i), _entity("sensor.s{}".format(i), i))
+        before = self.states.snapshot()
+
+        self.states.set_entity_state("sensor.s0", _entity("sensor.s0", "changed"))
+        self.states.set_entity_state("sensor.new", _entity("sensor.new", "new"))
+        after = self.states.snapshot()
+
+        self.assertEqual(len(before), 200)
+        self.assertEqual(before["sensor.s0"].state, 0)
+        self.assertNotIn("sensor.new", before)
+        self.assertEqual(len(after), 201)
+        self.assertEqual(after["sensor.s0"].state, "changed")
+        self.assertEqual(after.get("sensor.new").state, "new")
+        self.assertIsNone(after.get("sensor.missing"))
+        self.assertEqual(after.version, before.version + 2)
+        self.assertEqual(set(after), set(before) | {"sensor.new"})
+
+        # Unchanged entities are shared between snapshots, not copied
+        self.assertIs(after["sensor.s1"], before["sensor.s1"])
+
+    def test_batch_update_publishes_once(self):
+        version = self.states.snapshot().version
+        with self.states.batch_update():
+            for i in range(10):
+                self.states.set_entity_state("sensor.s{}".format(i), _entity("sensor.s", i))
+            self.assertEqual(len(self.states.snapshot()), 0)
+        self.assertEqual(self.states.snapshot().version, version + 1)
+        self.assertEqual(len(self.states.snapshot()), 10)
+        self.assertEqual(len(self.states.get_entities()), 10)
+
+    def test_snapshots_are_consistent_across_threads(self):
+        """Every snapshot a reader sees has the entities written so far, all with one value"""
+        num_entities = 500
+        errors = []
+        done = threading.Event()
+
+        def _reader():
+            while not done.is_set():
+                snapshot = self.states.snapshot()
+                values = {entity.state for entity in snapshot.values()}
+                if len(snapshot) not in (0, num_entities) or len(values) > 1:
+                    errors.append((len(snapshot), values))
+
+        reader = threading.Thread(target=_reader)
+        reader.start()
+        try:
+            for round_num in range(20):
+                with self.states.batch_update():
+                    for i in range(num_entities):
+                        entity_id = "sensor.s{}".format(i)
+                        self.states.set_entity_state(entity_id, _entity(entity_id, round_num))
+        finally:
+            done.set()
+            reader.join()
+        self.assertEqual(errors, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+import asyncio
+import tempfile
+import unittest
+
+from ottoengine import persistence, subscriptions
+from ottoengine.fibers import hass_websocket_reader
+from ottoengine.testing import engine_helpers, websocket_helpers
+
+
+def _rule_dict(rule_id, trigger, rule_condition=None, action_condition=None):
+    rule_dict = {
+        "id": rule_id,
+        "triggers": [trigger],
+        "actions": [{"action_sequence": [
+            {"condition": "state", "entity_id": "input_boolean.sequence", "state": "on"},
+            {"log_message": rule_id}
+        ]}]
+    }
+    if rule_condition:
+        rule_dict["rule_condition"] = rule_condition
+    if action_condition:
+        rule_dict["actions"][0]["action_condition"] = action_condition
+    return rule_dict
+
+
+class TestRuleSubscriptions(unittest.TestCase):
+
+    def setUp(self):
+        print()
+        self.persist_mgr = persistence.PersistenceManager(tempfile.gettempdir())
+
+    def _rule(self, rule_dict):
+        result = self.persist_mgr.rule_from_dict(rule_dict)
+        self.assertTrue(result.get("success"), msg=result)
+        return result.get("rule")
+
+    def test_rule_needs(self):
+        rule = self._rule(_rule_dict(
+            "r1",
+            {"platform": "state", "entity_id": "light.hall", "to": "on"},
+            rule_condition={"condition": "or", "conditions": [
+                {"condition": "state", "entity_id": "input_boolean.home", "state": "on"},
+                {"condition": "numeric_state", "entity_id": "sensor.lux", "below_value": 10},
+                {"condition": "zone", "entity_id": "device_tracker.paulus", "zone": "zone.home"}
+            ]},
+            action_condition={"condition": "state", "entity_id": "input_boolean.away",
+                              "state": "off"}
+        ))
+        entity_ids, event_types = subscriptions.get_rule_needs(rule)
+        print(entity_ids, event_types)
+        self.assertEqual(entity_ids, {
+            "light.hall", "input_boolean.home", "sensor.lux", "device_tracker.paulus",
+            "input_boolean.away", "input_boolean.sequence"})
+        self.assertEqual(event_types, set())
+
+        rule = self._rule(_rule_dict(
+            "r2", {"platform": "event", "event_type": "zwave.scene_activated", "event_data": {}}))
+        self.assertEqual(
+            subscriptions.get_rule_needs(rule),
+            ({"input_boolean.sequence"}, {"zwave.scene_activated"}))
+
+    def test_reference_counts(self):
+        subs = subscriptions.RuleSubscriptions(subscriptions.MODE_FILTERED)
+        subs.add_rule(self._rule(_rule_dict(
+            "r1", {"platform": "state", "entity_id": "light.hall"})))
+        subs.add_rule(self._rule(_rule_dict(
+            "r2", {"platform": "state", "entity_id": "light.hall"})))
+        subs.add_rule(self._rule(_rule_dict(
+            "r3", {"platform": "event", "event_type": "timer_ended", "event_data": {}})))
+        self.assertEqual(
+            subs.get_entity_ids(), {"light.hall", "input_boolean.sequence"})
+        self.assertEqual(subs.get_event_types(), {"timer_ended"})
+
+        subs.remove_rule("r1")
+        self.assertIn("light.hall", subs.get_entity_ids())
+        subs.remove_rule("r2")
+        subs.remove_rule("r2")  # Removing twice is a no-op
+        self.assertNotIn("light.hall", subs.get_entity_ids())
+        self.assertEqual(subs.get_entity_ids(), {"input_boolean.sequence"})
+        print(subs.get_stats())
+        self.assertEqual(subs.get_stats()["rules"], 1)
+
+    def test_mode_all(self):
+        subs = subscriptions.RuleSubscriptions()
+        subs.add_rule(self._rule(_rule_dict(
+            "r1", {"platform": "state", "entity_id": "light.hall"})))
+        self.assertEqual(subs.get_entity_ids(), set())
+        self.assertEqual(subs.get_event_types(), {"state_changed"})
+        with self.assertRaises(ValueError):
+            subscriptions.RuleSubscriptions("some")
+
+
+class TestEngineSubscriptions(unittest.TestCase):
+
+    def setUp(self):
+        print()
+        self.loop = asyncio.get_event_loop()
+        self.websocket = engine_helpers.RecordingWebsocket()
+        self.engine_obj = engine_helpers.setup_engine(
+            self, self.websocket, subscription_mode=subscriptions.MODE_FILTERED)
+
+    def _save(self, rule_dict):
+        result = self.loop.run_until_complete(self.engine_obj._async_save_rule(rule_dict))
+        self.assertTrue(result.get("success"), msg=result)
+
+    def test_incremental_updates(self):
+        self._save(_rule_dict("r1", {"platform": "state", "entity_id": "light.hall"}))
+        print(self.websocket.sent)
+        self.assertEqual(sorted(sent[:2] for sent in self.websocket.sent), [
+            ("subscribe_trigger", "input_boolean.sequence"),
+            ("subscribe_trigger", "light.hall"),
+        ])
+
+        print("Changing the trigger only swaps that entity's subscription")
+        hall_id = [sent[2] for sent in self.websocket.sent if sent[1] == "light.hall"][0]
+        self.websocket.sent = []
+        self._save(_rule_dict("r1", {"platform": "state", "entity_id": "light.porch"}))
+        print(self.websocket.sent)
+        self.assertEqual(self.websocket.sent, [
+            ("unsubscribe_events", hall_id),
+            ("subscribe_trigger", "light.porch", 3),
+        ])
+
+        print("An event trigger subscribes to just its event type")
+        self.websocket.sent = []
+        self._save(_rule_dict(
+            "r2", {"platform": "event", "event_type": "zwave.scene_activated",
+                   "event_data": {}}))
+        self.assertEqual(self.websocket.sent, [
+            ("subscribe_events", "zwave.scene_activated", 4),
+        ])
+
+        print("Deleting the rules unsubscribes from everything")
+        self.websocket.sent = []
+        self.loop.run_until_complete(self.engine_obj._async_delete_rule("r1"))
+        self.loop.run_until_complete(self.engine_obj._async_delete_rule("r2"))
+        self.assertEqual(
+            sorted(sent[0] for sent in self.websocket.sent), ["unsubscribe_events"] * 3)
+        self.assertEqual(self.engine_obj._subscription_ids, {})
+
+    def test_trigger_event(self):
+        state_msg = websocket_helpers.event_state_changed(1, "light.hall", "off", "on")
+        data = state_msg["event"]["data"]
+        trigger_event = {"variables": {"trigger": {
+            "platform": "state", "entity_id": "light.hall",
+            "from_state": data["old_state"], "to_state": data["new_state"]
+        }}}
+        event_obj = hass_websocket_reader._trigger_to_state_changed(trigger_event)
+        self.assertEqual(event_obj["event_type"], "state_changed")
+        self.assertEqual(event_obj["data"]["new_state"]["state"], "on")
+
+        msg = {"id": 1, "type": "event", "event": trigger_event}
+        self.loop.run_until_complete(
+            hass_websocket_reader._process_event_response(self.engine_obj, msg))
+        self.assertEqual(self.engine_obj.states.get_entity_state("light.hall").state, "on")
+
+        print("Entities that were added or removed have no from_state or to_state")
+        trigger_event["variables"]["trigger"]["from_state"] = None
+        self.assertIsNone(hass_websocket_reader._trigger_to_state_changed(trigger_event))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+import asyncio
+import datetime
+import json
+import unittest
+
+from ottoengine import config, hass_websocket_client, helpers, tracing
+from ottoengine.fibers import hass_websocket_reader
+from ottoengine.testing import engine_helpers
+
+
+class _AnsweringSocket(object):
+    """Stands in for the asyncws websocket, answering each request with a success result"""
+
+    def __init__(self, websocket):
+        self._websocket = websocket
+        self.sent = []
+
+    async def send(self, frame):
+        request = json.loads(frame)
+        self.sent.append(request)
+        asyncio.get_event_loop().call_soon(self._websocket.resolve_result, {
+            "id": request["id"], "type": "result", "success": True, "result": None})
+
+    def close(self):
+        pass
+
+
+def _state_changed(entity_id, old, new, fired_ago_secs=0.05):
+    time_fired = (
+        helpers.nowutc() - datetime.timedelta(seconds=fired_ago_secs)).isoformat()
+
+    def _state(value):
+        return {
+            "entity_id": entity_id, "state": value, "attributes": {},
+            "last_changed": time_fired, "last_updated": time_fired}
+    return {
+        "type": "event",
+        "event": {
+            "event_type": "state_changed",
+            "data": {"entity_id": entity_id, "old_state": _state(old), "new_state": _state(new)},
+            "time_fired": time_fired,
+        }
+    }
+
+
+class TestTracing(unittest.TestCase):
+
+    def setUp(self):
+        print()
+        self.loop = asyncio.get_event_loop()
+
+    def _engine(self, **settings):
+        websocket = hass_websocket_client.AsyncHassWebsocket("localhost", 8123)
+        websocket._socket = _AnsweringSocket(websocket)
+        settings.setdefault("trace_spans", tracing.DEFAULT_MAX_SPANS)
+        return engine_helpers.setup_engine(self, websocket, **settings)
+
+    def _load_rule(self, engine_obj, rule_id, light):
+        result = engine_obj._persistence_mgr.rule_from_dict({
+            "id": rule_id,
+            "triggers": [{"platform": "state", "entity_id": "switch.button", "to": "on"}],
+            "actions": [{"action_sequence": [
+                {"log_message": "pressed"},
+                {"domain": "light", "service": "turn_on", "data": {"entity_id": light}},
+            ]}]
+        })
+        self.assertTrue(result.get("success"), msg=result)
+        self.loop.run_until_complete(engine_obj._async_load_rule(result.get("rule")))
+
+    def _receive(self, engine_obj, msg):
+        async def _run():
+            await hass_websocket_reader._process_event_response(
+                engine_obj, msg, received=None)
+            # Let the rules run and their service calls get answered
+            await asyncio.sleep(0.02)
+        self.loop.run_until_complete(_run())
+
+    def test_event_to_service_call(self):
+        engine_obj = self._engine()
+        self._load_rule(engine_obj, "hall", "light.hall")
+
+        self._receive(engine_obj, _state_changed("switch.button", "off", "on"))
+        print("Events whose rules' triggers don't pass are not kept")
+        self._receive(engine_obj, _state_changed("switch.button", "on", "off"))
+        self._receive(engine_obj, _state_changed("switch.other", "off", "on"))
+
+        traces = engine_obj.get_traces()
+        print(json.dumps(traces, indent=2, default=str))
+        self.assertEqual(len(traces), 1)
+        trace = traces[0]
+        self.assertEqual(
+            [(span["name"], span["attrs"].get("rule") or span["attrs"].get("action"))
+             for span in trace["spans"]],
+            [(tracing.TRANSIT, None), (tracing.EVENT, None), (tracing.RULE, "hall"),
+             (tracing.ACTION, "LogAction"), (tracing.ACTION, "ServiceAction"),
+             (tracing.SERVICE_CALL, None)])
+
+        spans = {span["name"]: span for span in trace["spans"]}
+        self.assertEqual(spans[tracing.EVENT]["attrs"]["entity_id"], "switch.button")
+        self.assertEqual(spans[tracing.RULE]["attrs"]["outcome"], "completed")
+        self.assertEqual(spans[tracing.RULE]["parent_id"], spans[tracing.EVENT]["span_id"])
+        self.assertEqual(spans[tracing.SERVICE_CALL]["attrs"]["written"], True)
+        self.assertEqual(spans[tracing.SERVICE_CALL]["attrs"]["service"], "light.turn_on")
+        self.assertGreaterEqual(trace["fired_to_received_secs"], 0.05)
+        self.assertGreaterEqual(
+            trace["fired_to_first_call_secs"], trace["fired_to_received_secs"])
+
+        stats = engine_obj.get_stats()["tracer"]
+        print(stats)
+        self.assertEqual(stats["traces_started"], 3)
+        self.assertEqual(stats["traces_kept"], 1)
+
+        self.assertEqual(engine_obj.get_traces(rule_id="hall"), traces)
+        self.assertEqual(engine_obj.get_traces(rule_id="other"), [])
+        self.assertEqual(engine_obj.get_traces(since=trace["trace_id"]), [])
+
+    def test_merged_service_calls(self):
+        engine_obj = self._engine(service_batch_window_ms=5)
+        self._load_rule(engine_obj, "hall", "light.hall")
+        self._load_rule(engine_obj, "porch", "light.porch")
+        self._receive(engine_obj, _state_changed("switch.button", "off", "on"))
+
+        print("Both rules' calls went out as one, which ended both service_call spans")
+        self.assertEqual(len(engine_obj._websocket._socket.sent), 1)
+        spans = engine_obj.get_traces()[0]["spans"]
+        calls = [span for span in spans if span["name"] == tracing.SERVICE_CALL]
+        self.assertEqual(len(calls), 2)
+        self.assertTrue(all(span["attrs"]["written"] for span in calls))
+
+    def test_failed_send_ends_span(self):
+        engine_obj = self._engine()
+        self._load_rule(engine_obj, "hall", "light.hall")
+
+        async def _send(frame):
+            raise ConnectionError("connection lost")
+        engine_obj._websocket._socket.send = _send
+        self._receive(engine_obj, _state_changed("switch.button", "off", "on"))
+
+        print("The service_call span ended even though the call raised")
+        spans = {span["name"]: span for span in engine_obj.get_traces()[0]["spans"]}
+        self.assertEqual(spans[tracing.SERVICE_CALL]["attrs"]["written"], False)
+        self.assertEqual(spans[tracing.RULE]["attrs"]["outcome"], "errored")
+
+    def test_tracing_off(self):
+        print("Tracing is off unless TRACE_SPANS is set")
+        self.assertEqual(config.EngineConfig().trace_spans, 0)
+        engine_obj = self._engine(trace_spans=0)
+        self._load_rule(engine_obj, "hall", "light.hall")
+        self._receive(engine_obj, _state_changed("switch.button", "off", "on"))
+        self.assertEqual(len(engine_obj._websocket._socket.sent), 1)
+        self.assertIsNone(engine_obj.tracer)
+        self.assertEqual(engine_obj.get_traces(), [])
+
+    def test_buffer_and_chrome_trace(self):
+        tracer = tracing.Tracer(max_spans=5)
+        for i in range(3):
+            root = tracer.start_trace(time_fired="2018-10-01T12:00:00+00:00", event_type="e")
+            root.finish(keep=False)
+            rule = root.child(tracing.RULE, rule="r{}".format(i))
+            rule.child(tracing.ACTION, action="LogAction").finish()
+            rule.finish()
+
+        print("The oldest spans were dropped to keep 5")
+        self.assertEqual(tracer.get_stats()["spans"], 5)
+        traces = tracer.get_traces()
+        self.assertEqual([trace["trace_id"] for trace in traces], [2, 3])
+        print("A span is added when it ends, so trace 2's action (ended first) is gone")
+        self.assertEqual(
+            [span["name"] for span in traces[0]["spans"]],
+            [tracing.TRANSIT, tracing.EVENT, tracing.RULE])
+        self.assertEqual(len(traces[1]["spans"]), 4)
+
+        chrome = tracing.to_chrome_trace(traces)
+        print(json.dumps(chrome["traceEvents"][-4:], indent=2))
+        events = chrome["traceEvents"]
+        self.assertEqual(len(events), 7)
+        self.assertTrue(all(event["ph"] == "X" and event["dur"] >= 0 for event in events))
+        self.assertEqual(
+            [event["name"] for event in events if event["tid"] == 3],
+            ["hass_to_otto", "event e", "rule r2", "action LogAction"])
+        json.dumps(chrome)
+
+
+if __name__ == "__main__":
+    unittest.main()
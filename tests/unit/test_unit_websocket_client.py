@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+import asyncio
+import json
+import unittest
+
+from ottoengine import hass_websocket_client, histogram
+from ottoengine.model import dataobjects
+
+
+class _RecordingSocket(object):
+    """Stands in for the asyncws websocket, recording the frames sent"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, frame):
+        self.sent.append(json.loads(frame))
+
+    def close(self):
+        pass
+
+
+def _result(request_id, success=True):
+    return {"id": request_id, "type": "result", "success": success, "result": None}
+
+
+class TestAsyncHassWebsocket(unittest.TestCase):
+
+    def setUp(self):
+        print()
+        self.loop = asyncio.get_event_loop()
+        self.websocket = hass_websocket_client.AsyncHassWebsocket(
+            "localhost", 8123, request_timeout=0.05)
+        self.socket = _RecordingSocket()
+        self.websocket._socket = self.socket
+
+    def test_pipelined_service_calls(self):
+        calls = [
+            dataobjects.ServiceCall("light", "turn_on", {"entity_id": "light.l{}".format(i)})
+            for i in range(3)
+        ]
+
+        async def _run():
+            tasks = [
+                self.loop.create_task(self.websocket.async_call_service(call)) for call in calls
+            ]
+            await asyncio.sleep(0)
+
+            print("All three calls are sent before any result arrives")
+            self.assertEqual([frame["id"] for frame in self.socket.sent], [1, 2, 3])
+            self.assertEqual(self.websocket.get_rtt_stats()["pending"], 3)
+
+            # Results may come back in any order
+            for request_id, success in [(3, True), (1, False), (2, True)]:
+                self.assertEqual(
+                    self.websocket.resolve_result(_result(request_id, success)), "call_service")
+            return await asyncio.gather(*tasks)
+
+        results = self.loop.run_until_complete(_run())
+        self.assertEqual([result["success"] for result in results], [False, True, True])
+
+        stats = self.websocket.get_rtt_stats()
+        print(stats)
+        self.assertEqual(stats["pending"], 0)
+        self.assertEqual(stats["requests"]["call_service"]["count"], 3)
+
+    def test_unknown_result(self):
+        self.assertIsNone(self.websocket.resolve_result(_result(42)))
+
+    def test_timeout(self):
+        call = dataobjects.ServiceCall("light", "turn_on", {})
+        with self.assertRaises(hass_websocket_client.WebSocketError):
+            self.loop.run_until_complete(self.websocket.async_call_service(call))
+        self.assertEqual(self.websocket.get_rtt_stats()["pending"], 0)
+
+        print("A late result is ignored")
+        self.assertIsNone(self.websocket.resolve_result(_result(1)))
+
+    def test_close_fails_pending(self):
+        async def _run():
+            task = self.loop.create_task(self.websocket.async_call_service(
+                dataobjects.ServiceCall("light", "turn_on", {})))
+            await self.websocket.async_subscribe_events("state_changed")
+            await asyncio.sleep(0)
+            await self.websocket.async_close()
+            return await task
+
+        with self.assertRaises(hass_websocket_client.WebSocketError):
+            self.loop.run_until_complete(_run())
+        self.assertEqual(self.websocket.get_rtt_stats()["pending"], 0)
+
+
+class TestLatencyHistogram(unittest.TestCase):
+
+    def setUp(self):
+        print()
+
+    def test_percentiles(self):
+        hist = histogram.LatencyHistogram()
+        self.assertIsNone(hist.percentile(50))
+        for i in range(99):
+            hist.record(0.002)
+        hist.record(3.0)
+
+        stats = hist.get_stats()
+        print(stats)
+        self.assertEqual(stats["count"], 100)
+        self.assertEqual(stats["p50_secs"], 0.0025)
+        self.assertEqual(stats["p99_secs"], 0.0025)
+        self.assertEqual(hist.percentile(100), 3.0)
+        self.assertEqual(stats["buckets"], [[0.0025, 99], [5.0, 1]])
+
+    def test_unbounded_bucket(self):
+        hist = histogram.LatencyHistogram(bounds=(0.1,))
+        hist.record(0.05)
+        hist.record(30.0)
+        self.assertEqual(hist.get_buckets(), [(0.1, 1), (None, 1)])
+        self.assertEqual(hist.percentile(99), 30.0)
+
+
+if __name__ == "__main__":
+    unittest.main()